@@ -0,0 +1,348 @@
+"""
+CPU micro-benchmarks of the hot paths of the app: transformer steps, tiled VAE encode / decode, video writing, RIFE
+interpolation and frame preprocessing. The models are miniature versions of the real ones with random weights, so no
+checkpoint or network access is needed and the results of two runs on the same machine can be compared.
+
+    python benchmark.py                                 # runs all the benchmarks, results saved in benchmark_results.json
+    python benchmark.py --only wan_vae --repeat 10      # benchmarks whose name contains one of the given strings
+    python benchmark.py --save-baseline baseline.json   # stores the results as a baseline
+    python benchmark.py --baseline baseline.json        # compares with a baseline, exit code 1 if a benchmark got slower
+    python benchmark.py --trace trace.json              # also exports a Chrome trace of the runs
+"""
+import os
+# the benchmarks measure the cpu code paths, a gpu must not be picked up by the helpers that use one when available
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import atexit
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+import numpy as np
+import torch
+
+from wan.utils.profiler import profiler
+
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    # a benchmark is a function building its inputs and returning the callable to time
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def get_pipeline():
+    # the models only read the interrupt flag of the pipeline that calls them
+    return types.SimpleNamespace(_interrupt = False)
+
+
+@benchmark("wan_transformer_step")
+def bench_wan_transformer_step():
+    from wan.modules.model import WanModel
+    from wan.modules.posemb_layers import get_rotary_pos_embed
+    # head dim of 128 as the rope tables are built for it
+    model = WanModel(model_type = "t2v", text_len = 64, in_dim = 16, dim = 256, ffn_dim = 1024, freq_dim = 256, text_dim = 128, out_dim = 16, num_heads = 2, num_layers = 2)
+    model.eval().requires_grad_(False)
+    model.enable_cache = None
+    latent_shape = (16, 5, 24, 24)
+    latents = torch.randn(1, *latent_shape)
+    context = torch.randn(1, 64, 128)
+    context_null = torch.randn(1, 64, 128)
+    freqs = get_rotary_pos_embed(latent_shape[1:])
+    pipeline = get_pipeline()
+
+    def run():
+        # conditional and unconditional passes done jointly, as with cfg
+        return model(x = [latents, latents], t = torch.tensor([999.]), context = [context, context_null], freqs = freqs, pipeline = pipeline)
+    return run
+
+
+def get_wan_vae():
+    from wan.modules.vae import WanVAE_
+    model = WanVAE_(dim = 32, z_dim = 16, dim_mult = [1, 2, 4, 4], num_res_blocks = 1, attn_scales = [], temperal_downsample = [False, True, True])
+    return model.eval().requires_grad_(False)
+
+
+@benchmark("wan_vae_encode_tiled")
+def bench_wan_vae_encode_tiled():
+    model = get_wan_vae()
+    video = torch.rand(1, 3, 9, 256, 256) * 2 - 1
+    return lambda: model.spatial_tiled_encode(video, [0., 1.], 128)
+
+
+@benchmark("wan_vae_decode_tiled")
+def bench_wan_vae_decode_tiled():
+    model = get_wan_vae()
+    latents = torch.randn(1, 16, 3, 32, 32)
+    return lambda: model.spatial_tiled_decode(latents, [0., 1.], 128)
+
+
+@benchmark("wan_vae_decode")
+def bench_wan_vae_decode():
+    model = get_wan_vae()
+    latents = torch.randn(1, 16, 3, 16, 16)
+    return lambda: model.decode(latents, [0., 1.])
+
+
+def get_ltx_vae():
+    from ltx_video.models.autoencoders.causal_video_autoencoder import CausalVideoAutoencoder, create_video_autoencoder_demo_config
+    # the latent statistics buffers of the vae have 128 channels
+    config = create_video_autoencoder_demo_config(latent_channels = 128)
+    config["encoder_base_channels"] = config["decoder_base_channels"] = 32
+    model = CausalVideoAutoencoder.from_config(config)
+    return model.eval().requires_grad_(False)
+
+
+@benchmark("ltx_vae_encode")
+def bench_ltx_vae_encode():
+    from ltx_video.models.autoencoders.vae_encode import vae_encode
+    model = get_ltx_vae()
+    video = torch.rand(1, 3, 17, 128, 128) * 2 - 1
+    return lambda: vae_encode(video, model)
+
+
+@benchmark("ltx_vae_decode")
+def bench_ltx_vae_decode():
+    from ltx_video.models.autoencoders.vae_encode import vae_decode
+    model = get_ltx_vae()
+    latents = torch.randn(1, 128, 3, 4, 4)
+    return lambda: vae_decode(latents, model, timestep = torch.tensor([0.05]))
+
+
+@benchmark("flux_transformer_step")
+def bench_flux_transformer_step():
+    from mmgp import offload
+    from flux.model import Flux, FluxParams
+    from flux.modules.layers import get_linear_split_map
+    hidden_size = 256
+    params = FluxParams(in_channels = 64, out_channels = 64, vec_in_dim = 128, context_in_dim = 128, hidden_size = hidden_size, mlp_ratio = 4.0, num_heads = 2,
+                        depth = 2, depth_single_blocks = 2, axes_dim = [16, 56, 56], theta = 10_000, qkv_bias = True, guidance_embed = True)
+    model = Flux(params).eval().requires_grad_(False)
+    # the attention layers are split as when the checkpoint is loaded
+    offload.split_linear_modules(model, get_linear_split_map(hidden_size))
+    h = w = 24
+    img_ids = torch.zeros(h, w, 3)
+    img_ids[..., 1] = torch.arange(h)[:, None]
+    img_ids[..., 2] = torch.arange(w)[None, :]
+    img_ids = img_ids.reshape(1, h * w, 3)
+    img = torch.randn(1, h * w, 64)
+    txt = torch.randn(1, 64, 128)
+    txt_ids = torch.zeros(1, 64, 3)
+    y = torch.randn(1, 128)
+    pipeline = get_pipeline()
+    return lambda: model(img = img, img_ids = img_ids, txt = txt, txt_ids = txt_ids, timesteps = torch.tensor([1.]), y = y, guidance = torch.tensor([3.5]), pipeline = pipeline)
+
+
+@benchmark("cpu_attention")
+def bench_cpu_attention():
+    from wan.modules.attention import pay_attention
+    q, k, v = [torch.randn(1, 4096, 2, 128) for _ in range(3)]
+    return lambda: pay_attention([q, k, v])
+
+
+@benchmark("cache_video")
+def bench_cache_video():
+    from wan.utils.utils import cache_video
+    video = torch.rand(1, 3, 33, 256, 256) * 2 - 1
+    folder = tempfile.mkdtemp(prefix = "wgp_benchmark_")
+    atexit.register(shutil.rmtree, folder, ignore_errors = True)
+    save_file = os.path.join(folder, "video.mp4")
+    return lambda: cache_video(tensor = video, save_file = save_file, fps = 16, nrow = 1, normalize = True, value_range = (-1, 1))
+
+
+@benchmark("rife_interpolation")
+def bench_rife_interpolation():
+    from postprocessing.rife.inference import RifeEngine
+    from postprocessing.rife.RIFE_HDv3 import Model
+    engine = RifeEngine()
+    model = Model()
+    model.eval()
+    model.device = "cpu"
+    engine.model, engine.model_path, engine.device = model, None, "cpu"
+    # a smooth moving gradient so that the frames are neither static nor scene cuts
+    x = torch.linspace(-1, 1, 128)
+    frames = torch.stack([torch.sin(3 * (x[None, :] + x[:, None]) + 0.2 * t) for t in range(9)])
+    frames = frames[None].expand(3, -1, -1, -1).contiguous()
+    return lambda: engine.interpolate(frames, 1)
+
+
+@benchmark("resize_frames")
+def bench_resize_frames():
+    from wan.utils.utils import resize_frames
+    frames = np.random.randint(0, 256, (33, 480, 832, 3), dtype = np.uint8)
+    return lambda: resize_frames(frames, 416, 240)
+
+
+@benchmark("tensor_to_video_frames")
+def bench_tensor_to_video_frames():
+    from wan.utils.utils import tensor_to_video_frames
+    video = torch.rand(3, 81, 240, 416) * 2 - 1
+    return lambda: tensor_to_video_frames(video)
+
+
+@benchmark("frame_buffer_append")
+def bench_frame_buffer_append():
+    from wan.utils.utils import VideoFrameBuffer
+    window = torch.rand(3, 33, 240, 416) * 2 - 1
+
+    def run():
+        buffer = VideoFrameBuffer(33 * 4)
+        for _ in range(4):
+            buffer.append(window)
+        frames = buffer.get_frames()
+        buffer.release()
+        return frames
+    return run
+
+
+def set_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def run_benchmark(name, setup, warmup, repeat, seed):
+    set_seed(seed)
+    with torch.inference_mode():
+        func = setup()
+        for _ in range(warmup):
+            func()
+        timings = []
+        for _ in range(repeat):
+            with profiler.span(name, cat = "benchmark"):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "mean_s": statistics.mean(timings),
+        "stdev_s": statistics.stdev(timings) if len(timings) > 1 else 0.,
+        "repeat": repeat,
+    }
+
+
+def get_environment(threads):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "threads": threads,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def compare_results(results, baseline, tolerance, selected = None):
+    # ratio of the medians, a benchmark regresses when it is slower than the baseline by more than the tolerance
+    # a benchmark of the baseline that fails or is missing now is a failure, selected(name) tells if it should have run
+    regressions, failures = [], []
+    print(f"\n{'benchmark':<28}{'baseline':>12}{'current':>12}{'ratio':>9}")
+    for name, reference in baseline.items():
+        if name not in results and "median_s" in reference and (selected is None or selected(name)):
+            failures.append(name)
+            print(f"{name:<28}{reference['median_s']:>12.4f}{'missing':>12}{'-':>9}  << failed")
+    for name, result in results.items():
+        reference = baseline.get(name, None)
+        if reference is not None and "median_s" in reference and "median_s" not in result:
+            failures.append(name)
+            print(f"{name:<28}{reference['median_s']:>12.4f}{'error':>12}{'-':>9}  << failed")
+            continue
+        if reference is None or "median_s" not in result or "median_s" not in reference:
+            print(f"{name:<28}{'-':>12}{result.get('median_s', float('nan')):>12.4f}{'-':>9}")
+            continue
+        ratio = result["median_s"] / max(reference["median_s"], 1e-9)
+        result["baseline_median_s"] = reference["median_s"]
+        result["ratio"] = round(ratio, 3)
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  << slower"
+        elif ratio < 1 / (1 + tolerance):
+            flag = "  faster"
+        print(f"{name:<28}{reference['median_s']:>12.4f}{result['median_s']:>12.4f}{ratio:>9.2f}{flag}")
+    return regressions, failures
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="CPU micro-benchmarks on miniature random weights models")
+    parser.add_argument("--only", nargs="*", default=None, help="run only the benchmarks whose name contains one of these strings")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the timed ones")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs")
+    parser.add_argument("--threads", type=int, default=4, help="number of torch cpu threads, fixed so that results are comparable")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the random weights and inputs")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="json file where the results are saved")
+    parser.add_argument("--baseline", type=str, default=None, help="json results of a previous run to compare with")
+    parser.add_argument("--save-baseline", type=str, default=None, help="also save the results as a baseline in this file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative slowdown of the median tolerated before reporting a regression")
+    parser.add_argument("--trace", type=str, default=None, help="export a Chrome trace of the timed runs in this file")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+    torch.set_num_threads(args.threads)
+    selected = lambda name: args.only is None or any(pattern in name for pattern in args.only)
+    names = [name for name in BENCHMARKS if selected(name)]
+    if len(names) == 0:
+        print("No benchmark selected")
+        return 2
+
+    profiler.enabled = args.trace is not None
+    results = {}
+    for name in names:
+        print(f"Running {name}...", flush=True)
+        try:
+            results[name] = run_benchmark(name, BENCHMARKS[name], args.warmup, args.repeat, args.seed)
+            print(f"  median {results[name]['median_s']:.4f}s, min {results[name]['min_s']:.4f}s")
+        except Exception as e:
+            # a benchmark whose dependencies are missing doesn't prevent the others from running
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+            print(f"  failed: {results[name]['error']}")
+
+    regressions, failures = [], []
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions, failures = compare_results(results, baseline.get("results", {}), args.tolerance, selected)
+
+    output = {"environment": get_environment(args.threads), "settings": {"warmup": args.warmup, "repeat": args.repeat, "seed": args.seed}, "results": results}
+    for file_path in [args.output, args.save_baseline]:
+        if file_path is None: continue
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=4)
+        print(f"Results saved to {file_path}")
+    if args.trace is not None:
+        profiler.export_chrome_trace(args.trace)
+        print(f"Trace saved to {args.trace}")
+
+    if len(failures) > 0:
+        print(f"Benchmarks of the baseline that failed or are missing: {', '.join(failures)}")
+    if len(regressions) > 0:
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+    return 1 if len(regressions) + len(failures) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ from glob import iglob
 from mmgp import offload as offload
 import torch
 from wan.utils.utils import calculate_new_dimensions
+from wan.utils.profiler import profiler
 from flux.sampling import denoise, get_schedule, prepare_kontext, unpack
 from flux.modules.layers import get_linear_split_map
 from flux.util import (
@@ -133,7 +134,7 @@ class model_factory:
             if x==None: return None
             # decode latents to pixel space
             x = unpack_latent(x)
-            with torch.autocast(device_type=device, dtype=torch.bfloat16):
+            with torch.autocast(device_type=device, dtype=torch.bfloat16), profiler.span("vae decode"):
                 x = self.vae.decode(x)
 
             x = x.clamp(-1, 1)
@@ -151,6 +151,29 @@ class Flux(nn.Module):
                 new_sd[k] = v
         return new_sd    
 
+    def prepare_step_invariants(
+        self,
+        img_ids: Tensor,
+        txt: Tensor,
+        txt_ids: Tensor,
+        y: Tensor,
+        guidance: Tensor | None = None,
+    ) -> dict:
+        # text stream, pooled text / guidance embeddings and rope table don't change during sampling
+        if txt.ndim != 3:
+            raise ValueError("Input txt tensor must have 3 dimensions.")
+        guidance_vec = None
+        if self.params.guidance_embed:
+            if guidance is None:
+                raise ValueError("Didn't get guidance strength for guidance distilled model.")
+            guidance_vec = self.guidance_in(timestep_embedding(guidance, 256))
+        return {
+            "txt": self.txt_in(txt),
+            "guidance_vec": guidance_vec,
+            "y_vec": self.vector_in(y),
+            "pe": self.pe_embedder(torch.cat((txt_ids, img_ids), dim=1)),
+        }
+
     def forward(
         self,
         img: Tensor,
@@ -162,23 +185,28 @@ class Flux(nn.Module):
         guidance: Tensor | None = None,
         callback= None,
         pipeline =None,
+        step_invariants = None,
 
     ) -> Tensor:
-        if img.ndim != 3 or txt.ndim != 3:
-            raise ValueError("Input img and txt tensors must have 3 dimensions.")
+        if img.ndim != 3:
+            raise ValueError("Input img tensor must have 3 dimensions.")
+        # an empty dict passed as step_invariants is filled at the first step (inside forward so that offloaded weights are loaded) and reused by the next ones
+        if step_invariants is None or len(step_invariants) == 0:
+            invariants = self.prepare_step_invariants(img_ids, txt, txt_ids, y, guidance)
+            if step_invariants is not None: step_invariants.update(invariants)
+        else:
+            invariants = step_invariants
 
         # running on sequences img
         img = self.img_in(img)
         vec = self.time_in(timestep_embedding(timesteps, 256))
-        if self.params.guidance_embed:
-            if guidance is None:
-                raise ValueError("Didn't get guidance strength for guidance distilled model.")
-            vec +=  self.guidance_in(timestep_embedding(guidance, 256))
-        vec +=  self.vector_in(y)
-        txt = self.txt_in(txt)
-
-        ids = torch.cat((txt_ids, img_ids), dim=1)
-        pe = self.pe_embedder(ids)
+        if invariants["guidance_vec"] is not None:
+            vec +=  invariants["guidance_vec"]
+        vec +=  invariants["y_vec"]
+        # the double blocks update the text stream in place
+        txt = invariants["txt"].clone()
+        pe = invariants["pe"]
+        invariants = step_invariants = None
 
         for block in self.double_blocks:
             if callback != None:
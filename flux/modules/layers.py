@@ -7,11 +7,10 @@ from torch import Tensor, nn
 
 from flux.math import attention, rope
 
-def get_linear_split_map():
-    hidden_size = 3072
+def get_linear_split_map(hidden_size = 3072, mlp_ratio = 4):
     split_linear_modules_map =  {
                                 "qkv" : {"mapped_modules" : ["q", "k", "v"] , "split_sizes": [hidden_size, hidden_size, hidden_size]},
-                                "linear1" : {"mapped_modules" : ["linear1_attn_q", "linear1_attn_k", "linear1_attn_v", "linear1_mlp"] , "split_sizes":  [hidden_size, hidden_size, hidden_size, 7*hidden_size- 3*hidden_size]}
+                                "linear1" : {"mapped_modules" : ["linear1_attn_q", "linear1_attn_k", "linear1_attn_v", "linear1_mlp"] , "split_sizes":  [hidden_size, hidden_size, hidden_size, mlp_ratio*hidden_size]}
                                 }
     return split_linear_modules_map
 
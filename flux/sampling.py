@@ -12,6 +12,7 @@ from .modules.autoencoder import AutoEncoder
 from .modules.conditioner import HFEmbedder
 from .modules.image_embedders import CannyImageEncoder, DepthImageEncoder, ReduxImageEncoder
 from .util import PREFERED_KONTEXT_RESOLUTIONS
+from wan.utils.profiler import profiler
 from einops import rearrange, repeat
 
 
@@ -349,22 +350,35 @@ def denoise(
     from mmgp import offload
     # this is ignored for schnell
     guidance_vec = torch.full((img.shape[0],), guidance, device=img.device, dtype=img.dtype)
+
+    # the conditioning tokens (channel-wise and sequence-wise) are written once in the input buffer, only the latents are updated at each step
+    img_input = img
+    img_input_ids = img_ids
+    if img_cond is not None:
+        img_input = torch.cat((img, img_cond), dim=-1)
+    if img_cond_seq is not None:
+        assert (
+            img_cond_seq_ids is not None
+        ), "You need to provide either both or neither of the sequence conditioning"
+        img_input = torch.cat((img_input, img_cond_seq), dim=1)
+        img_input_ids = torch.cat((img_input_ids, img_cond_seq_ids), dim=1)
+
+    # text, guidance and rope embeddings are computed once, unless loras whose multipliers change during the steps may alter them
+    any_step_loras = any(isinstance(slist, list) and len(set(slist)) > 1 for slist in (loras_slists or []))
+    step_invariants = None if any_step_loras else {}
+
+    step_span = None
     for i, (t_curr, t_prev) in enumerate(zip(timesteps[:-1], timesteps[1:])):
+        profiler.end(step_span)
+        step_span = profiler.begin("denoising step", step = i)
         offload.set_step_no_for_lora(model, i)
         if pipeline._interrupt:
+            profiler.end(step_span)
             return None
 
         t_vec = torch.full((img.shape[0],), t_curr, dtype=img.dtype, device=img.device)
-        img_input = img
-        img_input_ids = img_ids
-        if img_cond is not None:
-            img_input = torch.cat((img, img_cond), dim=-1)
-        if img_cond_seq is not None:
-            assert (
-                img_cond_seq_ids is not None
-            ), "You need to provide either both or neither of the sequence conditioning"
-            img_input = torch.cat((img_input, img_cond_seq), dim=1)
-            img_input_ids = torch.cat((img_input_ids, img_cond_seq_ids), dim=1)
+        if img_input is not img:
+            img_input[:, :img.shape[1], :img.shape[-1]] = img
         pred = model(
             img=img_input,
             img_ids=img_input_ids,
@@ -373,9 +387,12 @@ def denoise(
             y=vec,
             timesteps=t_vec,
             guidance=guidance_vec,
+            step_invariants=step_invariants,
             **kwargs
         )
-        if pred == None: return None
+        if pred == None:
+            profiler.end(step_span)
+            return None
 
         if img_input_ids is not None:
             pred = pred[:, : img.shape[1]]
@@ -384,6 +401,7 @@ def denoise(
         if callback is not None:
             preview = unpack_latent(img).transpose(0,1)
             callback(i, preview, False)         
+    profiler.end(step_span)
 
 
     return img
@@ -49,6 +49,7 @@ from ...vae.autoencoder_kl_causal_3d import AutoencoderKLCausal3D
 from ...text_encoder import TextEncoder
 from ...modules import HYVideoDiffusionTransformer
 from mmgp import offload
+from wan.utils.profiler import profiler
 from ...utils.data_utils import black_image
 from einops import rearrange
 
@@ -1216,8 +1217,11 @@ class HunyuanVideoPipeline(DiffusionPipeline):
             self.transformer.previous_residual = [None] * latent_items
 
         # if is_progress_bar:
+        step_span = None
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                profiler.end(step_span)
+                step_span = profiler.begin("denoising step", step = i)
                 offload.set_step_no_for_lora(self.transformer, i)
                 if self.interrupt:
                     continue
@@ -1371,6 +1375,7 @@ class HunyuanVideoPipeline(DiffusionPipeline):
 
                 if callback is not None:
                     callback(i, latents.squeeze(0), False)         
+        profiler.end(step_span)
 
         if self.interrupt:
             return [None]
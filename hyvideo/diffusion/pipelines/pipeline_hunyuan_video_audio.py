@@ -45,6 +45,7 @@ from hyvideo.constants import PRECISION_TO_TYPE
 from hyvideo.vae.autoencoder_kl_causal_3d import AutoencoderKLCausal3D
 from hyvideo.text_encoder import TextEncoder
 from einops import rearrange
+from wan.utils.profiler import profiler
 from ...modules import HYVideoDiffusionTransformer
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
@@ -1153,8 +1154,11 @@ class HunyuanVideoAudioPipeline(DiffusionPipeline):
             transformer.previous_residual = [None] * latent_items
 
 
+        step_span = None
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                profiler.end(step_span)
+                step_span = profiler.begin("denoising step", step = i)
                 # init 
                 pred_latents = torch.zeros_like(
                     latents_all,
@@ -1329,6 +1333,7 @@ class HunyuanVideoAudioPipeline(DiffusionPipeline):
 
                 if callback is not None:
                     callback(i, latents_all.squeeze(0), False)
+        profiler.end(step_span)
 
         latents = latents_all.float()[:, :, :video_length] 
 
@@ -2,77 +2,11 @@ import os
 import math
 from typing import Dict, Optional, Tuple, Union
 from dataclasses import dataclass
-from torch import distributed as dist
-import loguru
 import torch
 import torch.nn as nn
-import torch.distributed
 
 RECOMMENDED_DTYPE = torch.float16
 
-def mpi_comm():
-    from mpi4py import MPI
-    return MPI.COMM_WORLD
-
-from torch import distributed as dist
-def mpi_rank():
-    return dist.get_rank()
-
-def mpi_world_size():
-    return dist.get_world_size()
-
-
-class TorchIGather:
-    def __init__(self):
-        if not torch.distributed.is_initialized():
-            rank = mpi_rank()
-            world_size = mpi_world_size()
-            os.environ['RANK'] = str(rank)
-            os.environ['WORLD_SIZE'] = str(world_size)
-            os.environ['MASTER_ADDR'] = '127.0.0.1'
-            os.environ['MASTER_PORT'] = str(29500)
-            torch.cuda.set_device(rank)
-            torch.distributed.init_process_group('nccl')
-
-        self.handles = []
-        self.buffers = []
-
-        self.world_size = dist.get_world_size()
-        self.rank = dist.get_rank()
-        self.groups_ids = []
-        self.group = {}
-
-        for i in range(self.world_size):
-            self.groups_ids.append(tuple(range(i + 1)))
-
-        for group in self.groups_ids:
-            new_group = dist.new_group(group)
-            self.group[group[-1]] = new_group
-
-
-    def gather(self, tensor, n_rank=None):
-        if n_rank is not None:
-            group = self.group[n_rank - 1]
-        else:
-            group = None
-        rank = self.rank
-        tensor = tensor.to(RECOMMENDED_DTYPE)
-        if rank == 0:
-            buffer = [torch.empty_like(tensor) for i in range(n_rank)]
-        else:
-            buffer = None
-        self.buffers.append(buffer)
-        handle = torch.distributed.gather(tensor, buffer, async_op=True, group=group)
-        self.handles.append(handle)
-
-    def wait(self):
-        for handle in self.handles:
-            handle.wait()
-
-    def clear(self):
-        self.buffers = []
-        self.handles = []
-
 
 from diffusers.configuration_utils import ConfigMixin, register_to_config
 try:
@@ -93,6 +27,7 @@ from diffusers.models.attention_processor import (
 from diffusers.models.modeling_outputs import AutoencoderKLOutput
 from diffusers.models.modeling_utils import ModelMixin
 from .vae import DecoderCausal3D, BaseOutput, DecoderOutput, DiagonalGaussianDistribution, EncoderCausal3D
+from wan.utils.profiler import profiler
 
 # """
 # use trt need install polygraphy and onnx-graphsurgeon
@@ -262,33 +197,36 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         self.tile_overlap_factor = 0.25
 
         use_trt_engine = False #if CPU_OFFLOAD else True
-        # ============= parallism related code ===================
-        self.parallel_decode = use_trt_engine
-        self.nccl_gather = nccl_gather
-
-        # only relevant if parallel_decode is enabled
-        self.gather_to_rank0 = self.parallel_decode
-
         self.engine_path = engine_path
         
         self.use_trt_decoder = use_trt_engine
 
-    @property
-    def igather(self):
-        assert self.nccl_gather and self.gather_to_rank0
-        if hasattr(self, '_igather'):
-            return self._igather
-        else:
-            self._igather = TorchIGather()
-            return self._igather
+        # decodes the tiles one after the other unless enable_tile_parallel is called
+        self.tile_scheduler = None
 
-    @property
-    def use_padding(self):
-        return (
-            self.use_trt_decoder
-            # dist.gather demands all processes possess to have the same tile shape.
-            or (self.nccl_gather and self.gather_to_rank0)
-        )
+    def enable_tile_parallel(self, backend = "devices", devices = None, group = None):
+        """
+        Spreads the tiles of tiled decodes over several workers, see hyvideo/vae/tile_parallel.py
+        backend: "devices" (one decoder replica per device in this process), "processes" (torch.multiprocessing pool)
+        or "distributed" (ranks of an initialized torch.distributed group, for instance gloo)
+        """
+        from .tile_parallel import get_tile_scheduler
+        self.disable_tile_parallel()
+        self.tile_scheduler = get_tile_scheduler(backend, devices = devices, group = group)
+
+    def disable_tile_parallel(self):
+        if self.tile_scheduler is not None:
+            self.tile_scheduler.release()
+            self.tile_scheduler = None
+
+    def decode_tiles(self, tiles, device):
+        # decoded tiles are yielded in the order of tiles whatever the scheduler
+        if self.tile_scheduler is None:
+            for tile in tiles:
+                yield self.decoder(self.post_quant_conv(tile))
+        else:
+            for decoded in self.tile_scheduler.map(self, tiles):
+                yield decoded.to(device)
 
     def _set_gradient_checkpointing(self, module, value=False):
         if isinstance(module, (EncoderCausal3D, DecoderCausal3D)):
@@ -433,6 +371,7 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
 
         self.set_attn_processor(processor, _remove_lora=True)
 
+    @profiler.trace("vae encode")
     @apply_forward_hook
     def encode(
         self, x: torch.FloatTensor, return_dict: bool = True
@@ -492,6 +431,7 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
 
         return DecoderOutput(sample=dec)
 
+    @profiler.trace("vae decode")
     @apply_forward_hook
     def decode(
         self, z: torch.FloatTensor, return_dict: bool = True, generator=None
@@ -511,15 +451,6 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
 
         """
 
-        if self.parallel_decode:
-            if z.dtype != RECOMMENDED_DTYPE:
-                loguru.logger.warning(
-                    f'For better performance, using {RECOMMENDED_DTYPE} for both latent features and model parameters is recommended.'
-                    f'Current latent dtype {z.dtype}. '
-                    f'Please note that the input latent will be cast to {RECOMMENDED_DTYPE} internally when decoding.'
-                )
-                z = z.to(RECOMMENDED_DTYPE)
-
         if self.use_slicing and z.shape[0] > 1:
             decoded_slices = [self._decode(z_slice).sample for z_slice in z.split(1)]
             decoded = torch.cat(decoded_slices)
@@ -655,129 +586,28 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
 
         # Split z into overlapping tiles and decode them separately.
         # The tiles have an overlap to avoid seams between tiles.
-        if self.parallel_decode:
-
-            rank = mpi_rank()
-            torch.cuda.set_device(rank) # set device for trt_runner
-            world_size = mpi_world_size()
-
-            tiles = []
-            afters_if_padding = []
-            for i in range(0, z.shape[-2], overlap_size):
-                for j in range(0, z.shape[-1], overlap_size):
-                    tile = z[:, :, :, i : i + self.tile_latent_min_size, j : j + self.tile_latent_min_size]
-
-                    if self.use_padding and (tile.shape[-2] < self.tile_latent_min_size or tile.shape[-1] < self.tile_latent_min_size):
-                        from torch.nn import functional as F
-                        after_h = tile.shape[-2] * 8
-                        after_w = tile.shape[-1] * 8
-                        padding = (0, self.tile_latent_min_size - tile.shape[-1], 0, self.tile_latent_min_size - tile.shape[-2], 0, 0)
-                        tile = F.pad(tile, padding, "replicate").to(device=tile.device, dtype=tile.dtype)
-                        afters_if_padding.append((after_h, after_w))
-                    else:
-                        afters_if_padding.append(None)
-
-                    tiles.append(tile)
-
-
-            # balance tasks
-            ratio = math.ceil(len(tiles) / world_size)
-            tiles_curr_rank = tiles[rank * ratio: None if rank == world_size - 1 else (rank + 1) * ratio]
-
-            decoded_results = []
-
-
-            total = len(tiles)
-            n_task = ([ratio] * (total // ratio) + ([total % ratio] if total % ratio else []))
-            n_task = n_task + [0] * (8 - len(n_task))
-
-            for i, tile in enumerate(tiles_curr_rank):
-                if self.use_trt_decoder:
-                    # For unknown reason, `copy_outputs_to_host` must be set to True
-                    decoded = self.trt_decoder_runner.infer(
-                        {"input": tile.to(RECOMMENDED_DTYPE).contiguous()},
-                        copy_outputs_to_host=True
-                    )["output"].to(device=z.device, dtype=z.dtype)
-                    decoded_results.append(decoded)
-                else:
-                    decoded_results.append(self.decoder(self.post_quant_conv(tile)))
-
-
-                def find(n):
-                    return next((i for i, task_n in enumerate(n_task) if task_n < n), len(n_task))
-
-
-                if self.nccl_gather and self.gather_to_rank0:
-                    self.igather.gather(decoded, n_rank=find(i + 1))
-
-            if not self.nccl_gather:
-                if self.gather_to_rank0:
-                    decoded_results = mpi_comm().gather(decoded_results, root=0)
-                    if rank != 0:
-                        return DecoderOutput(sample=None)
-                else:
-                    decoded_results = mpi_comm().allgather(decoded_results)
-
-                decoded_results = sum(decoded_results, [])
-            else:
-                # [Kevin]:
-                # We expect all tiles obtained from the same rank have the same shape.
-                # Shapes among ranks can differ due to the imbalance of task assignment.
-                if self.gather_to_rank0:
-                    if rank == 0:
-                        self.igather.wait()
-                        gather_results = self.igather.buffers
-                    self.igather.clear()
-                else:
-                    raise NotImplementedError('The old `allgather` implementation is deprecated for nccl plan.')
-
-                if rank != 0 and self.gather_to_rank0:
-                    return DecoderOutput(sample=None)
-
-                decoded_results = [col[i] for i in range(max([len(k) for k in gather_results])) for col in gather_results if i < len(col)]
-
-
-            # Crop the padding region in pixel level
-            if self.use_padding:
-                new_decoded_results = []
-                for after, dec in zip(afters_if_padding, decoded_results):
-                    if after is not None:
-                        after_h, after_w = after
-                        new_decoded_results.append(dec[:, :, :, :after_h, :after_w])
-                    else:
-                        new_decoded_results.append(dec)
-                decoded_results = new_decoded_results
-
-            rows = []
-            decoded_results_iter = iter(decoded_results)
-            for i in range(0, z.shape[-2], overlap_size):
-                row = []
-                for j in range(0, z.shape[-1], overlap_size):
-                    row.append(next(decoded_results_iter).to(rank))
-                rows.append(row)
-        else:
-            rows = []
-            for i in range(0, z.shape[-2], overlap_size):
-                row = []
-                for j in range(0, z.shape[-1], overlap_size):
-                    tile = z[:, :, :, i : i + self.tile_latent_min_size, j : j + self.tile_latent_min_size]
-                    tile = self.post_quant_conv(tile)
-                    decoded = self.decoder(tile)
-                    row.append(decoded)
-                rows.append(row)
+        tiles = []
+        for i in range(0, z.shape[-2], overlap_size):
+            for j in range(0, z.shape[-1], overlap_size):
+                tiles.append(z[:, :, :, i : i + self.tile_latent_min_size, j : j + self.tile_latent_min_size])
+        cols_count = len(range(0, z.shape[-1], overlap_size))
 
+        # rows are blended as soon as they are decoded, only the previous row is kept
         result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
+        previous_row, row = None, []
+        for tile in self.decode_tiles(tiles, z.device):
+            j = len(row)
+            # blend the above tile and the left tile
+            # to the current tile and add the current tile to the result row
+            if previous_row is not None:
+                tile = self.blend_v(previous_row[j], tile, blend_extent)
+            if j > 0:
+                tile = self.blend_h(row[j - 1], tile, blend_extent)
+            row.append(tile)
+            if len(row) == cols_count:
+                result_rows.append(torch.cat([tile[:, :, :, :row_limit, :row_limit] for tile in row], dim=-1))
+                previous_row, row = row, []
+        tiles = previous_row = None
 
         dec = torch.cat(result_rows, dim=-2)
         if not return_dict:
@@ -829,24 +659,22 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         blend_extent = int(self.tile_sample_min_tsize * self.tile_overlap_factor)
         t_limit = self.tile_sample_min_tsize - blend_extent
 
-        row = []
-        for i in range(0, T, overlap_size):
-            tile = z[:, :, i: i + self.tile_latent_min_tsize + 1, :, :]
-            if self.use_spatial_tiling and (tile.shape[-1] > self.tile_latent_min_size or tile.shape[-2] > self.tile_latent_min_size):
-                decoded = self.spatial_tiled_decode(tile, return_dict=True).sample
-            else:
-                tile = self.post_quant_conv(tile)
-                decoded = self.decoder(tile)
-            if i > 0:
-                decoded = decoded[:, :, 1:, :, :]
-            row.append(decoded)
+        tiles = [z[:, :, i: i + self.tile_latent_min_tsize + 1, :, :] for i in range(0, T, overlap_size)]
+        if self.use_spatial_tiling and (H > self.tile_latent_min_size or W > self.tile_latent_min_size):
+            decoded_tiles = (self.spatial_tiled_decode(tile, return_dict=True).sample for tile in tiles)
+        else:
+            decoded_tiles = self.decode_tiles(tiles, z.device)
         result_row = []
-        for i, tile in enumerate(row):
+        previous_tile = None
+        for i, tile in enumerate(decoded_tiles):
             if i > 0:
-                tile = self.blend_t(row[i - 1], tile, blend_extent)
+                tile = tile[:, :, 1:, :, :]
+                tile = self.blend_t(previous_tile, tile, blend_extent)
                 result_row.append(tile[:, :, :t_limit, :, :])
             else:
                 result_row.append(tile[:, :, :t_limit + 1, :, :])
+            previous_tile = tile
+        tiles = decoded_tiles = previous_tile = None
 
         dec = torch.cat(result_row, dim=2)
         if not return_dict:
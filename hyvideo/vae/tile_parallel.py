@@ -0,0 +1,160 @@
+"""
+Schedulers spreading the tiles of a tiled VAE decode over several devices or processes.
+map(vae, tiles) decodes a list of latent tiles and yields the decoded tiles in the order of the input list, whatever
+the worker that decoded them, so that the reassembly is deterministic. Decoded tiles are produced as the caller
+consumes them, the number of decoded tiles kept in memory is bounded by the number of workers.
+"""
+import threading
+
+import torch
+import torch.distributed as dist
+
+
+def build_decoder_replica(vae, device, dtype = None):
+    # only the modules needed to decode, built from the config so that no offload hook of the original is copied
+    from .autoencoder_kl_causal_3d import AutoencoderKLCausal3D
+    replica = AutoencoderKLCausal3D.from_config(vae.config)
+    replica.encoder = None
+    replica.quant_conv = None
+    state_dict = {k: v for k, v in vae.state_dict().items() if k.startswith("decoder.") or k.startswith("post_quant_conv.")}
+    replica.load_state_dict(state_dict, strict=False)
+    dtype = dtype if dtype is not None else vae.post_quant_conv.weight.dtype
+    return replica.to(device=device, dtype=dtype).eval().requires_grad_(False)
+
+
+def decode_tile(vae, tile):
+    device = vae.post_quant_conv.weight.device
+    dtype = vae.post_quant_conv.weight.dtype
+    with torch.no_grad():
+        return vae.decoder(vae.post_quant_conv(tile.to(device=device, dtype=dtype)))
+
+
+class SerialTileScheduler:
+    def map(self, vae, tiles):
+        for tile in tiles:
+            yield vae.decoder(vae.post_quant_conv(tile))
+
+    def release(self):
+        pass
+
+
+class DevicesTileScheduler:
+    """
+    One decoder replica per device, tiles are dispatched to the replicas by threads of this process
+    (the GIL is released by the convolution kernels), so it can be used from the app without starting new processes.
+    """
+
+    def __init__(self, devices):
+        self.devices = list(devices)
+        self.replicas = None
+        self.lock = threading.Lock()
+
+    def _get_replicas(self, vae):
+        with self.lock:
+            if self.replicas is None:
+                self.replicas = [build_decoder_replica(vae, device) for device in self.devices]
+            return self.replicas
+
+    def map(self, vae, tiles):
+        from concurrent.futures import ThreadPoolExecutor
+        replicas = self._get_replicas(vae)
+        with ThreadPoolExecutor(max_workers=len(replicas)) as executor:
+            # tiles are submitted by rounds of one tile per device so that few decoded tiles wait to be consumed
+            for start in range(0, len(tiles), len(replicas)):
+                futures = [executor.submit(decode_tile, replica, tile) for replica, tile in zip(replicas, tiles[start:start + len(replicas)])]
+                for future in futures:
+                    yield future.result()
+
+    def release(self):
+        with self.lock:
+            self.replicas = None
+
+
+_worker_vae = None
+
+def _init_process_worker(vae_config, state_dict, devices, dtype, counter):
+    global _worker_vae
+    from .autoencoder_kl_causal_3d import AutoencoderKLCausal3D
+    with counter.get_lock():
+        worker_no = counter.value
+        counter.value += 1
+    torch.set_grad_enabled(False)
+    vae = AutoencoderKLCausal3D.from_config(vae_config)
+    vae.encoder = None
+    vae.quant_conv = None
+    vae.load_state_dict(state_dict, strict=False)
+    _worker_vae = vae.to(device=devices[worker_no % len(devices)], dtype=dtype).eval()
+
+def _decode_process_tile(tile):
+    return decode_tile(_worker_vae, tile).cpu()
+
+
+class ProcessesTileScheduler:
+    """
+    torch.multiprocessing pool whose workers own a decoder replica on one of the devices ("cpu" devices can be repeated).
+    Workers are started with the spawn method, so the main module of the program must be guarded by
+    `if __name__ == "__main__"`: this is meant for scripts and tests rather than for the app.
+    """
+
+    def __init__(self, devices):
+        self.devices = list(devices)
+        self.pool = None
+
+    def _get_pool(self, vae):
+        if self.pool is None:
+            import torch.multiprocessing as mp
+            ctx = mp.get_context("spawn")
+            dtype = vae.post_quant_conv.weight.dtype
+            # cpu tensors are shared with the workers through shared memory instead of being copied for each one
+            state_dict = {k: v.detach().cpu().share_memory_() for k, v in vae.state_dict().items() if k.startswith("decoder.") or k.startswith("post_quant_conv.")}
+            self.pool = ctx.Pool(len(self.devices), initializer=_init_process_worker, initargs=(dict(vae.config), state_dict, self.devices, dtype, ctx.Value("i", 0)))
+        return self.pool
+
+    def map(self, vae, tiles):
+        pool = self._get_pool(vae)
+        tiles = [tile.cpu() for tile in tiles]
+        for start in range(0, len(tiles), len(self.devices)):
+            yield from pool.map(_decode_process_tile, tiles[start:start + len(self.devices)])
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+class DistributedTileScheduler:
+    """
+    Tiles spread over the ranks of an initialized torch.distributed group (for instance gloo, which also works on cpu):
+    every rank runs the same decode, tile n is decoded by rank n % world_size and the tiles are exchanged by rounds of
+    world_size tiles, so that all the ranks get the same result.
+    """
+
+    def __init__(self, group = None):
+        self.group = group
+
+    def map(self, vae, tiles):
+        world_size = dist.get_world_size(self.group)
+        rank = dist.get_rank(self.group)
+        for start in range(0, len(tiles), world_size):
+            tile_no = start + rank
+            decoded = decode_tile(vae, tiles[tile_no]).cpu() if tile_no < len(tiles) else None
+            gathered = [None] * world_size
+            dist.all_gather_object(gathered, decoded, group=self.group)
+            decoded = None
+            yield from gathered[:min(world_size, len(tiles) - start)]
+
+    def release(self):
+        pass
+
+
+def get_tile_scheduler(backend = "serial", devices = None, group = None):
+    if backend == "serial":
+        return SerialTileScheduler()
+    elif backend == "devices":
+        return DevicesTileScheduler(devices)
+    elif backend == "processes":
+        return ProcessesTileScheduler(devices)
+    elif backend == "distributed":
+        return DistributedTileScheduler(group)
+    raise Exception(f"Unknown tile parallel backend '{backend}'")
@@ -3,6 +3,7 @@ import torch
 from diffusers import AutoencoderKL
 from einops import rearrange
 from torch import Tensor
+from wan.utils.profiler import profiler
 
 
 from ltx_video.models.autoencoders.causal_video_autoencoder import (
@@ -19,6 +20,7 @@ except ImportError:
     xm = None
 
 
+@profiler.trace("vae encode")
 def vae_encode(
     media_items: Tensor,
     vae: AutoencoderKL,
@@ -91,6 +93,7 @@ def vae_encode(
     return latents
 
 
+@profiler.trace("vae decode")
 def vae_decode(
     latents: Tensor,
     vae: AutoencoderKL,
@@ -38,6 +38,7 @@ from ltx_video.models.transformers.transformer3d import Transformer3DModel
 from ltx_video.schedulers.rf import TimestepShifter
 from ltx_video.utils.skip_layer_strategy import SkipLayerStrategy
 from ltx_video.utils.prompt_enhance_utils import generate_cinematic_prompt
+from wan.utils.profiler import profiler
 from ltx_video.models.autoencoders.latent_upsampler import LatentUpsampler
 from ltx_video.models.autoencoders.vae_encode import (
     un_normalize_latents,
@@ -1156,8 +1157,11 @@ class LTXVideoPipeline(DiffusionPipeline):
         if callback != None:
             callback(-1, None, True, override_num_inference_steps = num_inference_steps, pass_no =pass_no)
 
+        step_span = None
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
+                profiler.end(step_span)
+                step_span = profiler.begin("denoising step", step = i, pass_no = pass_no)
                 if conditioning_mask is not None and image_cond_noise_scale > 0.0:
                     latents = self.add_noise_to_image_conditioning_latents(
                         t,
@@ -1318,6 +1322,7 @@ class LTXVideoPipeline(DiffusionPipeline):
 
                 if callback_on_step_end is not None:
                     callback_on_step_end(self, i, t, {})
+        profiler.end(step_span)
 
 
         # Remove the added conditioning latents
@@ -169,8 +169,8 @@ _SYNC_SIZE = 224
 _SYNC_FPS = 25.0
 
 
-def load_video(video_path: Path, duration_sec: float, load_all_frames: bool = True) -> VideoInfo:
-
+def _make_video_info(clip_chunk: torch.Tensor, sync_chunk: torch.Tensor, duration_sec: float, fps, all_frames) -> VideoInfo:
+    # clip_chunk / sync_chunk: uint8 frames (T, C, H, W) already resampled at _CLIP_FPS / _SYNC_FPS
     clip_transform = v2.Compose([
         v2.Resize((_CLIP_SIZE, _CLIP_SIZE), interpolation=v2.InterpolationMode.BICUBIC),
         v2.ToImage(),
@@ -185,16 +185,6 @@ def load_video(video_path: Path, duration_sec: float, load_all_frames: bool = Tr
         v2.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
     ])
 
-    output_frames, all_frames, orig_fps = read_frames(video_path,
-                                                      list_of_fps=[_CLIP_FPS, _SYNC_FPS],
-                                                      start_sec=0,
-                                                      end_sec=duration_sec,
-                                                      need_all_frames=load_all_frames)
-
-    clip_chunk, sync_chunk = output_frames
-    clip_chunk = torch.from_numpy(clip_chunk).permute(0, 3, 1, 2)
-    sync_chunk = torch.from_numpy(sync_chunk).permute(0, 3, 1, 2)
-
     clip_frames = clip_transform(clip_chunk)
     sync_frames = sync_transform(sync_chunk)
 
@@ -216,14 +206,53 @@ def load_video(video_path: Path, duration_sec: float, load_all_frames: bool = Tr
 
     video_info = VideoInfo(
         duration_sec=duration_sec,
-        fps=orig_fps,
+        fps=fps,
         clip_frames=clip_frames,
         sync_frames=sync_frames,
-        all_frames=all_frames if load_all_frames else None,
+        all_frames=all_frames,
     )
     return video_info
 
 
+def load_video(video_path: Path, duration_sec: float, load_all_frames: bool = True) -> VideoInfo:
+
+    output_frames, all_frames, orig_fps = read_frames(video_path,
+                                                      list_of_fps=[_CLIP_FPS, _SYNC_FPS],
+                                                      start_sec=0,
+                                                      end_sec=duration_sec,
+                                                      need_all_frames=load_all_frames)
+
+    clip_chunk, sync_chunk = output_frames
+    clip_chunk = torch.from_numpy(clip_chunk).permute(0, 3, 1, 2)
+    sync_chunk = torch.from_numpy(sync_chunk).permute(0, 3, 1, 2)
+
+    return _make_video_info(clip_chunk, sync_chunk, duration_sec, orig_fps, all_frames if load_all_frames else None)
+
+
+def load_video_frames(frames: torch.Tensor, fps: float, duration_sec: float) -> VideoInfo:
+    """
+    Same as load_video but for frames that are already in memory (uint8 tensor T, H, W, C), so that a video
+    that has just been generated doesn't need to be decoded again.
+    """
+    from fractions import Fraction
+    # same frame selection as read_frames, without decoding anything
+    list_of_fps = [_CLIP_FPS, _SYNC_FPS]
+    indices = [[] for _ in list_of_fps]
+    next_frame_time_for_each_fps = [0.0 for _ in list_of_fps]
+    for frame_no in range(len(frames)):
+        frame_time = frame_no / fps
+        if frame_time > duration_sec:
+            break
+        for i, target_fps in enumerate(list_of_fps):
+            while frame_time >= next_frame_time_for_each_fps[i]:
+                indices[i].append(frame_no)
+                next_frame_time_for_each_fps[i] += 1 / target_fps
+
+    frames = frames.permute(0, 3, 1, 2)
+    clip_chunk, sync_chunk = [frames[torch.tensor(frame_nos, dtype=torch.long)] for frame_nos in indices]
+    return _make_video_info(clip_chunk, sync_chunk, duration_sec, Fraction(fps).limit_denominator(1001), None)
+
+
 def load_image(image_path: Path) -> VideoInfo:
     clip_transform = v2.Compose([
         v2.Resize((_CLIP_SIZE, _CLIP_SIZE), interpolation=v2.InterpolationMode.BICUBIC),
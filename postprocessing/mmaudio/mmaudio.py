@@ -4,11 +4,12 @@ import logging
 import torch
 
 from .eval_utils import (ModelConfig, VideoInfo, all_model_cfg, generate, load_image,
-                                load_video, make_video, setup_eval_logging)
+                                load_video, load_video_frames, make_video, setup_eval_logging)
 from .model.flow_matching import FlowMatching
 from .model.networks import MMAudio, get_my_mmaudio
 from .model.sequence_config import SequenceConfig
 from .model.utils.features_utils import FeaturesUtils
+from wan.utils.profiler import profiler
 
 persistent_offloadobj = None
 
@@ -74,9 +75,22 @@ def get_model(persistent_models = False, verboseLevel = 1) -> tuple[MMAudio, Fea
 
     return net, feature_utils, seq_cfg, offloadobj
 
+def release_model():
+    # releases the network, feature utils and vocoder kept resident by persistent_models
+    global persistent_offloadobj, persistent_net, persistent_features_utils, persistent_seq_cfg
+    if persistent_offloadobj is not None:
+        persistent_offloadobj.release()
+    persistent_offloadobj = persistent_net = persistent_features_utils = persistent_seq_cfg = None
+    gc.collect()
+
+@profiler.trace("mmaudio")
 @torch.inference_mode()
 def video_to_audio(video, prompt: str, negative_prompt: str, seed: int, num_steps: int,
-                   cfg_strength: float, duration: float, video_save_path , persistent_models = False, verboseLevel = 1):
+                   cfg_strength: float, duration: float, video_save_path , persistent_models = False, verboseLevel = 1, frames = None, fps = None):
+    """
+    video: mp4 file on which the soundtrack is muxed
+    frames, fps: frames of this video (uint8 tensor T, H, W, C) if they are already in memory, the video is then not decoded
+    """
 
     global device
 
@@ -89,7 +103,10 @@ def video_to_audio(video, prompt: str, negative_prompt: str, seed: int, num_step
         rng.seed()
     fm = FlowMatching(min_sigma=0, inference_mode='euler', num_steps=num_steps)
 
-    video_info = load_video(video, duration)
+    if frames is not None:
+        video_info = load_video_frames(frames, fps, duration)
+    else:
+        video_info = load_video(video, duration, load_all_frames = False)
     clip_frames = video_info.clip_frames
     sync_frames = video_info.sync_frames
     duration = video_info.duration_sec
@@ -1,4 +1,5 @@
 import os
+import threading
 import torch
 from torch.nn import functional as F
 # from .model.pytorch_msssim import ssim_matlab
@@ -13,107 +14,143 @@ def get_frame(frames, frame_no):
     frame = frame.clip(0., 1.)
     return frame
 
-def add_frame(frames, frame, h, w):
-    frame = (frame * 2) - 1
-    frame = frame.clip(-1., 1.)    
-    frame = frame.squeeze(0)
-    frame = frame[:, :h, :w]
-    frame = frame.unsqueeze(1)
-    frames.append(frame.cpu())
-
-def process_frames(model, device, frames, exp):
-    pos = 0
-    output_frames = []
-
-    lastframe = get_frame(frames, 0)
-    _,  h, w = lastframe.shape
-    scale = 1
-    fp16 = False
-
-    def make_inference(I0, I1, n):
-        middle = model.inference(I0, I1, scale)
-        if n == 1:
-            return [middle]
-        first_half = make_inference(I0, middle, n=n//2)
-        second_half = make_inference(middle, I1, n=n//2)
-        if n%2:
-            return [*first_half, middle, *second_half]
-        else:
-            return [*first_half, *second_half]
-
-    tmp = max(32, int(32 / scale))
-    ph = ((h - 1) // tmp + 1) * tmp
-    pw = ((w - 1) // tmp + 1) * tmp
-    padding = (0, pw - w, 0, ph - h)
-
-    def pad_image(img):
-        if(fp16):
-            return F.pad(img, padding).half()
-        else:
-            return F.pad(img, padding)
-
-    I1 = lastframe.to(device, non_blocking=True).unsqueeze(0)
-    I1 = pad_image(I1)
-    temp = None # save lastframe when processing static frame
-
-    while True:
-        if temp is not None:
-            frame = temp
-            temp = None
-        else:
-            pos += 1
-            frame = get_frame(frames, pos)
-        if frame is None:
-            break
-        I0 = I1
-        I1 = frame.to(device, non_blocking=True).unsqueeze(0)
-        I1 = pad_image(I1)
-        I0_small = F.interpolate(I0, (32, 32), mode='bilinear', align_corners=False)
-        I1_small = F.interpolate(I1, (32, 32), mode='bilinear', align_corners=False)
-        ssim = ssim_matlab(I0_small[:, :3], I1_small[:, :3])
-
-        break_flag = False
-        if ssim > 0.996 or pos > 100:        
-            pos += 1
-            frame = get_frame(frames, pos)
-            if frame is None:
-                break_flag = True
-                frame = lastframe
+def to_output(frames, h, w):
+    # (B, C, H, W) frames in [0, 1] -> cropped frames in [-1, 1]
+    frames = (frames[:, :, :h, :w] * 2) - 1
+    return frames.clip(-1., 1.)
+
+
+class RifeEngine:
+    """
+    Resident RIFE interpolator: the flownet is loaded once and kept across calls, frame pairs are interpolated by batches
+    and the output frames are written in a preallocated tensor.
+    """
+
+    def __init__(self):
+        self.model = None
+        self.model_path = None
+        self.device = None
+        self.lock = threading.Lock()
+
+    def load(self, model_path, device):
+        if self.model is not None and self.model_path == model_path and self.device == device:
+            return self.model
+        model = Model()
+        model.load_model(model_path, -1, device=device)
+        model.eval()
+        model.to(device=device)
+        self.model, self.model_path, self.device = model, model_path, device
+        return model
+
+    def release(self):
+        with self.lock:
+            self.model = None
+            self.model_path = None
+            self.device = None
+
+    def interpolate(self, frames, exp, batch_size = 8, scale = 1):
+        model, device = self.model, self.device
+        channels, frames_count, h, w = frames.shape
+        tmp = max(32, int(32 / scale))
+        ph = ((h - 1) // tmp + 1) * tmp
+        pw = ((w - 1) // tmp + 1) * tmp
+        padding = (0, pw - w, 0, ph - h)
+
+        def get_padded(frame_nos):
+            batch = torch.stack([get_frame(frames, frame_no) for frame_no in frame_nos]).to(device, non_blocking=True)
+            return F.pad(batch, padding)
+
+        def get_small(images):
+            return F.interpolate(images, (32, 32), mode='bilinear', align_corners=False)[:, :3]
+
+        def infer(I0, I1):
+            return torch.cat([model.inference(I0[i:i+batch_size], I1[i:i+batch_size], scale) for i in range(0, len(I0), batch_size)])
+
+        # scene cut / static frame test of all the consecutive pairs at once
+        smalls = torch.cat([get_small(get_padded(range(i, min(i + batch_size, frames_count)))) for i in range(0, frames_count, batch_size)])
+        pairs_ssim = ssim_matlab(smalls[:-1], smalls[1:], size_average=False).flatten(1).mean(1).tolist() if frames_count > 1 else []
+
+        # a reference is either the index of a source frame or a frame synthesized when two frames are almost identical
+        def get_ref(ref):
+            return get_padded([ref]) if isinstance(ref, int) else ref
+
+        def get_ssim(ref0, ref1):
+            if isinstance(ref0, int) and isinstance(ref1, int) and ref1 == ref0 + 1:
+                return pairs_ssim[ref0]
+            return ssim_matlab(get_small(get_ref(ref0)), get_small(get_ref(ref1))).item()
+
+        jobs = [] # (I0, I1, key frame, ssim) for each output group
+        last_ref = current_ref = 0
+        pos = 0
+        temp = None
+        while True:
+            if temp is not None:
+                frame_ref = temp
+                temp = None
             else:
-                temp = frame
-            I1 = frame.to(device, non_blocking=True).unsqueeze(0)
-            I1 = pad_image(I1)
-            I1 = model.inference(I0, I1, scale)
-            I1_small = F.interpolate(I1, (32, 32), mode='bilinear', align_corners=False)
-            ssim = ssim_matlab(I0_small[:, :3], I1_small[:, :3])
-            frame = I1[0][:, :h, :w]
-        
-        if ssim < 0.2:
-            output = []
-            for _ in range((2 ** exp) - 1):
-                output.append(I0)
-        else:
-            output = make_inference(I0, I1, 2**exp-1) if exp else []
-
-        add_frame(output_frames, lastframe, h, w)
-        for mid in output:
-            add_frame(output_frames, mid, h, w)
-        lastframe = frame
-        if break_flag:
-            break
-
-    add_frame(output_frames, lastframe, h, w)
-    return torch.cat( output_frames, dim=1)
-
-def temporal_interpolation(model_path, frames, exp, device ="cuda"):
-
-    model = Model()
-    model.load_model(model_path, -1, device=device)
-
-    model.eval()
-    model.to(device=device)
-
-    with torch.no_grad():    
-        output = process_frames(model, device, frames.float(), exp)
+                pos += 1
+                frame_ref = pos if pos < frames_count else None
+            if frame_ref is None:
+                break
+            I0_ref, I1_ref = current_ref, frame_ref
+            ssim = get_ssim(I0_ref, I1_ref)
+            break_flag = False
+            if ssim > 0.996:
+                # static frame: the next frame is replaced by an interpolation with the one after
+                pos += 1
+                if pos >= frames_count:
+                    break_flag = True
+                    next_ref = last_ref
+                else:
+                    next_ref = temp = pos
+                I0 = get_ref(I0_ref)
+                I1_ref = frame_ref = model.inference(I0, get_ref(next_ref), scale)
+                ssim = ssim_matlab(get_small(I0), get_small(I1_ref)).item()
+            jobs.append((I0_ref, I1_ref, last_ref, ssim))
+            last_ref = frame_ref
+            current_ref = I1_ref
+            if break_flag:
+                break
+
+        group_size = 2 ** exp
+        output = torch.empty((channels, len(jobs) * group_size + 1, h, w), dtype=torch.float32)
+        for start in range(0, len(jobs), batch_size):
+            chunk = jobs[start:start + batch_size]
+            key_frames = torch.cat([get_ref(job[2]) for job in chunk])
+            groups = [key_frames]
+            if group_size > 1:
+                I0 = torch.cat([get_ref(job[0]) for job in chunk])
+                I1 = torch.cat([get_ref(job[1]) for job in chunk])
+                # each level inserts a frame between all the consecutive frames of the sequence, for all the pairs of the chunk at once
+                sequence = [I0, I1]
+                for _ in range(exp):
+                    new_sequence = [sequence[0]]
+                    for I_a, I_b in zip(sequence[:-1], sequence[1:]):
+                        new_sequence += [infer(I_a, I_b), I_b]
+                    sequence = new_sequence
+                mids = sequence[1:-1]
+                sequence = I1 = None
+                # scene cut: the first frame is repeated
+                scene_cuts = torch.tensor([job[3] < 0.2 for job in chunk], device=I0.device)
+                if scene_cuts.any():
+                    mids = [torch.where(scene_cuts[:, None, None, None], I0, mid) for mid in mids]
+                groups += mids
+                I0 = None
+            group = torch.stack([to_output(frame, h, w) for frame in groups], dim=1) # B, group_size, C, h, w
+            groups = mids = key_frames = None
+            output[:, start * group_size: (start + len(chunk)) * group_size] = group.flatten(0, 1).transpose(0, 1).to("cpu", torch.float32)
+            group = None
+        output[:, -1] = to_output(get_ref(last_ref), h, w)[0].to("cpu", torch.float32)
+        return output
+
+
+rife_engine = RifeEngine()
+
+def temporal_interpolation(model_path, frames, exp, device ="cuda", batch_size = 8):
+
+    with rife_engine.lock:
+        rife_engine.load(model_path, device)
+        with torch.no_grad():
+            output = rife_engine.interpolate(frames.float(), exp, batch_size = batch_size)
 
     return output
@@ -0,0 +1,112 @@
+import os
+import gc
+import json
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _get_modules(obj, seen = None):
+    # collect every torch module reachable from the annotator attributes
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return []
+    seen.add(id(obj))
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    modules = []
+    if isinstance(obj, (list, tuple)):
+        for o in obj:
+            modules += _get_modules(o, seen)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        for o in vars(obj).values():
+            modules += _get_modules(o, seen)
+    return modules
+
+
+def estimate_annotator_size(annotator, cfg_dict):
+    size = 0
+    for module in _get_modules(annotator):
+        size += sum(t.numel() * t.element_size() for t in module.state_dict().values())
+    if size == 0:
+        # onnx sessions do not expose their weights, use the size of the model files as an approximation
+        for value in cfg_dict.values():
+            if isinstance(value, str) and os.path.isfile(value):
+                size += os.path.getsize(value)
+        size *= getattr(annotator, "num_workers", 1)
+    return size
+
+
+def move_annotator(annotator, device):
+    for module in _get_modules(annotator):
+        module.to(device)
+
+
+class AnnotatorPool:
+    """Process wide cache of loaded annotators, so that the weights are not reloaded for each sliding window."""
+
+    def __init__(self, max_mb = 4096):
+        self.max_mb = max_mb
+        self._annotators = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_key(process_type, cfg_dict):
+        return process_type + "|" + json.dumps(cfg_dict, sort_keys=True)
+
+    def get_size(self):
+        return sum(size for _, size in self._annotators.values())
+
+    def get(self, process_type, cfg_dict, builder):
+        if self.max_mb <= 0:
+            return builder(cfg_dict)
+        key = self.get_key(process_type, cfg_dict)
+        with self._lock:
+            entry = self._annotators.get(key, None)
+            if entry is not None:
+                self._annotators.move_to_end(key)
+                annotator = entry[0]
+                device = getattr(annotator, "device", None)
+                if device is not None:
+                    move_annotator(annotator, device)
+                return annotator
+            annotator = builder(cfg_dict)
+            size = estimate_annotator_size(annotator, cfg_dict)
+            if size > self.max_mb * 1024**2:
+                # too big to be kept resident, the caller will release it once done
+                return annotator
+            self._annotators[key] = (annotator, size)
+            self._evict(self.max_mb * 1024**2)
+            return annotator
+
+    def _evict(self, max_bytes):
+        evicted = False
+        while len(self._annotators) > 0 and self.get_size() > max_bytes:
+            self._annotators.popitem(last=False)
+            evicted = True
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def offload(self):
+        # keep the weights in RAM only, so that they don't compete with the main model for VRAM
+        with self._lock:
+            for annotator, _ in self._annotators.values():
+                move_annotator(annotator, "cpu")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def set_max_mb(self, max_mb):
+        with self._lock:
+            self.max_mb = max_mb
+            self._evict(max(max_mb, 0) * 1024**2)
+
+    def release(self):
+        with self._lock:
+            self._evict(0)
+
+
+annotator_pool = AnnotatorPool()
@@ -73,9 +73,41 @@ class DepthV2Annotator:
 
 
 class DepthV2VideoAnnotator(DepthV2Annotator):
+    """
+    Frames are run through the model by batches and normalized with the depth range of the whole clip instead of the
+    range of each frame, so that the depth maps of a video don't flicker.
+    """
+
+    def __init__(self, cfg, device=None):
+        super().__init__(cfg, device)
+        self.batch_size = max(int(cfg.get("BATCH_SIZE", 8)), 1)
+        self.half_precision = cfg.get("HALF_PRECISION", False)
+        self.input_size = cfg.get("INPUT_SIZE", 518)
+
+    @torch.inference_mode()
     def forward(self, frames):
-        ret_frames = []
-        for frame in frames:
-            anno_frame = super().forward(np.array(frame))
-            ret_frames.append(anno_frame)
-        return ret_frames
\ No newline at end of file
+        import torch.nn.functional as F
+        frames = [np.asarray(frame) for frame in frames]
+        if len(frames) == 0:
+            return []
+        h, w = frames[0].shape[:2]
+        device = torch.device(self.device)
+        # fp16 only on cuda, the cpu kernels of some layers don't support it
+        use_half = self.half_precision and device.type == "cuda"
+        depths = np.empty((len(frames), h, w), dtype=np.float32)
+        for start in range(0, len(frames), self.batch_size):
+            images, _ = self.model.images2tensor(np.stack(frames[start:start + self.batch_size]), self.input_size, device)
+            with torch.autocast("cuda", dtype=torch.float16, enabled=use_half):
+                depth = self.model(images)
+            depth = F.interpolate(depth[:, None].float(), (h, w), mode="bilinear", align_corners=True)[:, 0]
+            depths[start:start + len(depth)] = depth.cpu().numpy()
+            images = depth = None
+
+        depth_min, depth_max = depths.min(), depths.max()
+        scale = 255.0 / max(float(depth_max - depth_min), 1e-6)
+        depth_maps = np.empty((len(frames), h, w, 3), dtype=np.uint8)
+        for start in range(0, len(frames), self.batch_size):
+            depth = depths[start:start + self.batch_size]
+            depth_maps[start:start + len(depth)] = ((depth - depth_min) * scale).clip(0, 255).astype(np.uint8)[..., np.newaxis]
+        # list of views of the preallocated maps, the caller releases the frames one by one
+        return list(depth_maps)
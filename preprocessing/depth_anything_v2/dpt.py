@@ -82,6 +82,25 @@ class DepthAnythingV2(nn.Module):
 
         return image, (h, w)
 
+    def images2tensor(self, raw_images, input_size=518, device=None):
+        # batched image2tensor for frames of the same size (n, h, w, 3), resized and normalized on the device
+        h, w = raw_images.shape[1:3]
+        width, height = Resize(
+            width=input_size,
+            height=input_size,
+            resize_target=False,
+            keep_aspect_ratio=True,
+            ensure_multiple_of=14,
+            resize_method='lower_bound',
+        ).get_size(w, h)
+
+        # same channels swap as image2tensor
+        images = torch.from_numpy(raw_images).to(device).permute(0, 3, 1, 2).flip(1).float().div_(255.0)
+        images = F.interpolate(images, (int(height), int(width)), mode="bicubic", align_corners=False)
+        mean = torch.tensor([0.485, 0.456, 0.406], device=images.device).view(1, 3, 1, 1)
+        std = torch.tensor([0.229, 0.224, 0.225], device=images.device).view(1, 3, 1, 1)
+        return (images - mean) / std, (h, w)
+
 
 class DPTHead(nn.Module):
     def __init__(
@@ -97,14 +97,38 @@ def preprocess(img, input_size, swap=(2, 0, 1)):
     padded_img = np.ascontiguousarray(padded_img, dtype=np.float32)
     return padded_img, r
 
-def inference_detector(session, oriImg):
-    input_shape = (640,640)
-    img, ratio = preprocess(oriImg, input_shape)
-
-    ort_inputs = {session.get_inputs()[0].name: img[None, :, :, :]}
-    output = session.run(None, ort_inputs)
-    predictions = demo_postprocess(output[0], input_shape)[0]
-
+def run_batches(session, inputs, batch_size = 8):
+    """
+    Runs an onnx session on the items of inputs (N, C, H, W) by batches and returns its concatenated outputs.
+    The input / output names are looked up once, models exported with a fixed batch size are fed padded batches.
+    """
+    input_name = session.get_inputs()[0].name
+    output_names = [out.name for out in session.get_outputs()]
+    fixed_batch_size = session.get_inputs()[0].shape[0]
+    if isinstance(fixed_batch_size, int) and fixed_batch_size > 0:
+        batch_size = fixed_batch_size
+    outputs = []
+    for start in range(0, len(inputs), batch_size):
+        batch = inputs[start:start + batch_size]
+        count = len(batch)
+        if fixed_batch_size == batch_size and count < batch_size:
+            batch = np.concatenate([batch, np.zeros((batch_size - count, *batch.shape[1:]), dtype=batch.dtype)])
+        outputs.append([output[:count] for output in session.run(output_names, {input_name: batch})])
+    return [np.concatenate([output[n] for output in outputs]) for n in range(len(output_names))]
+
+def preprocess_batch(imgs, input_size):
+    # letterboxed images (N, 3, H, W) and their resize ratios
+    batch = np.full((len(imgs), 3, input_size[0], input_size[1]), 114, dtype=np.float32)
+    ratios = []
+    for n, img in enumerate(imgs):
+        r = min(input_size[0] / img.shape[0], input_size[1] / img.shape[1])
+        h, w = int(img.shape[0] * r), int(img.shape[1] * r)
+        resized_img = cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR)
+        batch[n, :, :h, :w] = resized_img.reshape(h, w, -1).transpose(2, 0, 1)
+        ratios.append(r)
+    return batch, ratios
+
+def get_person_boxes(predictions, ratio):
     boxes = predictions[:, :4]
     scores = predictions[:, 4:5] * predictions[:, 5:]
 
@@ -125,3 +149,15 @@ def inference_detector(session, oriImg):
         final_boxes = np.array([])
 
     return final_boxes
+
+def inference_detector_batch(session, imgs, batch_size = 8):
+    # person boxes (x0, y0, x1, y1) of each image, the images are letterboxed and detected by batches
+    if len(imgs) == 0:
+        return []
+    input_shape = (640,640)
+    inputs, ratios = preprocess_batch(imgs, input_shape)
+    predictions = demo_postprocess(run_batches(session, inputs, batch_size)[0], input_shape)
+    return [get_person_boxes(prediction, ratio) for prediction, ratio in zip(predictions, ratios)]
+
+def inference_detector(session, oriImg):
+    return inference_detector_batch(session, [oriImg], 1)[0]
@@ -6,112 +6,100 @@ import cv2
 import numpy as np
 import onnxruntime as ort
 
+from .onnxdet import run_batches
+
+# normalization of the crops, in the channel order of the frames given to the annotator
+IMAGE_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+IMAGE_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+
+
 def preprocess(
-    img: np.ndarray, out_bbox, input_size: Tuple[int, int] = (192, 256)
-) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    """Do preprocessing for RTMPose model inference.
+    imgs: List[np.ndarray], bboxes_list, input_size: Tuple[int, int] = (192, 256)
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[int]]:
+    """Do preprocessing for RTMPose model inference, for all the persons detected in a list of images.
 
     Args:
-        img (np.ndarray): Input image in shape.
+        imgs (list[np.ndarray]): Input images.
+        bboxes_list (list): Bounding boxes (x0, y0, x1, y1) detected in each image, the whole image
+            is used when none was detected.
         input_size (tuple): Input image size in shape (w, h).
 
     Returns:
         tuple:
-        - resized_img (np.ndarray): Preprocessed image.
-        - center (np.ndarray): Center of image.
-        - scale (np.ndarray): Scale of image.
+        - crops (np.ndarray): Normalized crops of all the persons in shape (N, 3, h, w).
+        - center (np.ndarray): Centers of the crops in shape (N, 2).
+        - scale (np.ndarray): Scales of the crops in shape (N, 2).
+        - counts (list[int]): Number of crops of each image.
     """
-    # get shape of image
-    img_shape = img.shape[:2]
-    out_img, out_center, out_scale = [], [], []
-    if len(out_bbox) == 0:
-        out_bbox = [[0, 0, img_shape[1], img_shape[0]]]
-    for i in range(len(out_bbox)):
-        x0 = out_bbox[i][0]
-        y0 = out_bbox[i][1]
-        x1 = out_bbox[i][2]
-        y1 = out_bbox[i][3]
-        bbox = np.array([x0, y0, x1, y1])
-
-        # get center and scale
-        center, scale = bbox_xyxy2cs(bbox, padding=1.25)
+    w, h = input_size
+    boxes, counts = [], []
+    for img, bboxes in zip(imgs, bboxes_list):
+        if len(bboxes) == 0:
+            bboxes = [[0, 0, img.shape[1], img.shape[0]]]
+        boxes.append(np.asarray(bboxes, dtype=np.float64).reshape(-1, 4))
+        counts.append(len(boxes[-1]))
+    boxes = np.concatenate(boxes)
 
-        # do affine transformation
-        resized_img, scale = top_down_affine(input_size, scale, center, img)
+    # get centers and scales, fixed to the aspect ratio of the model input
+    center, scale = bbox_xyxy2cs(boxes, padding=1.25)
+    scale = _fix_aspect_ratio(scale, aspect_ratio=w / h)
 
-        # normalize image
-        mean = np.array([123.675, 116.28, 103.53])
-        std = np.array([58.395, 57.12, 57.375])
-        resized_img = (resized_img - mean) / std
+    # do affine transformations, the matrices of all the crops are computed at once
+    warp_mats = get_warp_matrices(center, scale, (w, h))
+    img_nos = np.repeat(np.arange(len(counts)), counts)
+    crops = np.empty((len(boxes), h, w, 3), dtype=np.uint8)
+    for n, (img_no, warp_mat) in enumerate(zip(img_nos, warp_mats)):
+        crops[n] = cv2.warpAffine(imgs[img_no], warp_mat, (int(w), int(h)), flags=cv2.INTER_LINEAR)
 
-        out_img.append(resized_img)
-        out_center.append(center)
-        out_scale.append(scale)
+    # normalize images
+    crops = (crops.astype(np.float32) - IMAGE_MEAN) / IMAGE_STD
+    crops = np.ascontiguousarray(crops.transpose(0, 3, 1, 2))
 
-    return out_img, out_center, out_scale
+    return crops, center, scale, counts
 
 
-def inference(sess: ort.InferenceSession, img: np.ndarray) -> np.ndarray:
+def inference(sess: ort.InferenceSession, imgs: np.ndarray, batch_size: int = 8) -> List[np.ndarray]:
     """Inference RTMPose model.
 
     Args:
         sess (ort.InferenceSession): ONNXRuntime session.
-        img (np.ndarray): Input image in shape.
+        imgs (np.ndarray): Input crops in shape (N, 3, h, w).
+        batch_size (int): Number of crops per run of the model.
 
     Returns:
-        outputs (np.ndarray): Output of RTMPose model.
+        outputs (list[np.ndarray]): SimCC x and y outputs of RTMPose model for all the crops.
     """
-    all_out = []
-    # build input
-    for i in range(len(img)):
-        input = [img[i].transpose(2, 0, 1)]
-
-        # build output
-        sess_input = {sess.get_inputs()[0].name: input}
-        sess_output = []
-        for out in sess.get_outputs():
-            sess_output.append(out.name)
-
-        # run model
-        outputs = sess.run(sess_output, sess_input)
-        all_out.append(outputs)
-
-    return all_out
+    return run_batches(sess, imgs, batch_size)
 
 
 def postprocess(outputs: List[np.ndarray],
                 model_input_size: Tuple[int, int],
-                center: Tuple[int, int],
-                scale: Tuple[int, int],
+                center: np.ndarray,
+                scale: np.ndarray,
                 simcc_split_ratio: float = 2.0
                 ) -> Tuple[np.ndarray, np.ndarray]:
     """Postprocess for RTMPose model output.
 
     Args:
-        outputs (np.ndarray): Output of RTMPose model.
+        outputs (list[np.ndarray]): SimCC x and y outputs of RTMPose model in shape (N, K, Wx) and (N, K, Wy).
         model_input_size (tuple): RTMPose model Input image size.
-        center (tuple): Center of bbox in shape (x, y).
-        scale (tuple): Scale of bbox in shape (w, h).
+        center (np.ndarray): Centers of bboxes in shape (N, 2).
+        scale (np.ndarray): Scales of bboxes in shape (N, 2).
         simcc_split_ratio (float): Split ratio of simcc.
 
     Returns:
         tuple:
-        - keypoints (np.ndarray): Rescaled keypoints.
-        - scores (np.ndarray): Model predict scores.
+        - keypoints (np.ndarray): Rescaled keypoints in shape (N, K, 2).
+        - scores (np.ndarray): Model predict scores in shape (N, K).
     """
-    all_key = []
-    all_score = []
-    for i in range(len(outputs)):
-        # use simcc to decode
-        simcc_x, simcc_y = outputs[i]
-        keypoints, scores = decode(simcc_x, simcc_y, simcc_split_ratio)
+    # use simcc to decode
+    simcc_x, simcc_y = outputs
+    keypoints, scores = decode(simcc_x, simcc_y, simcc_split_ratio)
 
-        # rescale keypoints
-        keypoints = keypoints / model_input_size * scale[i] + center[i] - scale[i] / 2
-        all_key.append(keypoints[0])
-        all_score.append(scores[0])
+    # rescale keypoints
+    keypoints = keypoints / np.asarray(model_input_size) * scale[:, None] + center[:, None] - scale[:, None] / 2
 
-    return np.array(all_key), np.array(all_score)
+    return keypoints, scores
 
 
 def bbox_xyxy2cs(bbox: np.ndarray,
@@ -254,6 +242,33 @@ def get_warp_matrix(center: np.ndarray,
     return warp_mat
 
 
+def get_warp_matrices(center: np.ndarray,
+                      scale: np.ndarray,
+                      output_size: Tuple[int, int]) -> np.ndarray:
+    """Calculate at once the matrices of get_warp_matrix without rotation nor
+    shift for several bboxes: the bbox is scaled to the output width and its
+    center moved to the center of the output.
+
+    Args:
+        center (np.ndarray[N, 2]): Centers of the bounding boxes (x, y).
+        scale (np.ndarray[N, 2]): Scales of the bounding boxes
+            wrt [width, height].
+        output_size (np.ndarray[2, ] | list(2,)): Size of the
+            destination heatmaps.
+
+    Returns:
+        np.ndarray: N 2x3 transformation matrices
+    """
+    dst_w, dst_h = output_size
+    ratio = dst_w / scale[:, 0]
+    warp_mats = np.zeros((len(center), 2, 3), dtype=np.float32)
+    warp_mats[:, 0, 0] = ratio
+    warp_mats[:, 1, 1] = ratio
+    warp_mats[:, 0, 2] = dst_w * 0.5 - ratio * center[:, 0]
+    warp_mats[:, 1, 2] = dst_h * 0.5 - ratio * center[:, 1]
+    return warp_mats
+
+
 def top_down_affine(input_size: dict, bbox_scale: dict, bbox_center: dict,
                     img: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     """Get the bbox image as the model input by affine transform.
@@ -352,11 +367,20 @@ def decode(simcc_x: np.ndarray, simcc_y: np.ndarray,
     return keypoints, scores
 
 
-def inference_pose(session, out_bbox, oriImg):
+def inference_pose_batch(session, bboxes_list, imgs, batch_size = 8):
+    # keypoints and scores of the persons of each image, the crops of all the images are processed together
+    if len(imgs) == 0:
+        return []
     h, w = session.get_inputs()[0].shape[2:]
     model_input_size = (w, h)
-    resized_img, center, scale = preprocess(oriImg, out_bbox, model_input_size)
-    outputs = inference(session, resized_img)
+    crops, center, scale, counts = preprocess(imgs, bboxes_list, model_input_size)
+    outputs = inference(session, crops, batch_size)
     keypoints, scores = postprocess(outputs, model_input_size, center, scale)
+    splits = np.cumsum(counts)[:-1]
+    return list(zip(np.split(keypoints, splits), np.split(scores, splits)))
+
 
-    return keypoints, scores
\ No newline at end of file
+def inference_pose(session, out_bbox, oriImg):
+    keypoints, scores = inference_pose_batch(session, [out_bbox], [oriImg], 1)[0]
+
+    return keypoints, scores
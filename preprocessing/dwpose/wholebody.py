@@ -3,8 +3,8 @@
 import cv2
 import numpy as np
 import onnxruntime as ort
-from .onnxdet import inference_detector
-from .onnxpose import inference_pose
+from .onnxdet import inference_detector_batch
+from .onnxpose import inference_pose_batch
 
 def HWC3(x):
     assert x.dtype == np.uint8
@@ -37,44 +37,56 @@ def resize_image(input_image, resolution):
     img = cv2.resize(input_image, (W, H), interpolation=cv2.INTER_LANCZOS4 if k > 1 else cv2.INTER_AREA)
     return img
 
-class Wholebody:
-    def __init__(self, onnx_det, onnx_pose, device = 'cuda:0'):
+def create_session(model_path, device, intra_op_threads = 0):
+    # intra_op_threads: threads used by the cpu provider for each run, 0 keeps the onnxruntime default
+    providers = ['CPUExecutionProvider'] if str(device).startswith('cpu') else ['CUDAExecutionProvider', 'CPUExecutionProvider']
+    options = ort.SessionOptions()
+    if intra_op_threads > 0:
+        options.intra_op_num_threads = intra_op_threads
+    return ort.InferenceSession(path_or_bytes=model_path, sess_options=options, providers=providers)
 
-        providers = ['CPUExecutionProvider'
-                 ] if device == 'cpu' else ['CUDAExecutionProvider']
-        # onnx_det = 'annotator/ckpts/yolox_l.onnx'
-        # onnx_pose = 'annotator/ckpts/dw-ll_ucoco_384.onnx'
 
-        self.session_det = ort.InferenceSession(path_or_bytes=onnx_det, providers=providers)
-        self.session_pose = ort.InferenceSession(path_or_bytes=onnx_pose, providers=providers)
-    
-    def __call__(self, ori_img):
-        det_result = inference_detector(self.session_det, ori_img)
-        keypoints, scores = inference_pose(self.session_pose, det_result, ori_img)
+def to_openpose_keypoints(keypoints, scores):
+    keypoints_info = np.concatenate(
+        (keypoints, scores[..., None]), axis=-1)
+    # compute neck joint
+    neck = np.mean(keypoints_info[:, [5, 6]], axis=1)
+    # neck score when visualizing pred
+    neck[:, 2:4] = np.logical_and(
+        keypoints_info[:, 5, 2:4] > 0.3,
+        keypoints_info[:, 6, 2:4] > 0.3).astype(int)
+    new_keypoints_info = np.insert(
+        keypoints_info, 17, neck, axis=1)
+    mmpose_idx = [
+        17, 6, 8, 10, 7, 9, 12, 14, 16, 13, 15, 2, 1, 4, 3
+    ]
+    openpose_idx = [
+        1, 2, 3, 4, 6, 7, 8, 9, 10, 12, 13, 14, 15, 16, 17
+    ]
+    new_keypoints_info[:, openpose_idx] = \
+        new_keypoints_info[:, mmpose_idx]
+    keypoints_info = new_keypoints_info
+
+    keypoints, scores = keypoints_info[
+        ..., :2], keypoints_info[..., 2]
+    return keypoints, scores
 
-        keypoints_info = np.concatenate(
-            (keypoints, scores[..., None]), axis=-1)
-        # compute neck joint
-        neck = np.mean(keypoints_info[:, [5, 6]], axis=1)
-        # neck score when visualizing pred
-        neck[:, 2:4] = np.logical_and(
-            keypoints_info[:, 5, 2:4] > 0.3,
-            keypoints_info[:, 6, 2:4] > 0.3).astype(int)
-        new_keypoints_info = np.insert(
-            keypoints_info, 17, neck, axis=1)
-        mmpose_idx = [
-            17, 6, 8, 10, 7, 9, 12, 14, 16, 13, 15, 2, 1, 4, 3
-        ]
-        openpose_idx = [
-            1, 2, 3, 4, 6, 7, 8, 9, 10, 12, 13, 14, 15, 16, 17
-        ]
-        new_keypoints_info[:, openpose_idx] = \
-            new_keypoints_info[:, mmpose_idx]
-        keypoints_info = new_keypoints_info
 
-        keypoints, scores = keypoints_info[
-            ..., :2], keypoints_info[..., 2]
-        
-        return keypoints, scores, det_result
+class Wholebody:
+    def __init__(self, onnx_det, onnx_pose, device = 'cuda:0', intra_op_threads = 0, batch_size = 8):
+        # onnx_det = 'annotator/ckpts/yolox_l.onnx'
+        # onnx_pose = 'annotator/ckpts/dw-ll_ucoco_384.onnx'
 
+        self.session_det = create_session(onnx_det, device, intra_op_threads)
+        self.session_pose = create_session(onnx_pose, device, intra_op_threads)
+        self.batch_size = batch_size
+
+    def __call__(self, ori_img):
+        return self.batch([ori_img])[0]
 
+    def batch(self, ori_imgs):
+        # (keypoints, scores, det_result) of each image: persons are detected by batches of images and the crops of
+        # all the persons found are given to the pose model together
+        det_results = inference_detector_batch(self.session_det, ori_imgs, self.batch_size)
+        poses = inference_pose_batch(self.session_pose, det_results, ori_imgs, self.batch_size)
+        return [to_openpose_keypoints(keypoints, scores) + (det_result,) for (keypoints, scores), det_result in zip(poses, det_results)]
@@ -35,24 +35,53 @@ class FlowAnnotator:
         self.model = self.model.to(self.device).eval()
         self.InputPadder = InputPadder
         self.flow_viz = flow_viz
+        # pairs of frames per batch, the correlation volume of a pair takes ~200 MB at 832x480
+        self.batch_size = max(int(cfg.get("BATCH_SIZE", 4)), 1)
+        self.iters = cfg.get("ITERS", 20)
+
+    def to_tensor(self, frames):
+        frames = np.stack([np.asarray(frame, dtype=np.uint8) for frame in frames])
+        return torch.from_numpy(frames).to(self.device).permute(0, 3, 1, 2).float()
+
+    def iter_flows(self, frames):
+        # flows of the consecutive pairs of frames (n, 2, h, w), yielded by batches of pairs: frames are moved to the
+        # device and encoded one batch at a time, and the encoding of the last frame of a batch is reused by the next one
+        if len(frames) < 2:
+            return
+        padder = self.InputPadder(np.asarray(frames[0]).shape[:2])
+        fmap = net = inp = None
+        with torch.no_grad():
+            for start in range(0, len(frames) - 1, self.batch_size):
+                end = min(start + self.batch_size, len(frames) - 1)
+                images = padder.pad(self.to_tensor(frames[start if fmap is None else start + 1: end + 1]))[0]
+                fmaps, nets, inps = self.model.encode(images)
+                images = None
+                if fmap is not None:
+                    fmaps, nets, inps = torch.cat([fmap, fmaps]), torch.cat([net, nets]), torch.cat([inp, inps])
+                _, flows = self.model.refine(fmaps[:-1], fmaps[1:], nets[:-1], inps[:-1], iters=self.iters, test_mode=True)
+                fmap, net, inp = fmaps[-1:], nets[-1:], inps[-1:]
+                fmaps = nets = inps = None
+                yield padder.unpad(flows)
 
     def forward(self, frames):
         # frames / RGB
-        frames = [torch.from_numpy(convert_to_numpy(frame).astype(np.uint8)).permute(2, 0, 1).float()[None].to(self.device) for frame in frames]
         flow_up_list, flow_up_vis_list = [], []
-        with torch.no_grad():
-            for i, (image1, image2) in enumerate(zip(frames[:-1], frames[1:])):
-                padder = self.InputPadder(image1.shape)
-                image1, image2 = padder.pad(image1, image2)
-                flow_low, flow_up = self.model(image1, image2, iters=20, test_mode=True)
-                flow_up = flow_up[0].permute(1, 2, 0).cpu().numpy()
-                flow_up_vis = self.flow_viz.flow_to_image(flow_up)
-                flow_up_list.append(flow_up)
-                flow_up_vis_list.append(flow_up_vis)
+        for flows in self.iter_flows(frames):
+            flow_up_vis_list += list(self.flow_viz.flow_to_image_batch(flows).cpu().numpy())
+            flow_up_list += list(flows.permute(0, 2, 3, 1).cpu().numpy())
         return flow_up_list, flow_up_vis_list  # RGB
 
 
 class FlowVisAnnotator(FlowAnnotator):
     def forward(self, frames):
-        flow_up_list, flow_up_vis_list = super().forward(frames)
-        return flow_up_vis_list[:1] + flow_up_vis_list
\ No newline at end of file
+        if len(frames) < 2:
+            return []
+        h, w = np.asarray(frames[0]).shape[:2]
+        # one map per frame, the first frame gets the map of the first pair
+        flow_maps = np.empty((len(frames), h, w, 3), dtype=np.uint8)
+        pos = 1
+        for flows in self.iter_flows(frames):
+            flow_maps[pos:pos + len(flows)] = self.flow_viz.flow_to_image_batch(flows).cpu().numpy()
+            pos += len(flows)
+        flow_maps[0] = flow_maps[1]
+        return list(flow_maps)
@@ -0,0 +1,172 @@
+import os
+import shutil
+import weakref
+import tempfile
+import threading
+
+import numpy as np
+
+# annotators whose output for a frame only depends on this frame, so that their results can be reused across windows
+# (depth maps are normalized with the depth range of the whole clip, so they are not)
+PER_FRAME_ANNOTATORS = ["pose", "gray", "canny", "scribble"]
+
+
+class FrameStore:
+    """Frames of the same shape saved in memory mapped files, allocated by chunks as frames are added."""
+
+    def __init__(self, root, shape, dtype = np.uint8, chunk_frames = 32):
+        self.root = root
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self.slots = {}
+        self.chunks = []
+        self.lock = threading.Lock()
+
+    def _get_slot(self, key):
+        with self.lock:
+            slot = self.slots.get(key, None)
+            if slot is None:
+                slot = len(self.slots)
+                if slot // self.chunk_frames >= len(self.chunks):
+                    os.makedirs(self.root, exist_ok=True)
+                    chunk_path = os.path.join(self.root, f"{len(self.chunks)}.npy")
+                    self.chunks.append(np.lib.format.open_memmap(chunk_path, mode="w+", dtype=self.dtype, shape=(self.chunk_frames,) + self.shape))
+                self.slots[key] = slot
+            return slot
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def get(self, key):
+        slot = self.slots.get(key, None)
+        if slot is None:
+            return None
+        return np.array(self.chunks[slot // self.chunk_frames][slot % self.chunk_frames])
+
+    def put(self, key, frame):
+        if frame.shape != self.shape or frame.dtype != self.dtype:
+            return False
+        slot = self._get_slot(key)
+        self.chunks[slot // self.chunk_frames][slot % self.chunk_frames] = frame
+        return True
+
+    def release(self):
+        self.chunks = []
+        self.slots = {}
+
+
+class CachedVideo:
+    """Window of a video resampled at a target fps, whose frames are decoded and resized only once per task."""
+
+    def __init__(self, cache, path, frame_nos):
+        self.cache = cache
+        self.path = path
+        self.frame_nos = list(frame_nos)
+
+    def __len__(self):
+        return len(self.frame_nos)
+
+    def get_frame_shape(self):
+        return self.cache._get_frame_shape(self.path)
+
+    def get_resized_frames(self, width, height, method = "torch", device = "cpu", max_workers = 1):
+        from wan.utils.utils import resize_frames
+        store = self.cache._get_store(self.path, (method, "frames"), width, height, self.get_frame_shape()[-1:])
+        missing_nos = sorted(set(frame_no for frame_no in self.frame_nos if frame_no not in store))
+        if len(missing_nos) > 0:
+            frames = resize_frames(self.cache._decode(self.path, missing_nos), width, height, method = method, device = device, max_workers = max_workers)
+            for frame_no, frame in zip(missing_nos, frames):
+                store.put(frame_no, frame)
+            frames = None
+        if len(self.frame_nos) == 0:
+            return np.zeros((0, height, width) + self.get_frame_shape()[-1:], dtype=np.uint8)
+        return np.stack([store.get(frame_no) for frame_no in self.frame_nos])
+
+    def get_annotations(self, process_type, width, height, frames, annotator):
+        # frames must be the resized frames of this video, only the frames never seen before are annotated
+        if process_type not in PER_FRAME_ANNOTATORS:
+            return annotator(frames)
+        key_prefix = (self.path, process_type, width, height)
+        stores = self.cache.annotation_stores
+        results = [None] * len(frames)
+        missing = []
+        for i, frame_no in enumerate(self.frame_nos[:len(frames)]):
+            for store_key, store in stores.items():
+                if store_key[:4] == key_prefix and frame_no in store:
+                    results[i] = store.get(frame_no)
+                    break
+            else:
+                missing.append(i)
+        if len(missing) > 0:
+            annotations = annotator([frames[i] for i in missing])
+            for i, annotation in zip(missing, annotations):
+                results[i] = annotation
+                if isinstance(annotation, np.ndarray):
+                    store = self.cache._get_store(self.path, process_type, width, height, annotation.shape, annotation.dtype, annotation = True)
+                    store.put(self.frame_nos[i], annotation)
+        return results
+
+
+class VideoFrameCache:
+    """
+    Per task cache of the control / mask / source video frames: resized frames and the outputs of the per frame annotators
+    are kept in memory mapped files, so that the overlapping frames of sliding windows and a second control type
+    don't decode, resize or annotate the same frames again.
+    """
+
+    def __init__(self, root = None):
+        self.root = tempfile.mkdtemp(prefix="wgp_frames_", dir=root)
+        self.readers = {}
+        self.frame_shapes = {}
+        self.frame_stores = {}
+        self.annotation_stores = {}
+        self.lock = threading.Lock()
+        # the files are removed even if the task ends with an exception before release is called
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.root, True)
+
+    def _get_reader(self, path):
+        reader = self.readers.get(path, None)
+        if reader is None:
+            import decord
+            reader = decord.VideoReader(path)
+            self.readers[path] = reader
+        return reader
+
+    def _decode(self, path, frame_nos):
+        import decord
+        decord.bridge.set_bridge('torch')
+        return self._get_reader(path).get_batch(frame_nos).cpu().numpy()
+
+    def _get_frame_shape(self, path):
+        shape = self.frame_shapes.get(path, None)
+        if shape is None:
+            shape = self.frame_shapes[path] = tuple(self._decode(path, [0])[0].shape)
+        return shape
+
+    def _get_store(self, path, kind, width, height, shape, dtype = np.uint8, annotation = False):
+        stores = self.annotation_stores if annotation else self.frame_stores
+        shape = (height, width) + tuple(shape) if not annotation else tuple(shape)
+        key = (path, kind, width, height, shape, np.dtype(dtype).str)
+        with self.lock:
+            store = stores.get(key, None)
+            if store is None:
+                store = stores[key] = FrameStore(os.path.join(self.root, str(len(self.frame_stores) + len(self.annotation_stores))), shape, dtype)
+            return store
+
+    def get_video(self, path, start_frame, max_frames, target_fps):
+        from wan.utils.utils import resample
+        reader = self._get_reader(path)
+        fps = round(reader.get_avg_fps())
+        if max_frames < 0:
+            max_frames = max(len(reader)/ fps * target_fps + max_frames, 0)
+        frame_nos = resample(fps, len(reader), max_target_frames_count= max_frames, target_fps=target_fps, start_target_frame= start_frame)
+        return CachedVideo(self, path, frame_nos)
+
+    def release(self):
+        for store in list(self.frame_stores.values()) + list(self.annotation_stores.values()):
+            store.release()
+        self.frame_stores = {}
+        self.annotation_stores = {}
+        self.readers = {}
+        self._finalizer()
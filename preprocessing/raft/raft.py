@@ -83,37 +83,43 @@ class RAFT(nn.Module):
         return up_flow.reshape(N, 2, 8*H, 8*W)
 
 
-    def forward(self, image1, image2, iters=12, flow_init=None, upsample=True, test_mode=False):
-        """ Estimate optical flow between pair of frames """
-
-        image1 = 2 * (image1 / 255.0) - 1.0
-        image2 = 2 * (image2 / 255.0) - 1.0
+    def encode(self, images, context=True):
+        """ Feature maps and context (hidden state, input features) of a batch of frames, so that each frame of a video
+        is encoded once and reused as first and second frame of the pairs it belongs to """
 
-        image1 = image1.contiguous()
-        image2 = image2.contiguous()
+        images = 2 * (images / 255.0) - 1.0
+        images = images.contiguous()
 
         hdim = self.hidden_dim
         cdim = self.context_dim
 
         # run the feature network
         with autocast('cuda', enabled=self.args.mixed_precision):
-            fmap1, fmap2 = self.fnet([image1, image2])        
-        
-        fmap1 = fmap1.float()
-        fmap2 = fmap2.float()
-        if self.args.alternate_corr:
-            corr_fn = AlternateCorrBlock(fmap1, fmap2, radius=self.args.corr_radius)
-        else:
-            corr_fn = CorrBlock(fmap1, fmap2, radius=self.args.corr_radius)
+            fmaps = self.fnet(images)
+
+        if not context:
+            return fmaps.float(), None, None
 
         # run the context network
         with autocast('cuda', enabled=self.args.mixed_precision):
-            cnet = self.cnet(image1)
+            cnet = self.cnet(images)
             net, inp = torch.split(cnet, [hdim, cdim], dim=1)
             net = torch.tanh(net)
             inp = torch.relu(inp)
 
-        coords0, coords1 = self.initialize_flow(image1)
+        return fmaps.float(), net, inp
+
+    def refine(self, fmap1, fmap2, net, inp, iters=12, flow_init=None, upsample=True, test_mode=False):
+        """ Estimate optical flow from the encodings of pairs of frames """
+
+        if self.args.alternate_corr:
+            corr_fn = AlternateCorrBlock(fmap1, fmap2, radius=self.args.corr_radius)
+        else:
+            corr_fn = CorrBlock(fmap1, fmap2, radius=self.args.corr_radius)
+
+        N, _, H, W = fmap1.shape
+        coords0 = coords_grid(N, H, W).to(fmap1.device)
+        coords1 = coords_grid(N, H, W).to(fmap1.device)
 
         if flow_init is not None:
             coords1 = coords1 + flow_init
@@ -130,6 +136,10 @@ class RAFT(nn.Module):
             # F(t+1) = F(t) + \Delta(t)
             coords1 = coords1 + delta_flow
 
+            # in test mode, only the last prediction is upsampled
+            if test_mode and itr < iters - 1:
+                continue
+
             # upsample predictions
             if up_mask is None:
                 flow_up = upflow8(coords1 - coords0)
@@ -142,3 +152,10 @@ class RAFT(nn.Module):
             return coords1 - coords0, flow_up
             
         return flow_predictions
+
+    def forward(self, image1, image2, iters=12, flow_init=None, upsample=True, test_mode=False):
+        """ Estimate optical flow between pair of frames """
+
+        fmap1, net, inp = self.encode(image1)
+        fmap2, _, _ = self.encode(image2, context=False)
+        return self.refine(fmap1, fmap2, net, inp, iters=iters, flow_init=flow_init, upsample=upsample, test_mode=test_mode)
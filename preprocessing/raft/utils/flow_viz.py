@@ -129,4 +129,39 @@ def flow_to_image(flow_uv, clip_flow=None, convert_to_bgr=False):
     epsilon = 1e-5
     u = u / (rad_max + epsilon)
     v = v / (rad_max + epsilon)
-    return flow_uv_to_colors(u, v, convert_to_bgr)
\ No newline at end of file
+    return flow_uv_to_colors(u, v, convert_to_bgr)
+
+def flow_to_image_batch(flows_uv, clip_flow=None):
+    """
+    Batched torch version of flow_to_image, the flows are colorized on their device in one pass.
+
+    Args:
+        flows_uv (torch.Tensor): Flows of shape [N,2,H,W]
+        clip_flow (float, optional): Clip maximum of flow values. Defaults to None.
+
+    Returns:
+        torch.Tensor: RGB uint8 flow visualization images of shape [N,H,W,3]
+    """
+    import torch
+    flows_uv = flows_uv.float()
+    if clip_flow is not None:
+        flows_uv = flows_uv.clamp(0, clip_flow)
+    u, v = flows_uv[:, 0], flows_uv[:, 1]
+    # each flow is normalized by its own maximum radius, as in flow_to_image
+    rad_max = torch.sqrt(torch.square(u) + torch.square(v)).flatten(1).max(dim=1)[0].view(-1, 1, 1)
+    epsilon = 1e-5
+    u = u / (rad_max + epsilon)
+    v = v / (rad_max + epsilon)
+
+    colorwheel = torch.from_numpy(make_colorwheel() / 255.0).to(device=flows_uv.device, dtype=torch.float32)
+    ncols = colorwheel.shape[0]
+    rad = torch.sqrt(torch.square(u) + torch.square(v)).unsqueeze(-1)
+    a = torch.atan2(-v, -u) / np.pi
+    fk = (a + 1) / 2 * (ncols - 1)
+    k0 = torch.floor(fk).long()
+    k1 = k0 + 1
+    k1[k1 == ncols] = 0
+    f = (fk - k0).unsqueeze(-1)
+    col = (1 - f) * colorwheel[k0] + f * colorwheel[k1]
+    col = torch.where(rad <= 1, 1 - rad * (1 - col), col * 0.75)   # out of range
+    return torch.floor(255 * col).to(torch.uint8)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+CPU check of the tile schedulers of the Hunyuan VAE (hyvideo/vae/tile_parallel.py): the tiled decode of a tiny random
+weights VAE spread over 2 worker processes ("processes" pool and "distributed" gloo group) must match the decode done
+in a single process.
+Run with `python test_tile_parallel.py` or `python -m pytest test_tile_parallel.py`.
+"""
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+WORLD_SIZE = 2
+
+
+def build_tiny_vae(seed = 0):
+    from hyvideo.vae.autoencoder_kl_causal_3d import AutoencoderKLCausal3D
+    torch.manual_seed(seed)
+    vae = AutoencoderKLCausal3D(
+        down_block_types=("DownEncoderBlockCausal3D", "DownEncoderBlockCausal3D"),
+        up_block_types=("UpDecoderBlockCausal3D", "UpDecoderBlockCausal3D"),
+        block_out_channels=(16, 16),
+        layers_per_block=1,
+        latent_channels=4,
+        norm_num_groups=8,
+        sample_size=16,
+        spatial_compression_ratio=2,
+        time_compression_ratio=4,
+        mid_block_add_attention=False,
+    )
+    vae.enable_tiling()
+    return vae.float().eval().requires_grad_(False)
+
+
+def get_latents(seed = 1):
+    # 14x14 latents with tiles of 8 latents: 3x3 tiles of different shapes
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn(1, 4, 2, 14, 14, generator=generator)
+
+
+def decode(vae, z):
+    with torch.no_grad():
+        return vae.decode(z, return_dict=False)[0]
+
+
+def check_same(reference, result, name):
+    assert reference.shape == result.shape, f"{name}: shape {tuple(result.shape)} instead of {tuple(reference.shape)}"
+    max_diff = (reference - result).abs().max().item()
+    assert max_diff <= 1e-4, f"{name}: max difference {max_diff} with the single process decode"
+
+
+def test_processes_scheduler():
+    vae, z = build_tiny_vae(), get_latents()
+    reference = decode(vae, z)
+    vae.enable_tile_parallel("processes", devices = ["cpu"] * WORLD_SIZE)
+    try:
+        result = decode(vae, z)
+    finally:
+        vae.disable_tile_parallel()
+    check_same(reference, result, "processes")
+
+
+def _distributed_worker(rank, init_method):
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=WORLD_SIZE)
+    try:
+        # every rank builds the same model and latents from the same seeds
+        vae, z = build_tiny_vae(), get_latents()
+        reference = decode(vae, z)
+        vae.enable_tile_parallel("distributed")
+        result = decode(vae, z)
+        vae.disable_tile_parallel()
+        check_same(reference, result, f"distributed rank {rank}")
+    finally:
+        dist.destroy_process_group()
+
+
+def test_distributed_scheduler():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    # an exception raised by a rank is raised again here
+    mp.spawn(_distributed_worker, args=(f"tcp://127.0.0.1:{port}",), nprocs=WORLD_SIZE, join=True)
+
+
+if __name__ == "__main__":
+    torch.set_num_threads(1)
+    test_processes_scheduler()
+    print("✓ processes scheduler matches the single process decode")
+    test_distributed_scheduler()
+    print("✓ distributed (gloo) scheduler matches the single process decode")
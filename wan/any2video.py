@@ -30,6 +30,7 @@ from wan.modules.posemb_layers import get_rotary_pos_embed
 from .utils.vace_preprocessor import VaceVideoProcessor
 from wan.utils.basic_flowmatch import FlowMatchScheduler
 from wan.utils.utils import get_outpainting_frame_location, resize_lanczos, calculate_new_dimensions
+from wan.utils.profiler import profiler
 from .multitalk.multitalk_utils import MomentumBuffer, adaptive_projected_guidance, match_and_blend_colors, match_and_blend_colors_with_mask
 from mmgp import safetensors2
 
@@ -160,18 +161,18 @@ class WanAny2V:
         self.num_timesteps = 1000 
         self.use_timestep_transform = True 
 
-    def vace_encode_frames(self, frames, ref_images, masks=None, tile_size = 0, overlapped_latents = None):
+    def vace_encode_frames(self, frames, ref_images, masks=None, tile_size = 0, overlapped_latents = None, tile_batch_size = 1):
         if ref_images is None:
             ref_images = [None] * len(frames)
         else:
             assert len(frames) == len(ref_images)
 
         if masks is None:
-            latents = self.vae.encode(frames, tile_size = tile_size)
+            latents = self.vae.encode(frames, tile_size = tile_size, tile_batch_size = tile_batch_size)
         else:
             inactive = [i * (1 - m) + 0 * m for i, m in zip(frames, masks)]
             reactive = [i * m + 0 * (1 - m) for i, m in zip(frames, masks)]
-            inactive = self.vae.encode(inactive, tile_size = tile_size)
+            inactive = self.vae.encode(inactive, tile_size = tile_size, tile_batch_size = tile_batch_size)
 
             if overlapped_latents  != None and False : # disabled as quality seems worse
                 # inactive[0][:, 0:1] = self.vae.encode([frames[0][:, 0:1]], tile_size = tile_size)[0] # redundant
@@ -179,16 +180,16 @@ class WanAny2V:
                     t[:, 1:overlapped_latents.shape[1] + 1] = overlapped_latents
                 overlapped_latents[: 0:1] = inactive[0][: 0:1]
 
-            reactive = self.vae.encode(reactive, tile_size = tile_size)
+            reactive = self.vae.encode(reactive, tile_size = tile_size, tile_batch_size = tile_batch_size)
             latents = [torch.cat((u, c), dim=0) for u, c in zip(inactive, reactive)]
 
         cat_latents = []
         for latent, refs in zip(latents, ref_images):
             if refs is not None:
                 if masks is None:
-                    ref_latent = self.vae.encode(refs, tile_size = tile_size)
+                    ref_latent = self.vae.encode(refs, tile_size = tile_size, tile_batch_size = tile_batch_size)
                 else:
-                    ref_latent = self.vae.encode(refs, tile_size = tile_size)
+                    ref_latent = self.vae.encode(refs, tile_size = tile_size, tile_batch_size = tile_batch_size)
                     ref_latent = [torch.cat((u, torch.zeros_like(u)), dim=0) for u in ref_latent]
                 assert all([x.shape[1] == 1 for x in ref_latent])
                 latent = torch.cat([*ref_latent, latent], dim=1)
@@ -379,6 +380,7 @@ class WanAny2V:
         callback = None,
         enable_RIFLEx = None,
         VAE_tile_size = 0,
+        VAE_tile_batch_size = 1,
         joint_pass = False,
         slg_layers = None,
         slg_start = 0.0,
@@ -405,6 +407,7 @@ class WanAny2V:
         color_correction_strength = 1,
         prefix_frames_count = 0,
         image_mode = 0,
+        output_stream = None,
 
         **bbargs
                 ):
@@ -451,8 +454,9 @@ class WanAny2V:
         # Text Encoder
         if n_prompt == "":
             n_prompt = self.sample_neg_prompt
-        context = self.text_encoder([input_prompt], self.device)[0]
-        context_null = self.text_encoder([n_prompt], self.device)[0]
+        with profiler.span("text encoding"):
+            context = self.text_encoder([input_prompt], self.device)[0]
+            context_null = self.text_encoder([n_prompt], self.device)[0]
         context = context.to(self.dtype)
         context_null = context_null.to(self.dtype)
         text_len = self.model.text_len
@@ -569,7 +573,7 @@ class WanAny2V:
             msk = msk.transpose(1, 2)[0]
 
 
-            lat_y = self.vae.encode([enc], VAE_tile_size, any_end_frame= any_end_frame and add_frames_for_end_image)[0]
+            lat_y = self.vae.encode([enc], VAE_tile_size, any_end_frame= any_end_frame and add_frames_for_end_image, tile_batch_size = VAE_tile_batch_size)[0]
             overlapped_latents_frames_num = int(1 + (preframes_count-1) // 4)
             if overlapped_latents != None:
                 # disabled because looks worse
@@ -640,11 +644,11 @@ class WanAny2V:
             input_ref_images = [ None if u == None else [v.to(self.device) for v in u]  for u in input_ref_images]
             input_masks = [u.to(self.device) for u in input_masks]
             if self.background_mask != None: self.background_mask = [m.to(self.device) for m in self.background_mask]
-            z0 = self.vace_encode_frames(input_frames, input_ref_images, masks=input_masks, tile_size = VAE_tile_size, overlapped_latents = overlapped_latents )
+            z0 = self.vace_encode_frames(input_frames, input_ref_images, masks=input_masks, tile_size = VAE_tile_size, overlapped_latents = overlapped_latents, tile_batch_size = VAE_tile_batch_size )
             m0 = self.vace_encode_masks(input_masks, input_ref_images)
             if self.background_mask != None:
                 color_reference_frame = input_ref_images[0][0].clone()
-                zbg = self.vace_encode_frames([ref_img[0] for ref_img in input_ref_images], None, masks=self.background_mask, tile_size = VAE_tile_size )
+                zbg = self.vace_encode_frames([ref_img[0] for ref_img in input_ref_images], None, masks=self.background_mask, tile_size = VAE_tile_size, tile_batch_size = VAE_tile_batch_size )
                 mbg = self.vace_encode_masks(self.background_mask, None)
                 for zz0, mm0, zzbg, mmbg in zip(z0, m0, zbg, mbg):
                     zz0[:, 0:1] = zzbg
@@ -707,6 +711,11 @@ class WanAny2V:
                 self.model.accumulated_err, self.model.accumulated_steps, self.model.accumulated_ratio  = [0.0] * x_count, [0] * x_count, [1.0] * x_count
                 self.model.one_for_all = x_count > 2
 
+        # step invariant conditioning is computed once, unless loras whose multipliers change during the steps may alter it
+        cond_cache = getattr(self.model, "use_cond_cache", False) and not any(isinstance(slist, list) and len(set(slist)) > 1 for slist in (loras_slists or []))
+        for model in [self.model, self.model2]:
+            if model is not None: model.enable_cond_cache(cond_cache)
+
         if callback != None:
             callback(-1, None, True)
 
@@ -736,10 +745,15 @@ class WanAny2V:
 
         # denoising
         trans = self.model
+        step_span = None
         for i, t in enumerate(tqdm(timesteps)):
+            profiler.end(step_span)
+            step_span = profiler.begin("denoising step", step = i)
             if not guidance_switch_done and t <= switch_threshold:
                 guide_scale = guide2_scale
-                if self.model2 is not None: trans = self.model2
+                if self.model2 is not None:
+                    self.model.enable_cond_cache(False)
+                    trans = self.model2
                 guidance_switch_done = True
  
             offload.set_step_no_for_lora(trans, i)
@@ -801,7 +815,8 @@ class WanAny2V:
                 }
 
             if joint_pass and guide_scale > 1:
-                ret_values = trans( **gen_args , **kwargs)
+                with profiler.span("model pass", passes = len(gen_args["x"])):
+                    ret_values = trans( **gen_args , **kwargs)
                 if self._interrupt:
                     return None               
             else:
@@ -809,7 +824,8 @@ class WanAny2V:
                 ret_values = [None] * size
                 for x_id in range(size):
                     sub_gen_args = {k : [v[x_id]] for k, v in gen_args.items() }
-                    ret_values[x_id] = trans( **sub_gen_args, x_id= x_id , **kwargs)[0]
+                    with profiler.span("model pass", x_id = x_id):
+                        ret_values[x_id] = trans( **sub_gen_args, x_id= x_id , **kwargs)[0]
                     if self._interrupt:
                         return None               
                 sub_gen_args = None
@@ -882,6 +898,7 @@ class WanAny2V:
                 if len(latents_preview) > 1: latents_preview = latents_preview.transpose(0,2)
                 callback(i, latents_preview[0], False)
                 latents_preview = None
+        profiler.end(step_span)
 
         if vace and ref_images_count > 0: latents = latents[:, :, ref_images_count:]
         if trim_frames > 0:  latents=  latents[:, :,:-trim_frames]
@@ -892,8 +909,15 @@ class WanAny2V:
 
         if chipmunk:
             self.model.release_chipmunk() # need to add it at every exit when in prod
+        for model in [self.model, self.model2]:
+            if model is not None: model.enable_cond_cache(False)
+
+        if output_stream is not None and not image_outputs and return_latent_slice == None and not (color_correction_strength > 0 and prefix_frames_count > 0):
+            # nothing needs the full video afterwards: the frames are handed to the writer as they are decoded
+            frames_count = output_stream(self.vae.decode_stream(x0[0], VAE_tile_size, tile_batch_size = VAE_tile_batch_size))
+            return { "x" : None, "streamed_frames_count" : frames_count }
 
-        videos = self.vae.decode(x0, VAE_tile_size)
+        videos = self.vae.decode(x0, VAE_tile_size, tile_batch_size = VAE_tile_batch_size)
 
         if image_outputs:
             videos = torch.cat([video[:,:1] for video in videos], dim=1) if len(videos) > 1 else videos[0][:,:1]
@@ -18,7 +18,7 @@ from wan.modules.posemb_layers import get_rotary_pos_embed
 from wan.utils.utils import calculate_new_dimensions
 from .utils.fm_solvers import (FlowDPMSolverMultistepScheduler,
                                get_sampling_sigmas, retrieve_timesteps)
-from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler, FlowUniPCMultiFrameScheduler
 from wan.utils.utils import update_loras_slists
 
 class DTT2V:
@@ -128,8 +128,7 @@ class DTT2V:
         casual_block_size=1,
         shrink_interval_with_mask=False,
     ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, list[tuple]]:
-        step_matrix, step_index = [], []
-        update_mask, valid_interval = [], []
+        valid_interval = []
         num_iterations = len(step_template) + 1
         num_frames_block = num_frames // casual_block_size
         base_num_frames_block = base_num_frames // casual_block_size
@@ -146,46 +145,36 @@ class DTT2V:
                 torch.tensor([0], dtype=torch.int64, device=step_template.device),
             ]
         )  # to handle the counter in row works starting from 1
-        pre_row = torch.zeros(num_frames_block, dtype=torch.long)
-        if num_pre_ready > 0:
-            pre_row[: num_pre_ready // casual_block_size] = num_iterations
-
-        while torch.all(pre_row >= (num_iterations - 1)) == False:
-            new_row = torch.zeros(num_frames_block, dtype=torch.long)
-            for i in range(num_frames_block):
-                if i == 0 or pre_row[i - 1] >= (
-                    num_iterations - 1
-                ):  # the first frame or the last frame is completely denoised
-                    new_row[i] = pre_row[i] + 1
-                else:
-                    new_row[i] = new_row[i - 1] - ar_step
-            new_row = new_row.clamp(0, num_iterations)
-
-            update_mask.append(
-                (new_row != pre_row) & (new_row != num_iterations)
-            )  # False: no need to update， True: need to update
-            step_index.append(new_row)
-            step_matrix.append(step_template[new_row])
-            pre_row = new_row
+        num_pre_ready_block = num_pre_ready // casual_block_size
+        first_row = torch.zeros(num_frames_block, dtype=torch.long)
+        first_row[:num_pre_ready_block] = num_iterations
+
+        # closed form of the rows: a block starts ar_step rows after the previous one (or as soon as the previous one is
+        # completely denoised if ar_step is larger), and moves by one step per row until all the blocks are denoised
+        delay = min(ar_step, num_iterations - 1)
+        num_rows = (num_frames_block - 1 - num_pre_ready_block) * delay + num_iterations - 1 if num_pre_ready_block < num_frames_block else 0
+        block_offsets = (torch.arange(num_frames_block) - num_pre_ready_block) * delay
+        rows = (torch.arange(1, num_rows + 1)[:, None] - block_offsets[None]).clamp(0, num_iterations)
+        rows[:, :num_pre_ready_block] = num_iterations
+        pre_rows = torch.cat([first_row[None], rows[:-1]])
+
+        step_update_mask = (rows != pre_rows) & (rows != num_iterations)  # False: no need to update， True: need to update
+        step_index = rows
+        step_matrix = step_template[rows.to(step_template.device)]
 
         # for long video we split into several sequences, base_num_frames is set to the model max length (for training)
         terminal_flag = base_num_frames_block
         if shrink_interval_with_mask:
             idx_sequence = torch.arange(num_frames_block, dtype=torch.int64)
-            update_mask = update_mask[0]
-            update_mask_idx = idx_sequence[update_mask]
+            update_mask_idx = idx_sequence[step_update_mask[0]]
             last_update_idx = update_mask_idx[-1].item()
             terminal_flag = last_update_idx + 1
         # for i in range(0, len(update_mask)):
-        for curr_mask in update_mask:
+        for curr_mask in step_update_mask.tolist():
             if terminal_flag < num_frames_block and curr_mask[terminal_flag]:
                 terminal_flag += 1
             valid_interval.append((max(terminal_flag - base_num_frames_block, 0), terminal_flag))
 
-        step_update_mask = torch.stack(update_mask, dim=0)
-        step_index = torch.stack(step_index, dim=0)
-        step_matrix = torch.stack(step_matrix, dim=0)
-
         if casual_block_size > 1:
             step_update_mask = step_update_mask.unsqueeze(-1).repeat(1, 1, casual_block_size).flatten(1).contiguous()
             step_index = step_index.unsqueeze(-1).repeat(1, 1, casual_block_size).flatten(1).contiguous()
@@ -216,6 +205,7 @@ class DTT2V:
         causal_attention: bool = True,
         fps: int = 24,
         VAE_tile_size = 0,
+        VAE_tile_batch_size = 1,
         joint_pass = False,
         slg_layers = None,
         slg_start = 0.0,
@@ -316,14 +306,8 @@ class DTT2V:
             predix_video_latent_length,
             causal_block_size,
         )
-        sample_schedulers = []
-        for _ in range(base_num_frames_iter):
-            sample_scheduler = FlowUniPCMultistepScheduler(
-                num_train_timesteps=1000, shift=1, use_dynamic_shifting=False
-            )
-            sample_scheduler.set_timesteps(sampling_steps, device=self.device, shift=shift)
-            sample_schedulers.append(sample_scheduler)
-        sample_schedulers_counter = [0] * base_num_frames_iter
+        # one solver for all the frames, each frame being at its own step
+        sample_scheduler = FlowUniPCMultiFrameScheduler(base_num_frames_iter, sampling_steps, device=self.device, shift=shift)
 
         updated_num_steps=  len(step_matrix)
         if callback != None:
@@ -420,16 +404,7 @@ class DTT2V:
                             return None
                     noise_pred = noise_pred_uncond + guide_scale * (noise_pred_cond - noise_pred_uncond)
                     del noise_pred_cond, noise_pred_uncond
-            for idx in range(valid_interval_start, valid_interval_end):
-                if update_mask_i[idx].item():
-                    latents[:, :, idx] = sample_schedulers[idx].step(
-                        noise_pred[:, :, idx - valid_interval_start],
-                        timestep_i[idx],
-                        latents[:, :, idx],
-                        return_dict=False,
-                        generator=generator,
-                    )[0]
-                    sample_schedulers_counter[idx] += 1
+            sample_scheduler.step(noise_pred, latents, update_mask_i, valid_interval_start)
             if callback is not None:
                 latents_preview = latents
                 if len(latents_preview) > 1: latents_preview = latents_preview.transpose(0,2)
@@ -438,7 +413,7 @@ class DTT2V:
 
         x0 =latents.unbind(dim=0)
 
-        videos = self.vae.decode(x0, VAE_tile_size)
+        videos = self.vae.decode(x0, VAE_tile_size, tile_batch_size = VAE_tile_batch_size)
 
         if self.image_outputs:
             videos = torch.cat(videos, dim=1) if len(videos) > 1 else videos[0]
@@ -44,7 +44,7 @@ def get_audio_features(wav2vec, audio_processor, audio_path, fps, num_frames):
 
     input_values = audio_processor(
         audio_segment, sampling_rate=sample_rate, return_tensors="pt"
-    ).input_values.to("cuda")
+    ).input_values.to(wav2vec.device)
 
     with torch.no_grad():
         fea = wav2vec(input_values).last_hidden_state
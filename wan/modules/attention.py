@@ -3,9 +3,20 @@ import torch
 from importlib.metadata import version
 from mmgp import offload
 import torch.nn.functional as F
+from functools import lru_cache
 
-major, minor = torch.cuda.get_device_capability(None)
-bfloat16_supported =  major >= 8 
+@lru_cache(maxsize=None)
+def get_device_capability():
+    # probed on first use only, so that the transformers can be imported on a host without GPU
+    if not torch.cuda.is_available():
+        return (0, 0)
+    return torch.cuda.get_device_capability(None)
+
+def is_bfloat16_supported(device = None):
+    if device is not None and torch.device(device).type == "cpu":
+        return True
+    major, minor = get_device_capability()
+    return major >= 8
 
 try:
     from xformers.ops import memory_efficient_attention
@@ -47,11 +58,10 @@ import warnings
 try:
     from sageattention import sageattn
     from .sage2_core import sageattn as alt_sageattn, is_sage2_supported
-    sage2_supported =  is_sage2_supported()
 except ImportError:
     sageattn = None
     alt_sageattn = None
-    sage2_supported = False
+    is_sage2_supported = None
 # @torch.compiler.disable()
 def sageattn_wrapper(
         qkv_list,
@@ -115,6 +125,69 @@ def sdpa_wrapper(
 
     return o
 
+# maximum number of attention scores computed at once by the cpu backend (256 MB in float32)
+cpu_attention_max_elements = 2 ** 26
+cpu_attention_k_block = 4096
+
+def _get_mask_block(attention_mask, q0, q1, k0, k1):
+    # masks may be broadcasted along the query / key dimensions
+    if attention_mask.shape[-2] > 1: attention_mask = attention_mask[..., q0:q1, :]
+    if attention_mask.shape[-1] > 1: attention_mask = attention_mask[..., k0:k1]
+    if attention_mask.dtype == torch.bool:
+        return torch.zeros(attention_mask.shape, dtype=torch.float32).masked_fill_(~attention_mask, float("-inf"))
+    return attention_mask.float()
+
+@torch.compiler.disable()
+def cpu_attention_wrapper(
+        qkv_list,
+        attention_length,
+        attention_mask = None,
+        softmax_scale = None,
+    ):
+    # memory efficient sdpa for cpu: queries and keys are processed by blocks with an online softmax,
+    # so that the working set is bounded by cpu_attention_max_elements whatever the sequence lengths
+    q, k, v = qkv_list
+    qkv_list.clear()
+    q = q.transpose(1,2)
+    k = k.transpose(1,2)
+    v = v.transpose(1,2)
+    if attention_mask != None:
+        attention_mask = attention_mask.transpose(1,2)
+    b, h, lq, d = q.shape
+    lk = k.shape[2]
+    scale = softmax_scale if softmax_scale != None else d ** -0.5
+    k_block = min(lk, cpu_attention_k_block)
+    q_block = max(1, cpu_attention_max_elements // (b * h * k_block))
+    o = torch.empty((b, h, lq, v.shape[-1]), dtype=q.dtype, device=q.device)
+    for q0 in range(0, lq, q_block):
+        q1 = min(q0 + q_block, lq)
+        if k_block == lk:
+            mask = None if attention_mask == None else _get_mask_block(attention_mask, q0, q1, 0, lk).to(q.dtype)
+            o[:, :, q0:q1] = F.scaled_dot_product_attention(q[:, :, q0:q1], k, v, attn_mask=mask, scale=scale)
+            continue
+        sub_q = q[:, :, q0:q1].float() * scale
+        max_score = torch.full((b, h, q1 - q0, 1), float("-inf"))
+        denominator = torch.zeros((b, h, q1 - q0, 1))
+        acc = torch.zeros((b, h, q1 - q0, v.shape[-1]))
+        for k0 in range(0, lk, k_block):
+            k1 = min(k0 + k_block, lk)
+            scores = sub_q @ k[:, :, k0:k1].float().transpose(-1, -2)
+            if attention_mask != None:
+                scores += _get_mask_block(attention_mask, q0, q1, k0, k1)
+            new_max = torch.maximum(max_score, scores.amax(-1, keepdim=True))
+            # rows whose scores are all masked so far
+            new_max = new_max.masked_fill(torch.isinf(new_max), 0.)
+            correction = torch.exp(max_score - new_max)
+            scores = (scores - new_max).exp_()
+            denominator = denominator * correction + scores.sum(-1, keepdim=True)
+            acc = acc * correction + scores @ v[:, :, k0:k1].float()
+            max_score = new_max
+            scores = None
+        o[:, :, q0:q1] = (acc / denominator).to(q.dtype)
+        sub_q = acc = denominator = max_score = None
+    del q, k, v
+    return o.transpose(1,2)
+
 
 def get_attention_modes():
     ret = ["sdpa", "auto"]
@@ -131,11 +204,14 @@ def get_attention_modes():
 
 def get_supported_attention_modes():
     ret = get_attention_modes()
-    if not sage2_supported:
+    if not torch.cuda.is_available():
+        # only sdpa runs on cpu, pay_attention switches to the cpu backend by itself
+        return [mode for mode in ret if mode in ("sdpa", "auto")]
+    if is_sage2_supported == None or not is_sage2_supported():
         if "sage2" in ret:
             ret.remove("sage2")
 
-    major, minor = torch.cuda.get_device_capability()
+    major, minor = get_device_capability()
     if  major < 7:
         if "sage" in ret:
             ret.remove("sage")
@@ -146,8 +222,8 @@ __all__ = [
     'attention',
 ]
 
-def get_cu_seqlens(batch_size, lens, max_len):
-    cu_seqlens = torch.zeros([2 * batch_size + 1], dtype=torch.int32, device="cuda")
+def get_cu_seqlens(batch_size, lens, max_len, device = "cuda"):
+    cu_seqlens = torch.zeros([2 * batch_size + 1], dtype=torch.int32, device=device)
 
     for i in range(batch_size):
         s = lens[i] 
@@ -176,13 +252,17 @@ def pay_attention(
     # format : torch.Size([batches, tokens, heads, head_features])
     # assume if q_lens is non null, each q is padded up to lq (one q out of two will need to be discarded or ignored)
     # assume if k_lens is non null, each k is padded up to lk (one k out of two will need to be discarded or ignored)
+    q,k,v = qkv_list
+    bfloat16_supported = is_bfloat16_supported(q.device)
     if attention_mask != None:
         force_attention = "sdpa"
         if  attention_mask.dtype == torch.bfloat16 and not bfloat16_supported:
             attention_mask = attention_mask.to(torch.float16)
-    attn = offload.shared_state["_attention"] if force_attention== None else force_attention
+    attn = offload.shared_state.get("_attention", "sdpa") if force_attention== None else force_attention
+    if q.device.type == "cpu":
+        # the gpu kernels can't run on cpu tensors
+        attn = "cpu"
 
-    q,k,v = qkv_list
     qkv_list.clear()
     out_dtype = q.dtype
     if q.dtype == torch.bfloat16 and not bfloat16_supported:
@@ -201,7 +281,7 @@ def pay_attention(
         from src.chipmunk.modules import SparseDiffMlp, SparseDiffAttn
         from src.chipmunk.util import LayerCounter, GLOBAL_CONFIG
 
-    if b > 1 and k_lens != None and attn in ("sage2", "sdpa"):
+    if b > 1 and k_lens != None and attn in ("sage2", "sdpa", "cpu"):
         assert attention_mask == None
         # Poor's man var k len attention
         assert q_lens == None
@@ -230,11 +310,11 @@ def pay_attention(
             for sub_q, sub_k, sub_v in zip(q_chunks, k_chunks, v_chunks): 
                 qkv_list = [sub_q, sub_k, sub_v]
                 sub_q, sub_k, sub_v = None, None, None
-                o.append( pay_attention(qkv_list) )
+                o.append( pay_attention(qkv_list, force_attention = force_attention) )
             q_chunks, k_chunks, v_chunks = None, None, None
             o = torch.cat(o, dim = 0)
             return o
-    elif (q_lens != None or k_lens != None) and attn in ("sage2", "sdpa"):
+    elif (q_lens != None or k_lens != None) and attn in ("sage2", "sdpa", "cpu"):
         assert b == 1
         szq = q_lens[0].item() if q_lens != None else lq
         szk = k_lens[0].item() if k_lens != None else lk
@@ -257,17 +337,17 @@ def pay_attention(
             k = k.reshape(-1, *k.shape[-2:])
             v = v.reshape(-1, *v.shape[-2:])
             q = q.reshape(-1, *q.shape[-2:])
-            cu_seqlens_q=get_cu_seqlens(b, q_lens, lq) 
-            cu_seqlens_k=get_cu_seqlens(b, k_lens, lk) 
+            cu_seqlens_q=get_cu_seqlens(b, q_lens, lq, q.device) 
+            cu_seqlens_k=get_cu_seqlens(b, k_lens, lk, q.device) 
         else:
             szq = q_lens[0].item() if q_lens != None else lq
             szk = k_lens[0].item() if k_lens != None else lk
             if szq != lq or szk != lk:
-                cu_seqlens_q = torch.tensor([0, szq, lq], dtype=torch.int32, device="cuda")
-                cu_seqlens_k = torch.tensor([0, szk, lk], dtype=torch.int32, device="cuda")
+                cu_seqlens_q = torch.tensor([0, szq, lq], dtype=torch.int32, device=q.device)
+                cu_seqlens_k = torch.tensor([0, szk, lk], dtype=torch.int32, device=q.device)
             else:
-                cu_seqlens_q = torch.tensor([0, lq], dtype=torch.int32, device="cuda")
-                cu_seqlens_k = torch.tensor([0, lk], dtype=torch.int32, device="cuda")
+                cu_seqlens_q = torch.tensor([0, lq], dtype=torch.int32, device=q.device)
+                cu_seqlens_k = torch.tensor([0, lk], dtype=torch.int32, device=q.device)
             q = q.squeeze(0)
             k = k.squeeze(0)
             v = v.squeeze(0)
@@ -352,6 +432,10 @@ def pay_attention(
         qkv_list = [q, k, v]
         del q ,k ,v
         x = sdpa_wrapper( qkv_list, lq, attention_mask = attention_mask) #.unsqueeze(0)
+    elif attn=="cpu":
+        qkv_list = [q, k, v]
+        del q ,k ,v
+        x = cpu_attention_wrapper( qkv_list, lq, attention_mask = attention_mask, softmax_scale = softmax_scale)
     elif attn=="flash" and version == 3:
         # Note: dropout_p, window_size are not supported in FA3 now.
         x = flash_attn_interface.flash_attn_varlen_func(
@@ -12,6 +12,7 @@ from diffusers.models.modeling_utils import ModelMixin
 import numpy as np
 from typing import Union,Optional
 from mmgp import offload
+from wan.utils.profiler import profiler
 from .attention import pay_attention
 from torch.backends.cuda import sdp_kernel
 from wan.multitalk.multitalk_utils import get_attn_map_with_target
@@ -32,6 +33,60 @@ def sinusoidal_embedding_1d(dim, position):
     return x
 
 
+def search_skip_threshold(count_steps, target_nb_steps, min_threshold = 0.01, max_threshold = 0.6, threshold_step = 0.01, monotone = True):
+    # count_steps(threshold) returns the number of computed steps for a threshold
+    # monotone: the count doesn't increase with the threshold (TeaCache), the thresholds grid is bisected for the first one
+    # that reaches the target and the closest of it and its predecessor is kept, which is the threshold of the linear sweep.
+    # Otherwise (MagCache, whose skip runs are also cut after magcache_K steps, so that a higher threshold may compute more
+    # steps when K is large) the grid is swept until the distance to the target grows
+    thresholds = []
+    threshold = min_threshold
+    while threshold <= max_threshold:
+        thresholds.append(threshold)
+        threshold += threshold_step
+    if not monotone:
+        best_no, best_diff, best_count = 0, None, None
+        for no, threshold in enumerate(thresholds):
+            count = count_steps(threshold)
+            diff = abs(target_nb_steps - count)
+            if best_diff is None or diff < best_diff:
+                best_no, best_diff, best_count = no, diff, count
+            elif diff > best_diff:
+                break
+        return thresholds[best_no], best_count
+    counts = {}
+    def get_count(no):
+        if no not in counts:
+            counts[no] = count_steps(thresholds[no])
+        return counts[no]
+    low, high = 0, len(thresholds)
+    while low < high:
+        mid = (low + high) // 2
+        if get_count(mid) <= target_nb_steps:
+            high = mid
+        else:
+            low = mid + 1
+    candidates = [no for no in (low - 1, low) if 0 <= no < len(thresholds)]
+    best_no = min(candidates, key= lambda no: (abs(target_nb_steps - get_count(no)), no))
+    # several thresholds may lead to the same schedule, the smallest one is the safest
+    while best_no > 0 and get_count(best_no - 1) == get_count(best_no):
+        best_no -= 1
+    return thresholds[best_no], get_count(best_no)
+
+
+def get_cached(cache, sources, compute):
+    # an entry is only reused if its source tensors are the same objects and have not been modified in place since
+    if cache is None:
+        return compute()
+    key = tuple(id(t) for t in sources)
+    versions = [t._version for t in sources]
+    entry = cache.get(key, None)
+    if entry is not None and all(a is b for a, b in zip(entry[0], sources)) and entry[1] == versions:
+        return entry[2]
+    value = compute()
+    cache[key] = (sources, versions, value)
+    return value
+
 def reshape_latent(latent, latent_frames):
     return latent.reshape(latent.shape[0], latent_frames, -1, latent.shape[-1] )
 
@@ -178,9 +233,18 @@ class WanSelfAttention(nn.Module):
         self.o = nn.Linear(dim, dim)
         self.norm_q = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
         self.norm_k = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
+        # K / V of the context, kept for all the denoising steps when the conditioning cache is enabled
+        self.kv_cache = None
 
+    def get_text_kv(self, context):
+        n, d = self.num_heads, self.head_dim
+        k = self.k(context)
+        self.norm_k(k)
+        k = k.view(context.shape[0], -1, n, d)
+        v = self.v(context).view(context.shape[0], -1, n, d)
+        return k, v
 
-    def text_cross_attention(self, xlist, context, return_q = False):
+    def text_cross_attention(self, xlist, context, return_q = False, kv = None):
         x = xlist[0]
         xlist.clear()
         b, n, d = x.size(0), self.num_heads, self.head_dim
@@ -190,10 +254,8 @@ class WanSelfAttention(nn.Module):
         del x
         self.norm_q(q)
         q= q.view(b, -1, n, d)
-        k = self.k(context)
-        self.norm_k(k)
-        k = k.view(context.shape[0], -1, n, d)
-        v = self.v(context).view(context.shape[0], -1, n, d)
+        k, v = self.get_text_kv(context) if kv is None else kv
+        kv = None
 
         if nag_scale <= 1 or len(k)==1:
             qvl_list=[q, k, v]
@@ -314,7 +376,8 @@ class WanT2VCrossAttention(WanSelfAttention):
             x(Tensor): Shape [B, L1, C]
             context(Tensor): Shape [B, L2, C]
         """
-        x, _ = self.text_cross_attention( xlist, context)
+        kv = get_cached(self.kv_cache, [context], lambda: self.get_text_kv(context))
+        x, _ = self.text_cross_attention( xlist, context, kv = kv)
         x = self.o(x)
         return x
 
@@ -343,20 +406,23 @@ class WanI2VCrossAttention(WanSelfAttention):
         """
 
 
-        context_img = context[:, :257]
-        context = context[:, 257:]
-        
-        x, q = self.text_cross_attention( xlist, context, return_q = True)
-        if len(q) != len(context_img):
-            context_img = context_img[:len(q)]
-        b, s, n, d = *x.shape[:2], self.num_heads, self.head_dim
+        def get_kv():
+            context_img = context[:, :257]
+            k, v = self.get_text_kv(context[:, 257:])
+            k_img = self.k_img(context_img)
+            self.norm_k_img(k_img)
+            k_img = k_img.view(context_img.shape[0], -1, self.num_heads, self.head_dim)
+            v_img = self.v_img(context_img).view(context_img.shape[0], -1, self.num_heads, self.head_dim)
+            return k, v, k_img, v_img
+
+        k, v, k_img, v_img = get_cached(self.kv_cache, [context], get_kv)
+        x, q = self.text_cross_attention( xlist, None, return_q = True, kv = (k, v))
+        del k, v
+        if len(q) != len(k_img):
+            k_img, v_img = k_img[:len(q)], v_img[:len(q)]
 
         if audio_scale != None:
             audio_x = self.processor(q, audio_proj, grid_sizes[0], audio_context_lens)
-        k_img = self.k_img(context_img)
-        self.norm_k_img(k_img)
-        k_img = k_img.view(b, -1, n, d)
-        v_img = self.v_img(context_img).view(b, -1, n, d)
         qkv_list = [q, k_img, v_img]
         del q, k_img, v_img
         img_x = pay_attention(qkv_list)
@@ -844,6 +910,7 @@ class WanModel(ModelMixin, ConfigMixin):
 
         assert model_type in ['t2v', 'i2v', 'i2v2_2']
         self.model_type = model_type
+        self.cond_cache = None
 
         self.patch_size = patch_size
         self.text_len = text_len
@@ -1004,6 +1071,19 @@ class WanModel(ModelMixin, ConfigMixin):
 
         self._lock_dtype = dtype
 
+    def enable_cond_cache(self, enabled = True):
+        # text / clip embeddings and the cross attention K/V of each block don't depend on the step and can be computed once per generation
+        self.cond_cache = {} if enabled else None
+        blocks = list(self.blocks) + (list(self.vace_blocks) if hasattr(self, "vace_blocks") else [])
+        for block in blocks:
+            block.cross_attn.kv_cache = {} if enabled else None
+
+    def _get_skip_schedule_cache(self):
+        cache = getattr(self, "_skip_schedule_cache", None)
+        if cache is None:
+            cache = self._skip_schedule_cache = {}
+        return cache
+
     def compute_magcache_threshold(self, start_step, timesteps = None, speed_factor =0):
         def nearest_interp(src_array, target_length):
             src_length = len(src_array)
@@ -1012,6 +1092,14 @@ class WanModel(ModelMixin, ConfigMixin):
             mapped_indices = np.round(np.arange(target_length) * scale).astype(int)
             return src_array[mapped_indices]
         num_inference_steps = len(timesteps)
+        target_nb_steps= int(len(timesteps) / speed_factor)
+        # the mag ratios only depend on the number of steps, so does the schedule
+        key = ("mag", num_inference_steps, start_step, speed_factor, self.magcache_K, tuple(np.asarray(self.def_mag_ratios).tolist()))
+        schedule_cache = self._get_skip_schedule_cache()
+        if key in schedule_cache:
+            self.mag_ratios, self.magcache_thresh, nb_steps = schedule_cache[key]
+            return self.magcache_thresh
+
         if len(self.def_mag_ratios) != num_inference_steps*2:
             mag_ratio_con = nearest_interp(self.def_mag_ratios[0::2], num_inference_steps)
             mag_ratio_ucon = nearest_interp(self.def_mag_ratios[1::2], num_inference_steps)
@@ -1020,96 +1108,65 @@ class WanModel(ModelMixin, ConfigMixin):
         else:
             self.mag_ratios = self.def_mag_ratios
 
-
-        best_deltas = None
-        best_threshold = 0.01
-        best_diff = 1000
-        best_signed_diff = 1000
-        target_nb_steps= int(len(timesteps) / speed_factor)
-        threshold = 0.01
-        x_id_max = 1
-        while threshold <= 0.6:
+        # skip errors of the conditional stream, the decision taken for it is applied to all the streams
+        mag_ratios = np.asarray(self.mag_ratios, dtype=np.float64)[0::2].tolist()
+        magcache_K = self.magcache_K
+        def count_steps(threshold):
             nb_steps = 0
-            diff = 1000
-            accumulated_err, accumulated_steps, accumulated_ratio = [0] * x_id_max , [0] * x_id_max, [1.0] * x_id_max
-            for i, t in enumerate(timesteps):
-                if i<=start_step:
-                    skip  = False
-                    x_should_calc = [True] * x_id_max
-                else:
-                    x_should_calc = []
-                    for cur_x_id in range(x_id_max):
-                        cur_mag_ratio = self.mag_ratios[i * 2 + cur_x_id] # conditional and unconditional in one list
-                        accumulated_ratio[cur_x_id] *= cur_mag_ratio # magnitude ratio between current step and the cached step
-                        accumulated_steps[cur_x_id] += 1 # skip steps plus 1
-                        cur_skip_err = np.abs(1-accumulated_ratio[cur_x_id]) # skip error of current steps
-                        accumulated_err[cur_x_id] += cur_skip_err # accumulated error of multiple steps
-                        if accumulated_err[cur_x_id]<threshold and accumulated_steps[cur_x_id]<=self.magcache_K:
-                            skip  = True
-                        else:
-                            skip  = False
-                            accumulated_err[cur_x_id], accumulated_steps[cur_x_id], accumulated_ratio[cur_x_id] = 0, 0, 1.0
-                        x_should_calc.append(not skip)
-                if not skip:
-                    nb_steps += 1
-                    signed_diff = target_nb_steps - nb_steps               
-                    diff = abs(signed_diff)  
-            if diff < best_diff:
-                best_threshold = threshold
-                best_diff = diff
-                best_signed_diff = signed_diff
-            elif diff > best_diff:
-                break
-            threshold += 0.01
+            accumulated_err, accumulated_steps, accumulated_ratio = 0, 0, 1.0
+            for i in range(num_inference_steps):
+                if i > start_step:
+                    accumulated_ratio *= mag_ratios[i] # magnitude ratio between current step and the cached step
+                    accumulated_steps += 1 # skip steps plus 1
+                    accumulated_err += abs(1-accumulated_ratio) # accumulated error of multiple steps
+                    if accumulated_err<threshold and accumulated_steps<=magcache_K:
+                        continue
+                    accumulated_err, accumulated_steps, accumulated_ratio = 0, 0, 1.0
+                nb_steps += 1
+            return nb_steps
+
+        best_threshold, nb_steps = search_skip_threshold(count_steps, target_nb_steps, monotone = False)
         self.magcache_thresh = best_threshold
-        print(f"Mag Cache, best threshold found:{best_threshold:0.2f} with gain x{len(timesteps)/(target_nb_steps - best_signed_diff):0.2f} for a target of x{speed_factor}")
+        schedule_cache[key] = (self.mag_ratios, best_threshold, nb_steps)
+        print(f"Mag Cache, best threshold found:{best_threshold:0.2f} with gain x{len(timesteps)/nb_steps:0.2f} for a target of x{speed_factor}")
         return best_threshold
 
     def compute_teacache_threshold(self, start_step, timesteps = None, speed_factor =0): 
         modulation_dtype = self.time_projection[1].weight.dtype
         rescale_func = np.poly1d(self.coefficients)
-        e_list = []
-        for t in timesteps:
-            t = torch.stack([t])
-            time_emb =  self.time_embedding( sinusoidal_embedding_1d(self.freq_dim, t.flatten()).to(modulation_dtype) )  # b, dim   
-            e_list.append(time_emb)
-        best_deltas = None
-        best_threshold = 0.01
-        best_diff = 1000
-        best_signed_diff = 1000
+        num_inference_steps = len(timesteps)
         target_nb_steps= int(len(timesteps) / speed_factor)
-        threshold = 0.01
-        while threshold <= 0.6:
-            accumulated_rel_l1_distance =0
+        timesteps = [torch.stack([t]).flatten() for t in timesteps]
+        flat_timesteps = torch.cat(timesteps)
+        key = ("tea", tuple(t.numel() for t in timesteps), tuple(flat_timesteps.float().cpu().tolist()), start_step, speed_factor, tuple(np.asarray(self.coefficients).tolist()))
+        schedule_cache = self._get_skip_schedule_cache()
+        if key in schedule_cache:
+            self.rel_l1_thresh, nb_steps = schedule_cache[key]
+            return self.rel_l1_thresh
+
+        # all the time embeddings are computed in one pass and the relative distances transferred with a single sync
+        e_list = self.time_embedding( sinusoidal_embedding_1d(self.freq_dim, flat_timesteps).to(modulation_dtype) ).split([t.numel() for t in timesteps])
+        rel_distances = [ ((e_list[i]-e_list[i-1]).abs().mean() / e_list[i-1].abs().mean()).float() for i in range(1, num_inference_steps)]
+        rel_distances = torch.stack(rel_distances).cpu().numpy() if len(rel_distances) > 0 else np.zeros(0)
+        e_list = None
+        deltas = np.abs(rescale_func(np.concatenate([np.zeros(1), rel_distances]))).tolist()
+
+        def count_steps(threshold):
+            accumulated_rel_l1_distance = 0
             nb_steps = 0
-            diff = 1000
-            deltas = []
-            for i, t in enumerate(timesteps):
-                skip = False    
-                if not (i<=start_step or i== len(timesteps)-1):
-                    delta = abs(rescale_func(((e_list[i]-e_list[i-1]).abs().mean() / e_list[i-1].abs().mean()).cpu().item()))
-                    # deltas.append(delta)
-                    accumulated_rel_l1_distance += delta
+            for i in range(num_inference_steps):
+                if not (i<=start_step or i== num_inference_steps-1):
+                    accumulated_rel_l1_distance += deltas[i]
                     if accumulated_rel_l1_distance < threshold:
-                        skip = True
-                        # deltas.append("SKIP")
-                    else:
-                        accumulated_rel_l1_distance = 0
-                if not skip:
-                    nb_steps += 1
-                    signed_diff = target_nb_steps - nb_steps               
-                    diff = abs(signed_diff)  
-            if diff < best_diff:
-                best_threshold = threshold
-                best_deltas = deltas
-                best_diff = diff
-                best_signed_diff = signed_diff
-            elif diff > best_diff:
-                break
-            threshold += 0.01
+                        continue
+                    accumulated_rel_l1_distance = 0
+                nb_steps += 1
+            return nb_steps
+
+        best_threshold, nb_steps = search_skip_threshold(count_steps, target_nb_steps)
         self.rel_l1_thresh = best_threshold
-        print(f"Tea Cache, best threshold found:{best_threshold:0.2f} with gain x{len(timesteps)/(target_nb_steps - best_signed_diff):0.2f} for a target of x{speed_factor}")
-        # print(f"deltas:{best_deltas}")
+        schedule_cache[key] = (best_threshold, nb_steps)
+        print(f"Tea Cache, best threshold found:{best_threshold:0.2f} with gain x{num_inference_steps/nb_steps:0.2f} for a target of x{speed_factor}")
         return best_threshold
 
     
@@ -1220,17 +1277,19 @@ class WanModel(ModelMixin, ConfigMixin):
             else:
                 e0 = e0 + self.fps_projection(fps_emb).unflatten(1, (6, self.dim))
 
-        # context
-        context = [self.text_embedding( u ) for u in context  ] 
+        # context, the same embeddings are returned at each step when the conditioning cache is enabled
+        cond_cache = self.cond_cache
+        context = [get_cached(cond_cache, [u], lambda u=u: self.text_embedding( u )) for u in context  ] 
         
         if clip_fea is not None:
-            context_clip = self.img_emb(clip_fea)  # bs x 257 x dim
+            context_clip = get_cached(cond_cache, [clip_fea], lambda: self.img_emb(clip_fea))  # bs x 257 x dim
             context_list = []
             for one_context in context: 
                 if len(one_context) != len(context_clip):
-                    context_list.append( torch.cat( [context_clip.repeat(len(one_context), 1, 1), one_context ], dim=1 ))
+                    context_list.append( get_cached(cond_cache, [clip_fea, one_context], lambda: torch.cat( [context_clip.repeat(len(one_context), 1, 1), one_context ], dim=1 )))
                 else:
-                    context_list.append( torch.cat( [context_clip, one_context ], dim=1 ))
+                    context_list.append( get_cached(cond_cache, [clip_fea, one_context], lambda: torch.cat( [context_clip, one_context ], dim=1 )))
+            context_clip = None
         else:
             context_list = context
 
@@ -1295,7 +1354,9 @@ class WanModel(ModelMixin, ConfigMixin):
                         self.accumulated_err[cur_x_id] += cur_skip_err # accumulated error of multiple steps
                         if self.accumulated_err[cur_x_id]<self.magcache_thresh and self.accumulated_steps[cur_x_id]<=self.magcache_K:
                             skip_forward = True
-                            if i == 0 and x_id == 0: self.cache_skipped_steps += 1
+                            if i == 0 and x_id == 0:
+                                self.cache_skipped_steps += 1
+                                profiler.instant("skipped step", step = current_step, cache = "mag")
                             # print(f"skip: step={current_step} for x_id={cur_x_id}, accum error {self.accumulated_err[cur_x_id]}")
                         else:
                             skip_forward = False
@@ -1318,6 +1379,7 @@ class WanModel(ModelMixin, ConfigMixin):
                         if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
                             should_calc = False
                             self.cache_skipped_steps += 1
+                            profiler.instant("skipped step", step = current_step, cache = "tea")
                             # print(f"Teacache Skipped Step no {current_step} ({self.cache_skipped_steps}/{current_step}), delta={delta}" )
                         else:
                             should_calc = True
@@ -1,7 +1,11 @@
 # Modified from transformers.models.t5.modeling_t5
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
 import logging
 import math
+import os
+import threading
+from collections import OrderedDict
 
 import torch
 import torch.nn as nn
@@ -14,6 +18,8 @@ __all__ = [
     'T5Encoder',
     'T5Decoder',
     'T5EncoderModel',
+    'T5EmbeddingCache',
+    't5_embedding_cache',
 ]
 
 
@@ -469,6 +475,77 @@ def umt5_xxl(**kwargs):
     return _t5('umt5-xxl', **cfg)
 
 
+class T5EmbeddingCache:
+    """
+    Content addressed cache of prompt embeddings keyed by (encoder file, dtype, prompt), so that the text encoder
+    weights don't need to be moved back to VRAM when a prompt is encoded again (sliding windows, repeats, queues).
+    Embeddings are kept in RAM with a LRU policy and optionally persisted as safetensors files in disk_path.
+    """
+
+    def __init__(self, max_entries=256, disk_path=None):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(checkpoint_path, dtype, text):
+        key = f"{os.path.basename(checkpoint_path or '')}|{dtype}|{text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _get_file_name(self, key):
+        return os.path.join(self.disk_path, key[:2], key + ".safetensors")
+
+    def get(self, key):
+        with self._lock:
+            embedding = self._entries.get(key, None)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                return embedding
+        if self.disk_path is None:
+            return None
+        file_name = self._get_file_name(key)
+        if not os.path.isfile(file_name):
+            return None
+        from safetensors.torch import load_file
+        try:
+            embedding = load_file(file_name)["embedding"]
+        except Exception as e:
+            logging.warning(f"unable to read cached embedding '{file_name}': {e}")
+            return None
+        self._add(key, embedding)
+        return embedding
+
+    def _add(self, key, embedding):
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, embedding):
+        embedding = embedding.detach().to("cpu").contiguous()
+        if self.max_entries > 0:
+            self._add(key, embedding)
+        if self.disk_path is not None:
+            from safetensors.torch import save_file
+            file_name = self._get_file_name(key)
+            try:
+                os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                tmp_file_name = file_name + ".tmp"
+                save_file({"embedding": embedding}, tmp_file_name)
+                os.replace(tmp_file_name, file_name)
+            except Exception as e:
+                logging.warning(f"unable to save cached embedding '{file_name}': {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+t5_embedding_cache = T5EmbeddingCache()
+
+
 class T5EncoderModel:
 
     def __init__(
@@ -512,7 +589,7 @@ class T5EncoderModel:
         self.tokenizer = HuggingfaceTokenizer(
             name=tokenizer_path, seq_len=text_len, clean='whitespace')
 
-    def __call__(self, texts, device):
+    def encode(self, texts, device):
         ids, mask = self.tokenizer(
             texts, return_mask=True, add_special_tokens=True)
         ids = ids.to(device)
@@ -520,3 +597,16 @@ class T5EncoderModel:
         seq_lens = mask.gt(0).sum(dim=1).long()
         context = self.model(ids, mask)
         return [u[:v] for u, v in zip(context, seq_lens)]
+
+    def __call__(self, texts, device, use_cache = True):
+        if not use_cache:
+            return self.encode(texts, device)
+        keys = [t5_embedding_cache.get_key(self.checkpoint_path, self.dtype, text) for text in texts]
+        contexts = [t5_embedding_cache.get(key) for key in keys]
+        missing = [no for no, context in enumerate(contexts) if context is None]
+        if len(missing) > 0:
+            encoded = self.encode([texts[no] for no in missing], device)
+            for no, context in zip(missing, encoded):
+                t5_embedding_cache.put(keys[no], context)
+                contexts[no] = context
+        return [context.to(device) for context in contexts]
@@ -1,6 +1,8 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import logging
+from functools import lru_cache
 from mmgp import offload
+from wan.utils.profiler import profiler
 import torch
 import torch.cuda.amp as amp
 import torch.nn as nn
@@ -510,6 +512,33 @@ class Decoder3d(nn.Module):
         return x
 
 
+@lru_cache(maxsize=32)
+def get_blend_ramp(blend_extent, device, dtype):
+    # linear weights of the tile being blended in, the previous tile gets 1 - weight
+    return torch.arange(blend_extent, device=device, dtype=torch.float32).div_(blend_extent).to(dtype)
+
+
+def process_tiles_batched(tiles, process_tiles, tile_batch_size = 1):
+    # same shaped tiles (all the interior ones) are processed together by batches of tile_batch_size
+    results = [None] * len(tiles)
+    if tile_batch_size <= 1:
+        for n, tile in enumerate(tiles):
+            results[n] = process_tiles(tile)
+        return results
+    groups = {}
+    for n, tile in enumerate(tiles):
+        groups.setdefault(tuple(tile.shape), []).append(n)
+    for indexes in groups.values():
+        for start in range(0, len(indexes), tile_batch_size):
+            batch_indexes = indexes[start:start + tile_batch_size]
+            batch = process_tiles(torch.cat([tiles[n] for n in batch_indexes], dim=0))
+            batch_size = tiles[batch_indexes[0]].shape[0]
+            for k, n in enumerate(batch_indexes):
+                results[n] = batch[k * batch_size: (k + 1) * batch_size]
+            batch = None
+    return results
+
+
 def count_conv3d(model):
     count = 0
     for m in model.modules():
@@ -593,7 +622,8 @@ class WanVAE_(nn.Module):
         return mu
 
 
-    def decode(self, z, scale=None, any_end_frame = False):
+    def decode_stream(self, z, scale=None, any_end_frame = False):
+        # yields the pixels decoded for each latent frame as soon as they are available, thanks to the causal cache
         self.clear_cache()
         # z: [b,c,t,h,w]
         if scale != None:
@@ -604,41 +634,47 @@ class WanVAE_(nn.Module):
                 z = z / scale[1] + scale[0]
         iter_ = z.shape[2]
         x = self.conv2(z)
-        out_list = []
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
-                out_list.append(self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx))
-            elif any_end_frame and i==iter_-1:
-                out_list.append(self.decoder(
-                    x[:, :, -1:, :, :],
-                    feat_cache=None ,
-                    feat_idx=self._conv_idx))
-            else:
-                out_list.append(self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx))
-        self.clear_cache()
+        try:
+            for i in range(iter_):
+                self._conv_idx = [0]
+                if i == 0:
+                    yield self.decoder(
+                        x[:, :, i:i + 1, :, :],
+                        feat_cache=self._feat_map,
+                        feat_idx=self._conv_idx)
+                elif any_end_frame and i==iter_-1:
+                    yield self.decoder(
+                        x[:, :, -1:, :, :],
+                        feat_cache=None ,
+                        feat_idx=self._conv_idx)
+                else:
+                    yield self.decoder(
+                        x[:, :, i:i + 1, :, :],
+                        feat_cache=self._feat_map,
+                        feat_idx=self._conv_idx)
+        finally:
+            self.clear_cache()
+
+    def decode(self, z, scale=None, any_end_frame = False):
+        out_list = list(self.decode_stream(z, scale, any_end_frame = any_end_frame))
         out = torch.cat(out_list, 2)
         return out
     
     def blend_v(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
-        for y in range(blend_extent):
-            b[:, :, :, y, :] = a[:, :, :, -blend_extent + y, :] * (1 - y / blend_extent) + b[:, :, :, y, :] * (y / blend_extent)
+        if blend_extent > 0:
+            weight = get_blend_ramp(blend_extent, b.device, b.dtype).view(-1, 1)
+            b[:, :, :, :blend_extent, :] = torch.lerp(a[:, :, :, -blend_extent:, :].to(b.device), b[:, :, :, :blend_extent, :], weight)
         return b
 
     def blend_h(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-1], b.shape[-1], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (1 - x / blend_extent) + b[:, :, :, :, x] * (x / blend_extent)
+        if blend_extent > 0:
+            weight = get_blend_ramp(blend_extent, b.device, b.dtype)
+            b[:, :, :, :, :blend_extent] = torch.lerp(a[:, :, :, :, -blend_extent:].to(b.device), b[:, :, :, :, :blend_extent], weight)
         return b
     
-    def spatial_tiled_decode(self, z, scale, tile_size, any_end_frame= False):
+    def spatial_tiled_decode(self, z, scale, tile_size, any_end_frame= False, tile_batch_size = 1):
         tile_sample_min_size = tile_size
         tile_latent_min_size = int(tile_sample_min_size / 8)
         tile_overlap_factor = 0.25
@@ -658,14 +694,11 @@ class WanVAE_(nn.Module):
 
         # Split z into overlapping tiles and decode them separately.
         # The tiles have an overlap to avoid seams between tiles.
-        rows = []
-        for i in range(0, z.shape[-2], overlap_size):
-            row = []
-            for j in range(0, z.shape[-1], overlap_size):
-                tile = z[:, :, :, i: i + tile_latent_min_size, j: j + tile_latent_min_size]
-                decoded = self.decode(tile, any_end_frame= any_end_frame)
-                row.append(decoded)
-            rows.append(row)
+        row_starts, col_starts = range(0, z.shape[-2], overlap_size), range(0, z.shape[-1], overlap_size)
+        tiles = [z[:, :, :, i: i + tile_latent_min_size, j: j + tile_latent_min_size] for i in row_starts for j in col_starts]
+        tiles = process_tiles_batched(tiles, lambda tile: self.decode(tile, any_end_frame= any_end_frame), tile_batch_size)
+        rows = [tiles[n: n + len(col_starts)] for n in range(0, len(tiles), len(col_starts))]
+        tiles = None
         result_rows = []
         for i, row in enumerate(rows):
             result_row = []
@@ -682,7 +715,7 @@ class WanVAE_(nn.Module):
         return torch.cat(result_rows, dim=-2)
 
 
-    def spatial_tiled_encode(self, x, scale, tile_size, any_end_frame = False) :
+    def spatial_tiled_encode(self, x, scale, tile_size, any_end_frame = False, tile_batch_size = 1) :
         tile_sample_min_size = tile_size
         tile_latent_min_size = int(tile_sample_min_size / 8)
         tile_overlap_factor = 0.25
@@ -692,14 +725,11 @@ class WanVAE_(nn.Module):
         row_limit = tile_latent_min_size - blend_extent
 
         # Split video into tiles and encode them separately.
-        rows = []
-        for i in range(0, x.shape[-2], overlap_size):
-            row = []
-            for j in range(0, x.shape[-1], overlap_size):
-                tile = x[:, :, :, i: i + tile_sample_min_size, j: j + tile_sample_min_size]
-                tile = self.encode(tile, any_end_frame= any_end_frame)
-                row.append(tile)
-            rows.append(row)
+        row_starts, col_starts = range(0, x.shape[-2], overlap_size), range(0, x.shape[-1], overlap_size)
+        tiles = [x[:, :, :, i: i + tile_sample_min_size, j: j + tile_sample_min_size] for i in row_starts for j in col_starts]
+        tiles = process_tiles_batched(tiles, lambda tile: self.encode(tile, any_end_frame= any_end_frame), tile_batch_size)
+        rows = [tiles[n: n + len(col_starts)] for n in range(0, len(tiles), len(col_starts))]
+        tiles = None
         result_rows = []
         for i, row in enumerate(rows):
             result_row = []
@@ -826,20 +856,38 @@ class WanVAE:
 
         return  VAE_tile_size
 
-    def encode(self, videos, tile_size = 256, any_end_frame = False):
+    @profiler.trace("vae encode")
+    def encode(self, videos, tile_size = 256, any_end_frame = False, tile_batch_size = 1):
         """
         videos: A list of videos each with shape [C, T, H, W].
+        tile_batch_size: number of same shaped tiles encoded in one call, trades VRAM for speed
         """
         original_dtype = videos[0].dtype
         
         if tile_size > 0:
-            return [ self.model.spatial_tiled_encode(u.to(self.dtype).unsqueeze(0), self.scale, tile_size, any_end_frame=any_end_frame).float().squeeze(0) for u in videos ]
+            return [ self.model.spatial_tiled_encode(u.to(self.dtype).unsqueeze(0), self.scale, tile_size, any_end_frame=any_end_frame, tile_batch_size=tile_batch_size).float().squeeze(0) for u in videos ]
         else:
             return [ self.model.encode(u.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame).float().squeeze(0) for u in videos ]
 
 
-    def decode(self, zs, tile_size, any_end_frame = False):
+    def decode_stream(self, z, tile_size, any_end_frame = False, chunk_size = 4, tile_batch_size = 1):
+        """
+        z: A single latent with shape [C, T, H, W].
+        Yields the decoded video as clamped float chunks of shape [C, t, H, W] on the VAE device.
+        """
+        if tile_size > 0:
+            # tiles are decoded over their full temporal extent, so only the transfer of the result can be streamed
+            video = self.model.spatial_tiled_decode(z.to(self.dtype).unsqueeze(0), self.scale, tile_size, any_end_frame=any_end_frame, tile_batch_size=tile_batch_size).squeeze(0)
+            for i in range(0, video.shape[1], chunk_size):
+                yield video[:, i:i + chunk_size].clamp(-1, 1).float()
+            video = None
+        else:
+            for chunk in self.model.decode_stream(z.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame):
+                yield chunk.clamp_(-1, 1).float().squeeze(0)
+
+    @profiler.trace("vae decode")
+    def decode(self, zs, tile_size, any_end_frame = False, tile_batch_size = 1):
         if tile_size > 0:
-            return [ self.model.spatial_tiled_decode(u.to(self.dtype).unsqueeze(0), self.scale, tile_size, any_end_frame=any_end_frame).clamp_(-1, 1).float().squeeze(0) for u in zs ]
+            return [ self.model.spatial_tiled_decode(u.to(self.dtype).unsqueeze(0), self.scale, tile_size, any_end_frame=any_end_frame, tile_batch_size=tile_batch_size).clamp_(-1, 1).float().squeeze(0) for u in zs ]
         else:
             return [ self.model.decode(u.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame).clamp_(-1, 1).float().squeeze(0) for u in zs ]
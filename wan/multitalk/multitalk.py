@@ -168,19 +168,27 @@ def process_tts_multi(text, save_dir, voice1, voice2):
 
 
 def get_full_audio_embeddings(audio_guide1 = None, audio_guide2 = None, combination_type ="add", num_frames =  0, fps = 25, sr = 16000):
-    wav2vec_feature_extractor, audio_encoder= custom_init('cpu', "ckpts/chinese-wav2vec2-base")
-    # wav2vec_feature_extractor, audio_encoder= custom_init('cpu', "ckpts/wav2vec")
-
-    new_human_speech1, new_human_speech2, sum_human_speechs = audio_prepare_multi(audio_guide1, audio_guide2, combination_type, duration= num_frames / fps)
-    audio_embedding_1 = get_embedding(new_human_speech1, wav2vec_feature_extractor, audio_encoder, sr=sr, fps= fps)
-    audio_embedding_2 = get_embedding(new_human_speech2, wav2vec_feature_extractor, audio_encoder, sr=sr, fps= fps)
-
-    full_audio_embs = []
-    if audio_guide1 != None: full_audio_embs.append(audio_embedding_1)
-    # if audio_guide1 != None: full_audio_embs.append(audio_embedding_1)
-    if audio_guide2 != None: full_audio_embs.append(audio_embedding_2)
-    if audio_guide2 == None: sum_human_speechs = None
-    return full_audio_embs, sum_human_speechs
+    from wan.utils.audio_encoder import audio_encoder_service
+    wav2vec = "ckpts/chinese-wav2vec2-base"
+    # wav2vec = "ckpts/wav2vec"
+
+    def compute():
+        wav2vec_feature_extractor, audio_encoder= audio_encoder_service.get_encoder(wav2vec, lambda: custom_init('cpu', wav2vec))
+
+        new_human_speech1, new_human_speech2, sum_human_speechs = audio_prepare_multi(audio_guide1, audio_guide2, combination_type, duration= num_frames / fps)
+        audio_embedding_1 = get_embedding(new_human_speech1, wav2vec_feature_extractor, audio_encoder, sr=sr, fps= fps)
+        audio_embedding_2 = get_embedding(new_human_speech2, wav2vec_feature_extractor, audio_encoder, sr=sr, fps= fps)
+
+        full_audio_embs = []
+        if audio_guide1 != None: full_audio_embs.append(audio_embedding_1)
+        # if audio_guide1 != None: full_audio_embs.append(audio_embedding_1)
+        if audio_guide2 != None: full_audio_embs.append(audio_embedding_2)
+        if audio_guide2 == None: sum_human_speechs = None
+        return full_audio_embs, sum_human_speechs
+
+    # audio tracks are loudness normalized (-23 lufs) before being encoded
+    key = ("multitalk", wav2vec, audio_encoder_service.get_file_hash(audio_guide1), audio_encoder_service.get_file_hash(audio_guide2), combination_type, num_frames, fps, sr, "lufs-23")
+    return audio_encoder_service.get_embeddings(key, compute)
 
 
 def get_window_audio_embeddings(full_audio_embs, audio_start_idx=0, clip_length = 81, vae_scale = 4, audio_window = 5):
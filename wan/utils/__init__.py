@@ -1,8 +1,9 @@
 from .fm_solvers import (FlowDPMSolverMultistepScheduler, get_sampling_sigmas,
                          retrieve_timesteps)
-from .fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .fm_solvers_unipc import FlowUniPCMultistepScheduler, FlowUniPCMultiFrameScheduler
 
 __all__ = [
     'HuggingfaceTokenizer', 'get_sampling_sigmas', 'retrieve_timesteps',
-    'FlowDPMSolverMultistepScheduler', 'FlowUniPCMultistepScheduler'
+    'FlowDPMSolverMultistepScheduler', 'FlowUniPCMultistepScheduler',
+    'FlowUniPCMultiFrameScheduler'
 ]
@@ -0,0 +1,88 @@
+import os
+import gc
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _clone(obj, device = None):
+    # cached results are never handed out directly, so that callers can't modify them in place
+    if torch.is_tensor(obj):
+        return obj.to(device) if device is not None and obj.device != torch.device(device) else obj.clone()
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_clone(o, device) for o in obj)
+    if hasattr(obj, "copy"):
+        return obj.copy()
+    return obj
+
+
+class AudioEncoderService:
+    """
+    Process wide audio front-end of the talking head models: the feature extractors / wav2vec encoders are loaded once
+    and kept in RAM, and the embeddings computed for an audio track are cached so that generating again with the same
+    voice track (other seed, other prompt, ...) skips the audio encoding.
+    """
+
+    def __init__(self, resident = True, max_embeddings = 8):
+        self.resident = resident
+        self.max_embeddings = max_embeddings
+        self._encoders = {}
+        self._embeddings = OrderedDict()
+        self._hashes = {}
+        self._lock = threading.RLock()
+
+    def configure(self, resident, max_embeddings):
+        with self._lock:
+            self.resident = resident
+            self.max_embeddings = max_embeddings
+            if not resident:
+                self._encoders = {}
+            self._evict()
+
+    def get_file_hash(self, file_path):
+        # content hash, the tmp files of separated speakers get a new name each time but have the same content
+        if file_path is None:
+            return None
+        from wan.utils.queue_assets import hash_file
+        stat = os.stat(file_path)
+        signature = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        file_hash = self._hashes.get(signature, None)
+        if file_hash is None:
+            file_hash = self._hashes[signature] = hash_file(file_path)
+        return file_hash
+
+    def get_encoder(self, name, builder):
+        with self._lock:
+            encoder = self._encoders.get(name, None)
+            if encoder is None:
+                encoder = builder()
+                if self.resident:
+                    self._encoders[name] = encoder
+            return encoder
+
+    def get_embeddings(self, key, compute, device = None):
+        with self._lock:
+            embeddings = self._embeddings.get(key, None)
+            if embeddings is None:
+                embeddings = compute()
+                if self.max_embeddings > 0:
+                    self._embeddings[key] = _clone(embeddings, "cpu")
+                    self._evict()
+                return embeddings
+            self._embeddings.move_to_end(key)
+            return _clone(embeddings, device)
+
+    def _evict(self):
+        while len(self._embeddings) > max(self.max_embeddings, 0):
+            self._embeddings.popitem(last=False)
+
+    def release(self):
+        with self._lock:
+            self._encoders = {}
+            self._embeddings = OrderedDict()
+            self._hashes = {}
+        gc.collect()
+
+
+audio_encoder_service = AudioEncoderService()
@@ -798,3 +798,122 @@ class FlowUniPCMultistepScheduler(SchedulerMixin, ConfigMixin):
 
     def __len__(self):
         return self.config.num_train_timesteps
+
+
+class FlowUniPCMultiFrameScheduler:
+    """
+    UniPC solver of FlowUniPCMultistepScheduler (flow_prediction, predict_x0, bh2, order <= 2, lower_order_final) for
+    diffusion forcing, where each latent frame is at its own step of the same schedule. The solver state of all the
+    frames is kept in tensors and the frames updated at a denoising step are stepped together, each frame with the
+    coefficients of its own step index, which are precomputed for the whole schedule.
+    """
+
+    def __init__(self, num_frames, num_inference_steps, device = None, shift = 1.0, solver_order = 2, num_train_timesteps = 1000):
+        if solver_order not in [1, 2]:
+            raise NotImplementedError(f"solver_order {solver_order} is not implemented for {self.__class__}")
+        scheduler = FlowUniPCMultistepScheduler(num_train_timesteps=num_train_timesteps, solver_order=solver_order, shift=1, use_dynamic_shifting=False)
+        scheduler.set_timesteps(num_inference_steps, device=device, shift=shift)
+        self.timesteps = scheduler.timesteps
+        self.sigmas = scheduler.sigmas
+        self.num_inference_steps = len(self.timesteps)
+        self.solver_order = solver_order
+        self.num_frames = num_frames
+        # number of steps done by each frame
+        self.step_indices = torch.zeros(num_frames, dtype=torch.int64)
+        self.coefficients = self._get_coefficients()
+        self.model_outputs = None
+        self.prev_model_outputs = None
+        self.last_samples = None
+
+    def _get_order(self, step_index):
+        # order of the predictor at this step index (warmup and lower order final steps)
+        return min(self.solver_order, self.num_inference_steps - step_index, step_index + 1)
+
+    def _get_coefficients(self):
+        # for each step index s, with m the converted model output, m0 / m1 the last two converted outputs of the frame
+        # and x0 the sample before the last predictor:
+        # corrected x = e x + a x0 + b m0 + c (m1 - m0) + d (m - m0)
+        # next x = pa corrected x + pb m + pc (m0 - m)
+        sigmas = self.sigmas.double().tolist()
+
+        def get_lambda(sigma):
+            return math.log(1 - sigma) - math.log(sigma) if sigma > 0 else math.inf
+
+        def get_h(sigma_t, sigma_s0):
+            hh = -(get_lambda(sigma_t) - get_lambda(sigma_s0))
+            return hh, math.expm1(hh)
+
+        coefficients = []
+        for s in range(self.num_inference_steps):
+            if s == 0:
+                corrector = [1., 0., 0., 0., 0.]
+            else:
+                sigma_t, sigma_s0 = sigmas[s], sigmas[s - 1]
+                alpha_t = 1 - sigma_t
+                hh, h_phi_1 = get_h(sigma_t, sigma_s0)
+                B_h = h_phi_1
+                h_phi_k = h_phi_1 / hh - 1
+                b1 = h_phi_k / B_h
+                h_phi_k = h_phi_k / hh - 1 / 2
+                b2 = h_phi_k * 2 / B_h
+                if self._get_order(s - 1) == 1:
+                    rho_0, rho_1, c = 0., 0.5, 0.
+                else:
+                    rk = (get_lambda(sigmas[s - 2]) - get_lambda(sigma_s0)) / -hh
+                    rho_0 = (b1 - b2) / (1 - rk)
+                    rho_1 = b1 - rho_0
+                    c = -alpha_t * B_h * rho_0 / rk
+                corrector = [0., sigma_t / sigma_s0, -alpha_t * h_phi_1, c, -alpha_t * B_h * rho_1]
+
+            sigma_t, sigma_s0 = sigmas[s + 1], sigmas[s]
+            alpha_t = 1 - sigma_t
+            hh, h_phi_1 = get_h(sigma_t, sigma_s0)
+            if self._get_order(s) == 2:
+                rk = (get_lambda(sigmas[s - 1]) - get_lambda(sigma_s0)) / -hh
+                pc = -alpha_t * h_phi_1 * 0.5 / rk
+            else:
+                pc = 0.
+            coefficients.append([sigmas[s]] + corrector + [sigma_t / sigma_s0, -alpha_t * h_phi_1, pc])
+        return torch.tensor(coefficients, dtype=torch.float32)
+
+    def step(self, model_output, latents, update_mask, start = 0):
+        """
+        Steps in place the frames of latents (b, c, f, h, w) selected by update_mask (cpu bool tensor of f frames)
+        model_output (b, c, n, h, w) is the output of the model for the frames start to start + n, the frames out of
+        this interval are not updated.
+        """
+        end = start + model_output.shape[2]
+        frame_ids = torch.nonzero(update_mask[start:end])[:, 0] + start
+        if len(frame_ids) == 0:
+            return latents
+        if self.model_outputs is None:
+            self.model_outputs = torch.zeros_like(latents)
+            self.prev_model_outputs = torch.zeros_like(latents)
+            self.last_samples = torch.zeros_like(latents)
+
+        first, last = frame_ids[0].item(), frame_ids[-1].item()
+        if last - first + 1 == len(frame_ids):
+            # the updated frames are usually contiguous, slices avoid gathering / scattering them
+            index = slice(first, last + 1)
+            out_index = slice(first - start, last + 1 - start)
+        else:
+            index = frame_ids.to(latents.device)
+            out_index = index - start
+
+        coefficients = self.coefficients[self.step_indices[frame_ids]].to(device=latents.device, dtype=latents.dtype)
+        sigma, e, a, b, c, d, pa, pb, pc = coefficients.t().reshape(9, 1, 1, -1, 1, 1).unbind(0)
+
+        sample = latents[:, :, index]
+        model_output = model_output[:, :, out_index].to(latents.dtype)
+        m0 = self.model_outputs[:, :, index]
+        m1 = self.prev_model_outputs[:, :, index]
+
+        model_output = sample - sigma * model_output
+        sample = e * sample + a * self.last_samples[:, :, index] + b * m0 + c * (m1 - m0) + d * (model_output - m0)
+        latents[:, :, index] = pa * sample + pb * model_output + pc * (m0 - model_output)
+
+        self.prev_model_outputs[:, :, index] = m0
+        self.model_outputs[:, :, index] = model_output
+        self.last_samples[:, :, index] = sample
+        self.step_indices[frame_ids] += 1
+        return latents
@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import glob
+import struct
+import hashlib
+import threading
+
+INDEX_VERSION = 1
+LORA_EXTENSIONS = ["*.sft", "*.safetensors"]
+
+
+def read_safetensors_header(file_path):
+    with open(file_path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        return json.loads(f.read(header_size))
+
+
+def get_lora_info(file_path):
+    # key signature, targeted modules and rank of a lora, read from the header of the file only
+    header = read_safetensors_header(file_path)
+    header.pop("__metadata__", None)
+    keys = sorted(header.keys())
+    signature = hashlib.sha1("\n".join(f"{k}:{header[k].get('dtype')}:{header[k].get('shape')}" for k in keys).encode("utf-8")).hexdigest()
+    # targeted modules families, for instance "diffusion_model.blocks" or "lora_unet_single_blocks"
+    targets = sorted(set(re.split(r"[._]\d", k)[0] for k in keys))
+    ranks = [min(header[k]["shape"]) for k in keys if len(header[k].get("shape", [])) == 2 and re.search(r"lora_down|lora_A|lora\.down", k) is not None]
+    return {"signature": signature, "targets": targets, "rank": max(ranks) if len(ranks) > 0 else None}
+
+
+class LoraIndex:
+    """
+    Persistent index of the lora files, keyed by path and validated by size and modification time: the header of a
+    file is only read again when the file changes, and the compatibility verdict of a file is kept per model type,
+    so that only the new or modified files of a folder go through the (slow) compatibility check.
+    Verdicts are also shared by the files with the same key signature, and they are dropped when the version of the
+    checker changes.
+    """
+
+    def __init__(self, path = None, check_version = ""):
+        self.path = path
+        self.check_version = check_version
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.RLock()
+        self._refresh_thread = None
+
+    def configure(self, path, check_version = ""):
+        with self.lock:
+            if path != self.path or check_version != self.check_version:
+                self.save()
+                self.path = path
+                self.check_version = check_version
+                self.entries = None
+
+    def _get_entries(self):
+        if self.entries is None:
+            self.entries = {}
+            if self.path is not None and os.path.isfile(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        index = json.load(f)
+                except (OSError, ValueError):
+                    # corrupted index, it is rebuilt
+                    index = {}
+                if index.get("version", None) == INDEX_VERSION:
+                    self.entries = index.get("files", {})
+                    if index.get("check_version", "") != self.check_version:
+                        for entry in self.entries.values():
+                            entry["verdicts"] = {}
+                        self.dirty = True
+        return self.entries
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.path is None or self.entries is None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "check_version": self.check_version, "files": self.entries}, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    def get_entry(self, file_path):
+        # entry of a file, (re)built if the file is new or has changed since it was indexed
+        with self.lock:
+            entries = self._get_entries()
+            stat = os.stat(file_path)
+            key = os.path.abspath(file_path)
+            entry = entries.get(key, None)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "verdicts": {}}
+                try:
+                    entry.update(get_lora_info(file_path))
+                except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+                    entry["error"] = str(e)
+                entries[key] = entry
+                self.dirty = True
+            return entry
+
+    def list_loras(self, lora_dir):
+        # lora files of a folder, sorted, the entries of the files that have been removed are dropped
+        loras = []
+        for pattern in LORA_EXTENSIONS:
+            loras += glob.glob(os.path.join(lora_dir, pattern))
+        loras.sort()
+        with self.lock:
+            entries = self._get_entries()
+            root = os.path.abspath(lora_dir)
+            existing = set(os.path.abspath(lora) for lora in loras)
+            for key in [key for key in entries if os.path.dirname(key) == root and key not in existing]:
+                del entries[key]
+                self.dirty = True
+        return loras
+
+    def filter_compatible(self, model_type, loras, check):
+        """
+        Returns the loras of the list that are compatible with model_type.
+        check(loras) returns the compatible loras of a list, it is only called with the files whose verdict is not known.
+        """
+        with self.lock:
+            shared_verdicts = {}
+            for entry in self._get_entries().values():
+                if entry.get("signature", None) is not None and model_type in entry["verdicts"]:
+                    shared_verdicts[entry["signature"]] = entry["verdicts"][model_type]
+            unknown = []
+            for lora in loras:
+                entry = self.get_entry(lora)
+                if model_type not in entry["verdicts"]:
+                    verdict = shared_verdicts.get(entry.get("signature", None), None)
+                    if verdict is None:
+                        unknown.append(lora)
+                    else:
+                        entry["verdicts"][model_type] = verdict
+                        self.dirty = True
+        if len(unknown) > 0:
+            compatible = set(check(unknown))
+            with self.lock:
+                for lora in unknown:
+                    self.get_entry(lora)["verdicts"][model_type] = lora in compatible
+                self.dirty = True
+        with self.lock:
+            loras = [lora for lora in loras if self.get_entry(lora)["verdicts"].get(model_type, False)]
+        self.save()
+        return loras
+
+    def refresh(self, lora_dirs):
+        for lora_dir in lora_dirs:
+            if lora_dir is None or not os.path.isdir(lora_dir):
+                continue
+            for lora in self.list_loras(lora_dir):
+                try:
+                    self.get_entry(lora)
+                except OSError:
+                    pass
+        self.save()
+
+    def refresh_async(self, lora_dirs):
+        # reads the headers of the new / modified files in a background thread, so that a later check has less to do
+        with self.lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, args=(list(lora_dirs),), name="lora_index_refresh", daemon=True)
+            self._refresh_thread.start()
+
+
+lora_index = LoraIndex()
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+import torch
+
+
+class Span:
+    __slots__ = ("name", "cat", "args", "start", "end", "tid", "parent", "peak_vram")
+
+    def __init__(self, name, cat, args, parent):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.parent = parent
+        self.tid = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+        self.peak_vram = 0
+
+
+class Profiler:
+    """
+    Opt-in tracer of the phases of a generation: spans can be nested (model load > denoising step > model pass ...)
+    and record the VRAM high-water mark reached while they were open. Spans of a task can be summarized per name
+    and exported as a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+    The VRAM peak counter of torch is process wide, so once memory_thread is set only the spans opened by this thread
+    reset it and record a peak, the spans of the other threads (output save ...) are timed only.
+    When disabled, begin / end / span / instant cost a test.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.instants = []
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_thread = None
+        self._origin = time.perf_counter()
+
+    def _get_stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _track_memory(self, tid):
+        if self.memory_thread is not None and tid != self.memory_thread:
+            return False
+        return torch.cuda.is_available() and torch.cuda.is_initialized()
+
+    def begin(self, name, cat = "phase", **args):
+        if not self.enabled:
+            return None
+        stack = self._get_stack()
+        parent = stack[-1] if len(stack) > 0 else None
+        if self._track_memory(threading.get_ident()):
+            # the peak counter is global: the peak reached so far is credited to the parent before being reset
+            if parent is not None:
+                parent.peak_vram = max(parent.peak_vram, torch.cuda.max_memory_allocated())
+            torch.cuda.reset_peak_memory_stats()
+        span = Span(name, cat, args, parent)
+        stack.append(span)
+        return span
+
+    def end(self, span, **args):
+        if span is None or span.end is not None:
+            return
+        span.end = time.perf_counter()
+        span.args.update(args)
+        if self._track_memory(span.tid):
+            span.peak_vram = max(span.peak_vram, torch.cuda.max_memory_allocated())
+            if span.parent is not None:
+                span.parent.peak_vram = max(span.parent.peak_vram, span.peak_vram)
+        stack = self._get_stack()
+        if span in stack:
+            # spans left open by an early exit of a nested phase are closed with their parent
+            while len(stack) > 0:
+                open_span = stack.pop()
+                if open_span is span:
+                    break
+                if open_span.end is None:
+                    open_span.end = span.end
+                    with self.lock:
+                        self.spans.append(open_span)
+        with self.lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name, cat = "phase", **args):
+        span = self.begin(name, cat, **args)
+        try:
+            yield span
+        finally:
+            self.end(span)
+
+    def trace(self, name, cat = "phase"):
+        # decorator recording each call of a function as a span
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.span(name, cat):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instant(self, name, cat = "event", **args):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.instants.append((name, cat, args, threading.get_ident(), time.perf_counter()))
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.instants = []
+        self._origin = time.perf_counter()
+
+    def get_summary(self, since = None):
+        # total time, number of occurences and VRAM peak per span name, in the order they first appeared
+        # since: time.perf_counter() value, only the spans started after it are summarized
+        with self.lock:
+            spans = sorted([span for span in self.spans if since is None or span.start >= since], key=lambda span: span.start)
+            instants = [instant for instant in self.instants if since is None or instant[4] >= since]
+        summary = {}
+        for span in spans:
+            entry = summary.setdefault(span.name, {"count": 0, "total_s": 0., "max_s": 0.})
+            duration = span.end - span.start
+            entry["count"] += 1
+            entry["total_s"] += duration
+            entry["max_s"] = max(entry["max_s"], duration)
+            if span.peak_vram > 0:
+                entry["peak_vram_gb"] = max(entry.get("peak_vram_gb", 0), span.peak_vram / 1024**3)
+        for name, _, _, _, _ in instants:
+            entry = summary.setdefault(name, {"count": 0})
+            entry["count"] += 1
+        for entry in summary.values():
+            for key in ["total_s", "max_s", "peak_vram_gb"]:
+                if key in entry: entry[key] = round(entry[key], 3)
+        return summary
+
+    def export_chrome_trace(self, file_path):
+        pid = os.getpid()
+        events = []
+        with self.lock:
+            spans = list(self.spans)
+            instants = list(self.instants)
+        for span in spans:
+            args = dict(span.args)
+            if span.peak_vram > 0: args["peak_vram_gb"] = round(span.peak_vram / 1024**3, 3)
+            events.append({"name": span.name, "cat": span.cat, "ph": "X", "pid": pid, "tid": span.tid,
+                           "ts": (span.start - self._origin) * 1e6, "dur": (span.end - span.start) * 1e6, "args": args})
+        for name, cat, args, tid, timestamp in instants:
+            events.append({"name": name, "cat": cat, "ph": "i", "s": "t", "pid": pid, "tid": tid, "ts": (timestamp - self._origin) * 1e6, "args": args})
+        events.sort(key=lambda event: event["ts"])
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return file_path
+
+
+profiler = Profiler()
@@ -0,0 +1,212 @@
+import os
+import io
+import json
+import shutil
+import hashlib
+import tempfile
+import weakref
+import threading
+
+from PIL import Image
+
+BLOB_HASH_LENGTH = 64
+
+
+def is_blob_name(name):
+    base = os.path.splitext(os.path.basename(name))[0]
+    return len(base) == BLOB_HASH_LENGTH and all(c in "0123456789abcdef" for c in base)
+
+
+def hash_file(file_path, chunk_size = 4 * 1024 * 1024):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class StoredImage:
+    """Image of a queued task kept in the asset store, it is only decoded when the task runs"""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def load(self):
+        with Image.open(self.store.get_path(self.name)) as img:
+            img.load()
+            image = img.convert("RGB") if img.mode != "RGB" else img.copy()
+        self.store.remember_image(image, self.name)
+        return image
+
+
+class QueueAssetStore:
+    """
+    Content addressed store of the images / videos / audio files referenced by queued tasks.
+    Each asset is saved once as <sha256><ext>: saving a queue again only writes the new assets,
+    and files are hard linked into the store when possible instead of being copied. A linked blob shares its content
+    with the source file, so the blobs whose size or modification time changed since they were stored are hashed again
+    by check before being used.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self._images = {}
+        self._files_index = None
+
+    def get_path(self, name):
+        return os.path.join(self.root, name)
+
+    def exists(self, name):
+        return os.path.isfile(self.get_path(name))
+
+    def _get_index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _get_files_index(self):
+        if self._files_index is None:
+            self._files_index = {}
+            if os.path.isfile(self._get_index_path()):
+                try:
+                    with open(self._get_index_path(), "r", encoding="utf-8") as f:
+                        self._files_index = json.load(f)
+                except Exception as e:
+                    print(f"Queue assets: unable to read the index, it will be rebuilt: {e}")
+        return self._files_index
+
+    def save_index(self):
+        with self.lock:
+            if self._files_index is None:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = self._get_index_path() + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._files_index, f)
+            os.replace(tmp_path, self._get_index_path())
+
+    def remember_image(self, image, name):
+        # PIL images are not hashable, the entries are keyed by id and dropped when their image is collected
+        key = id(image)
+        entry = self._images.get(key, None)
+        if entry is None or entry[0]() is not image:
+            weakref.finalize(image, self._forget_image, key)
+        self._images[key] = (weakref.ref(image), name)
+
+    def _forget_image(self, key):
+        entry = self._images.get(key, None)
+        if entry is not None and entry[0]() is None:
+            del self._images[key]
+
+    def _get_image_name(self, image):
+        entry = self._images.get(id(image), None)
+        if entry is not None and entry[0]() is image:
+            return entry[1]
+        return None
+
+    def add_image(self, image):
+        if isinstance(image, StoredImage):
+            return image.name
+        name = self._get_image_name(image)
+        if name is not None and self.exists(name):
+            return name
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        data = buffer.getvalue()
+        name = hashlib.sha256(data).hexdigest() + ".png"
+        if not self.exists(name):
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = self.get_path(name) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.get_path(name))
+        self.remember_image(image, name)
+        return name
+
+    def check(self, name):
+        # returns name if the asset exists and still has the content it is named after, None otherwise
+        if not self.exists(name):
+            return None
+        with self.lock:
+            signatures = [entry[:2] for entry in self._get_files_index().values() if entry[2] == name]
+        if len(signatures) == 0:
+            return name
+        stat = os.stat(self.get_path(name))
+        if [stat.st_size, stat.st_mtime_ns] in signatures:
+            return name
+        new_name = hash_file(self.get_path(name)) + os.path.splitext(name)[1]
+        if new_name == name:
+            return name
+        # the source file of a hard linked blob has been edited in place, the blob is moved under its new hash
+        print(f"Queue assets: '{name}' has been modified since it was stored and can't be used anymore")
+        if self.exists(new_name):
+            os.remove(self.get_path(name))
+        else:
+            os.replace(self.get_path(name), self.get_path(new_name))
+        with self.lock:
+            index = self._get_files_index()
+            for file_path in [path for path, entry in index.items() if entry[2] == name]:
+                del index[file_path]
+        return None
+
+    def add_file(self, file_path):
+        file_path = os.path.abspath(file_path)
+        if os.path.dirname(file_path) == os.path.abspath(self.root) and is_blob_name(file_path):
+            return os.path.basename(file_path)
+        stat = os.stat(file_path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        index = self._get_files_index()
+        entry = index.get(file_path, None)
+        if entry is not None and entry[:2] == signature and self.exists(entry[2]):
+            return entry[2]
+        _, extension = os.path.splitext(file_path)
+        name = hash_file(file_path) + (extension.lower() if extension else ".mp4")
+        if not self.exists(name):
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                os.link(file_path, self.get_path(name))
+            except OSError:
+                # hard links are not possible across devices or on some file systems
+                tmp_path = self.get_path(name) + ".tmp"
+                shutil.copy2(file_path, tmp_path)
+                os.replace(tmp_path, self.get_path(name))
+        with self.lock:
+            index[file_path] = signature + [name]
+        return name
+
+    def import_from_zip(self, zf, member):
+        # assets of archives written by the store are already named after their content and are only extracted once
+        if is_blob_name(member) and self.exists(os.path.basename(member)):
+            return os.path.basename(member)
+        os.makedirs(self.root, exist_ok=True)
+        # a unique temporary file per import, several sessions may load a queue at the same time
+        handle, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.root)
+        with zf.open(member) as src, os.fdopen(handle, "wb") as dst:
+            shutil.copyfileobj(src, dst, 4 * 1024 * 1024)
+        _, extension = os.path.splitext(member)
+        name = hash_file(tmp_path) + (extension.lower() if extension else ".mp4")
+        if self.exists(name):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, self.get_path(name))
+        return name
+
+    def prune(self, names_to_keep):
+        # removes the assets that are not referenced anymore
+        if not os.path.isdir(self.root):
+            return
+        names_to_keep = set(names_to_keep)
+        for name in os.listdir(self.root):
+            if is_blob_name(name) and name not in names_to_keep:
+                try:
+                    os.remove(self.get_path(name))
+                except OSError as e:
+                    print(f"Queue assets: unable to remove '{name}': {e}")
+        with self.lock:
+            index = self._get_files_index()
+            for file_path in [path for path, entry in index.items() if entry[2] not in names_to_keep]:
+                del index[file_path]
+        self.save_index()
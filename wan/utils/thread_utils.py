@@ -1,45 +1,63 @@
 # based on FramePack https://github.com/lllyasviel/FramePack
 
-import time
+import asyncio
+import queue
 import traceback
+from collections import deque
 
-from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Thread, Lock, Condition, BoundedSemaphore
 
 
 class Listener:
-    task_queue = []
+    task_queue = queue.SimpleQueue()
     lock = Lock()
     thread = None
-    
+    _previous_thread = None
+
     @classmethod
-    def _process_tasks(cls):
+    def _process_tasks(cls, task_queue, previous_thread = None):
+        # each worker has its own queue so that the sentinel of a shut down worker can't stop its successor,
+        # which waits for the tasks left to its predecessor to keep the submission order
+        if previous_thread is not None:
+            previous_thread.join()
         while True:
-            task = None
-            with cls.lock:
-                if cls.task_queue:
-                    task = cls.task_queue.pop(0)
-                    
+            # blocks until a task is available, no busy polling
+            task = task_queue.get()
             if task is None:
-                time.sleep(0.001)
-                continue
-                
+                break
+
             func, args, kwargs = task
             try:
                 func(*args, **kwargs)
             except Exception as e:
-                tb = traceback.format_exc().split('\n')[:-1] 
+                tb = traceback.format_exc().split('\n')[:-1]
                 print('\n'.join(tb))
 
                 # print(f"Error in listener thread: {e}")
-    
+
     @classmethod
     def add_task(cls, func, *args, **kwargs):
         with cls.lock:
-            cls.task_queue.append((func, args, kwargs))
+            cls.task_queue.put((func, args, kwargs))
+            if cls.thread is None:
+                previous_thread, cls._previous_thread = cls._previous_thread, None
+                cls.thread = Thread(target=cls._process_tasks, args=(cls.task_queue, previous_thread), daemon=True)
+                cls.thread.start()
 
-        if cls.thread is None:
-            cls.thread = Thread(target=cls._process_tasks, daemon=True)
-            cls.thread.start()
+    @classmethod
+    def shutdown(cls, timeout = None):
+        # the pending tasks are processed before the thread exits
+        with cls.lock:
+            thread = cls.thread
+            if thread is None:
+                return True
+            cls.task_queue.put(None)
+            cls.task_queue = queue.SimpleQueue()
+            cls.thread = None
+            cls._previous_thread = thread
+        thread.join(timeout)
+        return not thread.is_alive()
 
 
 def async_run(func, *args, **kwargs):
@@ -48,17 +66,23 @@ def async_run(func, *args, **kwargs):
 
 class FIFOQueue:
     def __init__(self):
-        self.queue = []
+        self.queue = deque()
         self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.closed = False
+        self._async_waiters = []
 
     def push(self, cmd, data = None):
         with self.lock:
             self.queue.append( (cmd, data) )
+            self.not_empty.notify()
+            waiters, self._async_waiters = self._async_waiters, []
+        _wake_async_waiters(waiters)
 
     def pop(self):
         with self.lock:
             if self.queue:
-                return self.queue.pop(0)
+                return self.queue.popleft()
             return None
 
     def top(self):
@@ -67,16 +91,122 @@ class FIFOQueue:
                 return self.queue[0]
             return None
 
-    def next(self):
+    def next(self, timeout = None):
+        # waits for the next item, returns None on timeout or if the queue has been closed
+        with self.lock:
+            if not self.not_empty.wait_for(lambda: self.queue or self.closed, timeout):
+                return None
+            if self.queue:
+                return self.queue.popleft()
+            return None
+
+    async def next_async(self, timeout = None):
+        # asyncio version of next: awaits the next item without blocking the event loop
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
         while True:
+            remaining = None if deadline is None else deadline - loop.time()
             with self.lock:
                 if self.queue:
-                    return self.queue.pop(0)
+                    return self.queue.popleft()
+                if self.closed or remaining is not None and remaining <= 0:
+                    return None
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    def close(self):
+        # wakes up all the consumers, items already queued can still be retrieved
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        _wake_async_waiters(waiters)
+
+
+def _set_future_done(future):
+    if not future.done():
+        future.set_result(None)
+
 
-            time.sleep(0.001)
+def _wake_async_waiters(waiters):
+    for loop, future in waiters:
+        try:
+            loop.call_soon_threadsafe(_set_future_done, future)
+        except RuntimeError:
+            # the event loop of this waiter has already been closed
+            pass
 
 
 class AsyncStream:
     def __init__(self):
         self.input_queue = FIFOQueue()
         self.output_queue = FIFOQueue()
+
+
+class OutputPipeline:
+    """
+    Background stage that runs output jobs (encoding, muxing, metadata) in submission order.
+    At most max_pending jobs (and therefore their frames) may be in flight, submit blocks beyond that.
+    With max_pending = 0 the jobs are run synchronously by the caller.
+    """
+
+    def __init__(self, max_pending = 2):
+        self.max_pending = max_pending
+        self.executor = None
+        self.slots = None
+        self.lock = Lock()
+        self.pending = set()
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="output_pipeline")
+                self.slots = BoundedSemaphore(self.max_pending)
+            return self.executor, self.slots
+
+    def _run(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            tb = traceback.format_exc().split('\n')[:-1]
+            print('\n'.join(tb))
+            raise
+
+    def submit(self, func, *args, **kwargs):
+        if self.max_pending <= 0:
+            self._run(func, args, kwargs)
+            return None
+        executor, slots = self._get_executor()
+        # backpressure: wait for a slot so that the frames of too many videos are not kept in memory
+        slots.acquire()
+        try:
+            future = executor.submit(self._run, func, args, kwargs)
+        except Exception:
+            slots.release()
+            raise
+        with self.lock:
+            self.pending.add(future)
+        def on_done(future):
+            with self.lock:
+                self.pending.discard(future)
+            slots.release()
+        future.add_done_callback(on_done)
+        return future
+
+    def wait(self, timeout = None):
+        with self.lock:
+            pending = list(self.pending)
+        if len(pending) > 0:
+            wait(pending, timeout)
+        with self.lock:
+            return len(self.pending) == 0
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -145,6 +145,55 @@ def resize_lanczos(img, h, w):
     img = img.resize((w,h), resample=Image.Resampling.LANCZOS) 
     return torch.from_numpy(np.array(img).astype(np.float32) / 255.0).movedim(-1, 0)
 
+def map_frames(func, items, max_workers = 1):
+    # cv2 / PIL release the GIL, so per frame work can be spread over threads
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
+
+def resize_frames(frames, width, height, method = "torch", device = "cpu", batch_size = 16, max_workers = 1):
+    """
+    Resizes a stack of uint8 frames (F, H, W, C) at once and returns a uint8 numpy array (F, height, width, C).
+    method: "torch" (antialiased bicubic interpolation of whole batches, on cpu or gpu), "cv2" or "pil" (lanczos, one frame at a time)
+    """
+    if len(frames) == 0:
+        return np.zeros((0, height, width, frames.shape[-1]), dtype=np.uint8)
+    if frames.shape[1:3] == (height, width):
+        return frames.cpu().numpy() if torch.is_tensor(frames) else np.ascontiguousarray(frames)
+    if method == "torch":
+        if device != "cpu" and not torch.cuda.is_available():
+            device = "cpu"
+        output = np.empty((len(frames), height, width, frames.shape[-1]), dtype=np.uint8)
+        for start in range(0, len(frames), batch_size):
+            batch = torch.as_tensor(frames[start:start + batch_size]).to(device)
+            batch = batch.permute(0, 3, 1, 2).float()
+            batch = F.interpolate(batch, size=(height, width), mode="bicubic", antialias=True, align_corners=False)
+            output[start:start + batch_size] = batch.round_().clamp_(0, 255).to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+        return output
+    frames = frames.cpu().numpy() if torch.is_tensor(frames) else frames
+    if method == "cv2":
+        interpolation = cv2.INTER_AREA if width * height < frames.shape[1] * frames.shape[2] else cv2.INTER_LANCZOS4
+        resize = lambda frame: cv2.resize(np.ascontiguousarray(frame), (width, height), interpolation=interpolation).reshape(height, width, -1)
+    else:
+        resize = lambda frame: np.array(Image.fromarray(frame).resize((width, height), resample=Image.Resampling.LANCZOS)).reshape(height, width, -1)
+    return np.stack(map_frames(resize, list(frames), max_workers))
+
+def get_masks_boxes(masks):
+    # bounding boxes [x0, y0, x1, y1] of the 255 pixels of a stack of masks (F, H, W), None for empty masks
+    rows, cols = masks == 255, masks == 255
+    rows, cols = rows.any(axis=2), cols.any(axis=1)
+    boxes = []
+    for row, col in zip(rows, cols):
+        if not row.any():
+            boxes.append(None)
+            continue
+        y = np.flatnonzero(row)
+        x = np.flatnonzero(col)
+        boxes.append([int(x[0]), int(y[0]), int(x[-1]) + 1, int(y[-1]) + 1])
+    return boxes
+
 
 def remove_background(img, session=None):
     if session ==None:
@@ -238,6 +287,131 @@ def rand_name(length=8, suffix=''):
     return name
 
 
+def tensor_to_video_frames(tensor, value_range=(-1, 1)):
+    # c t h w float -> t h w c uint8, same conversion as make_grid(normalize=True) for a single video
+    low, high = min(value_range), max(value_range)
+    tensor = tensor.clamp(low, high).sub(low).div_(max(high - low, 1e-5))
+    return (tensor * 255).type(torch.uint8).permute(1, 2, 3, 0).cpu()
+
+
+class VideoStreamWriter:
+    """
+    Incremental video writer: frames chunks are converted to uint8 and piped to ffmpeg as soon as they are pushed,
+    the encoding being done by a background thread so that it overlaps with the production of the next chunks.
+    """
+
+    def __init__(self, save_file, fps=30, codec='libx264', quality=8, value_range=(-1, 1), max_pending_chunks=4):
+        import queue, threading
+        self.save_file = save_file
+        self.value_range = value_range
+        self.frames_count = 0
+        self.error = None
+        self._writer = imageio.get_writer(save_file, fps=fps, codec=codec, quality=quality)
+        # bounded queue: the producer is throttled if the encoder can't keep up, so that only a few frames are kept in memory
+        self._queue = queue.Queue(maxsize=max_pending_chunks)
+        self._thread = threading.Thread(target=self._encode_frames, daemon=True)
+        self._thread.start()
+
+    def _encode_frames(self):
+        while True:
+            frames = self._queue.get()
+            if frames is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                for frame in frames.numpy():
+                    self._writer.append_data(frame)
+            except Exception as e:
+                self.error = e
+
+    def write(self, chunk):
+        """chunk: float tensor [C, T, H, W] within value_range, may be on any device"""
+        if self.error is not None:
+            raise self.error
+        frames = tensor_to_video_frames(chunk, self.value_range)
+        self.frames_count += frames.shape[0]
+        self._queue.put(frames)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        if self.error is not None:
+            raise self.error
+        return self.save_file
+
+
+def stream_video(chunks, save_file, fps=30, value_range=(-1, 1)):
+    """Writes an iterable of [C, T, H, W] chunks (for instance WanVAE.decode_stream) to save_file"""
+    writer = VideoStreamWriter(save_file, fps=fps, value_range=value_range)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    finally:
+        writer.close()
+    return save_file
+
+
+class VideoFrameBuffer:
+    """
+    Frames of a video generated window by window ([C, T, H, W] within [-1, 1]), written in place in a preallocated tensor
+    instead of concatenating each window to all the frames generated so far. The tensor can be backed by a file created
+    in root so that long videos are not kept in RAM. Frames are never modified once written, so the views returned by
+    get_frames remain valid while the next windows are appended.
+    """
+
+    def __init__(self, expected_frames, dtype=torch.float32, root=None):
+        self.expected_frames = expected_frames
+        self.dtype = dtype
+        self.root = root
+        self.frames_count = 0
+        self._buffer = None
+        self._files_to_remove = []
+
+    def _allocate(self, shape):
+        if self.root is None:
+            return torch.empty(shape, dtype=self.dtype)
+        os.makedirs(self.root, exist_ok=True)
+        fd, file_path = tempfile.mkstemp(prefix="wgp_frames_", suffix=".bin", dir=self.root)
+        numel = int(np.prod(shape))
+        with os.fdopen(fd, "wb") as f:
+            f.truncate(numel * torch.empty((), dtype=self.dtype).element_size())
+        buffer = torch.from_file(file_path, shared=True, size=numel, dtype=self.dtype).view(shape)
+        try:
+            # the mapping stays valid once the file is unlinked, except on Windows where it is removed by release
+            os.remove(file_path)
+        except OSError:
+            self._files_to_remove.append(file_path)
+        return buffer
+
+    def append(self, frames):
+        channels, frames_count, height, width = frames.shape
+        needed = self.frames_count + frames_count
+        if self._buffer is None:
+            self._buffer = self._allocate((channels, max(self.expected_frames, needed), height, width))
+        elif needed > self._buffer.shape[1]:
+            # more windows than expected: the buffer grows geometrically so that the copies stay linear overall
+            buffer = self._allocate((channels, max(needed, int(self._buffer.shape[1] * 1.5)), height, width))
+            buffer[:, :self.frames_count] = self._buffer[:, :self.frames_count]
+            self._buffer = buffer
+        self._buffer[:, self.frames_count:needed] = frames
+        self.frames_count = needed
+
+    def get_frames(self):
+        return self._buffer[:, :self.frames_count]
+
+    def release(self):
+        self._buffer = None
+        self.frames_count = 0
+        for file_path in self._files_to_remove:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        self._files_to_remove = []
+
+
 def cache_video(tensor,
                 save_file=None,
                 fps=30,
@@ -245,7 +419,8 @@ def cache_video(tensor,
                 nrow=8,
                 normalize=True,
                 value_range=(-1, 1),
-                retry=5):
+                retry=5,
+                chunk_size=8):
     # cache file
     cache_file = osp.join('/tmp', rand_name(
         suffix=suffix)) if save_file is None else save_file
@@ -254,20 +429,25 @@ def cache_video(tensor,
     error = None
     for _ in range(retry):
         try:
+            if tensor.shape[0] == 1 and normalize:
+                # a single video: convert it a few frames at a time instead of materializing several full video copies
+                video = tensor[0]
+                return stream_video((video[:, i:i + chunk_size] for i in range(0, video.shape[1], chunk_size)), cache_file, fps=fps, value_range=value_range)
+
             # preprocess
-            tensor = tensor.clamp(min(value_range), max(value_range))
-            tensor = torch.stack([
+            frames = tensor.clamp(min(value_range), max(value_range))
+            frames = torch.stack([
                 torchvision.utils.make_grid(
                     u, nrow=nrow, normalize=normalize, value_range=value_range)
-                for u in tensor.unbind(2)
+                for u in frames.unbind(2)
             ],
                                  dim=1).permute(1, 2, 3, 0)
-            tensor = (tensor * 255).type(torch.uint8).cpu()
+            frames = (frames * 255).type(torch.uint8).cpu()
 
             # write video
             writer = imageio.get_writer(
                 cache_file, fps=fps, codec='libx264', quality=8)
-            for frame in tensor.numpy():
+            for frame in frames.numpy():
                 writer.append_data(frame)
             writer.close()
             return cache_file
@@ -51,8 +51,9 @@ import wan
 from wan.utils import notification_sound
 from wan.configs import MAX_AREA_CONFIGS, WAN_CONFIGS, SUPPORTED_SIZES, VACE_SIZE_CONFIGS
 from wan.utils.utils import expand_slist, update_loras_slists
-from wan.utils.utils import cache_video, convert_tensor_to_image, save_image, get_video_info, get_file_creation_date, convert_image_to_video
+from wan.utils.utils import cache_video, convert_tensor_to_image, save_image, get_video_info, get_file_creation_date, convert_image_to_video, tensor_to_video_frames
 from wan.utils.utils import extract_audio_tracks, combine_video_with_audio_tracks, cleanup_temp_audio_files, calculate_new_dimensions
+from wan.utils.profiler import profiler
 
 from wan.modules.attention import get_attention_modes, get_supported_attention_modes
 from huggingface_hub import hf_hub_download, snapshot_download    
@@ -82,6 +83,7 @@ import requests
 
 global_queue_ref = []
 AUTOSAVE_FILENAME = "queue.zip"
+AUTOSAVE_MANIFEST_FILENAME = "queue_autosave.json"
 PROMPT_VARS_MAX = 10
 
 target_mmgp_version = "3.5.3"
@@ -99,84 +101,6 @@ lock = threading.Lock()
 current_task_id = None
 task_id = 0
 
-# Global Performance Tracking System for RTX 5090
-class GlobalPerformanceTracker:
-    def __init__(self):
-        self.model_load_times = {}
-        self.generation_times = {}
-        self.memory_stats = {}
-        self.last_load_time = 0
-        self.rtx_5090_detected = False
-        
-        # Detect RTX 5090 on init
-        try:
-            if torch.cuda.is_available():
-                device_name = torch.cuda.get_device_name()
-                if "RTX 5090" in device_name:
-                    self.rtx_5090_detected = True
-                    print("🚀 Global RTX 5090 Performance Tracker Initialized")
-        except:
-            pass
-    
-    def start_model_load(self, model_name):
-        self.current_load_start = time.time()
-        self.current_model = model_name
-        
-    def end_model_load(self, model_name=None):
-        if hasattr(self, 'current_load_start'):
-            load_time = time.time() - self.current_load_start
-            model = model_name or getattr(self, 'current_model', 'unknown')
-            self.model_load_times[model] = load_time
-            self.last_load_time = load_time
-            
-            if self.rtx_5090_detected:
-                if load_time < 30:
-                    status = "⚡ EXCELLENT"
-                elif load_time < 60:
-                    status = "✅ GOOD"
-                elif load_time < 300:
-                    status = "⚠️ SLOW"
-                else:
-                    status = "🐌 VERY SLOW"
-                    
-                print(f"🚀 RTX 5090 LOAD PERFORMANCE: {model} loaded in {load_time:.1f}s - {status}")
-            
-    def get_memory_stats(self):
-        try:
-            if torch.cuda.is_available():
-                vram_used = torch.cuda.memory_allocated() / (1024**3)
-                vram_total = torch.cuda.get_device_properties(0).total_memory / (1024**3)
-                
-                import psutil
-                ram_used = psutil.virtual_memory().used / (1024**3)
-                ram_total = psutil.virtual_memory().total / (1024**3)
-                
-                return {
-                    'vram_used': vram_used,
-                    'vram_total': vram_total,
-                    'vram_percent': (vram_used / vram_total) * 100,
-                    'ram_used': ram_used,
-                    'ram_total': ram_total,
-                    'ram_percent': (ram_used / ram_total) * 100
-                }
-        except:
-            pass
-        return {}
-    
-    def get_performance_summary(self):
-        summary = []
-        if self.last_load_time > 0:
-            summary.append(f"Last Model Load: {self.last_load_time:.1f}s")
-        
-        memory = self.get_memory_stats()
-        if memory:
-            summary.append(f"VRAM: {memory['vram_used']:.1f}GB/{memory['vram_total']:.1f}GB ({memory['vram_percent']:.1f}%)")
-            summary.append(f"RAM: {memory['ram_used']:.1f}GB/{memory['ram_total']:.1f}GB ({memory['ram_percent']:.1f}%)")
-        
-        return " | ".join(summary)
-
-# Initialize global performance tracker
-global_perf_tracker = GlobalPerformanceTracker()
 vmc_event_handler = matanyone_app.get_vmc_event_handler()
 unique_id = 0
 unique_id_lock = threading.Lock()
@@ -797,6 +721,86 @@ def update_global_queue_ref(queue):
     with lock:
         global_queue_ref = queue[:]
 
+QUEUE_IMAGE_KEYS = ["image_start", "image_end", "image_refs", "image_guide", "image_mask"]
+QUEUE_FILE_KEYS = ["video_guide", "video_mask", "video_source", "audio_guide", "audio_guide2"]
+QUEUE_THUMBNAIL_KEYS = ["start_image_labels", "end_image_labels", "start_image_data_base64", "end_image_data_base64"]
+
+def get_queue_asset_store(assets_root = None):
+    from wan.utils.queue_assets import QueueAssetStore
+    if assets_root is None:
+        assets_root = os.path.abspath(os.path.join(server_config.get("save_path", "outputs"), "_queue_assets"))
+    return QueueAssetStore(assets_root)
+
+def build_queue_manifest(queue, store):
+    # only the assets that are not yet in the store are written
+    queue_manifest = []
+    assets_names = set()
+    for task_index, task in enumerate(queue):
+        if task is None or not isinstance(task, dict) or task.get('id') is None: continue
+
+        params_copy = task.get('params', {}).copy()
+        task_id_s = task.get('id', f"task_{task_index}")
+
+        for key in QUEUE_IMAGE_KEYS:
+            images = params_copy.get(key)
+            if images is None: continue
+            is_list = isinstance(images, list)
+            if not is_list: images = [images]
+            image_names = []
+            for image in images:
+                if not isinstance(image, Image.Image) and not hasattr(image, "load"):
+                    print(f"Warning: Expected PIL Image for key '{key}' in task {task_id_s}, got {type(image)}. Skipping image.")
+                    continue
+                try:
+                    image_names.append(store.add_image(image))
+                except Exception as e:
+                    print(f"Error saving image for key '{key}' of task {task_id_s}: {e}")
+            if image_names:
+                params_copy[key] = image_names if is_list else image_names[0]
+                assets_names.update(image_names)
+            else:
+                params_copy.pop(key, None)
+
+        for key in QUEUE_FILE_KEYS:
+            file_path = params_copy.get(key)
+            if file_path is None or not isinstance(file_path, str):
+                continue
+            if not os.path.isfile(file_path):
+                print(f"Warning: File not found for key '{key}' in task {task_id_s}: {file_path}. Skipping file.")
+                params_copy.pop(key, None)
+                continue
+            try:
+                params_copy[key] = store.add_file(file_path)
+                assets_names.add(params_copy[key])
+            except Exception as e:
+                print(f"Error storing file {file_path} for task {task_id_s}: {e}")
+                params_copy.pop(key, None)
+
+        for key in ['state', 'start_image_labels', 'end_image_labels', 'start_image_data_base64', 'end_image_data_base64', 'start_image_data', 'end_image_data']:
+            params_copy.pop(key, None)
+
+        manifest_entry = {
+            "id": task.get('id'),
+            "params": params_copy,
+        }
+        # thumbnails are saved as well so that the images don't need to be decoded when the queue is loaded
+        for key in QUEUE_THUMBNAIL_KEYS:
+            manifest_entry[key] = task.get(key, None)
+        manifest_entry = {k: v for k, v in manifest_entry.items() if v is not None}
+        queue_manifest.append(manifest_entry)
+    store.save_index()
+    return queue_manifest, assets_names
+
+def load_queued_images(params):
+    # the images of a loaded queue are only decoded when the task is about to run
+    from wan.utils.queue_assets import StoredImage
+    for key in QUEUE_IMAGE_KEYS:
+        images = params.get(key, None)
+        if isinstance(images, list):
+            params[key] = [image.load() if isinstance(image, StoredImage) else image for image in images]
+        elif isinstance(images, StoredImage):
+            params[key] = images.load()
+
 def save_queue_action(state):
     gen = get_gen_info(state)
     queue = gen.get("queue", [])
@@ -805,149 +809,51 @@ def save_queue_action(state):
         gr.Info("Queue is empty. Nothing to save.")
         return ""
 
-    zip_buffer = io.BytesIO()
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        queue_manifest = []
-        file_paths_in_zip = {}
-
-        for task_index, task in enumerate(queue):
-            if task is None or not isinstance(task, dict) or task.get('id') is None: continue
-
-            params_copy = task.get('params', {}).copy()
-            task_id_s = task.get('id', f"task_{task_index}")
-
-            image_keys = ["image_start", "image_end", "image_refs", "image_guide", "image_mask"]
-            video_keys = ["video_guide", "video_mask", "video_source", "audio_guide", "audio_guide2"]
-
-            for key in image_keys:
-                images_pil = params_copy.get(key)
-                if images_pil is None:
-                    continue
-
-                is_originally_list = isinstance(images_pil, list)
-                if not is_originally_list:
-                    images_pil = [images_pil]
-
-                image_filenames_for_json = []
-                for img_index, pil_image in enumerate(images_pil):
-                    if not isinstance(pil_image, Image.Image):
-                         print(f"Warning: Expected PIL Image for key '{key}' in task {task_id_s}, got {type(pil_image)}. Skipping image.")
-                         continue
-
-                    img_id = id(pil_image)
-                    if img_id in file_paths_in_zip:
-                         image_filenames_for_json.append(file_paths_in_zip[img_id])
-                         continue
-
-                    img_filename_in_zip = f"task{task_id_s}_{key}_{img_index}.png"
-                    img_save_path = os.path.join(tmpdir, img_filename_in_zip)
-
-                    try:
-                        pil_image.save(img_save_path, "PNG")
-                        image_filenames_for_json.append(img_filename_in_zip)
-                        file_paths_in_zip[img_id] = img_filename_in_zip
-                        print(f"Saved image: {img_filename_in_zip}")
-                    except Exception as e:
-                        print(f"Error saving image {img_filename_in_zip} for task {task_id_s}: {e}")
-
-                if image_filenames_for_json:
-                     params_copy[key] = image_filenames_for_json if is_originally_list else image_filenames_for_json[0]
-                else:
-                     pass
-                    #  params_copy.pop(key, None) #cant pop otherwise crash during reload
-
-            for key in video_keys:
-                video_path_orig = params_copy.get(key)
-                if video_path_orig is None or not isinstance(video_path_orig, str):
-                    continue
-
-                if video_path_orig in file_paths_in_zip:
-                    params_copy[key] = file_paths_in_zip[video_path_orig]
-                    continue
-
-                if not os.path.isfile(video_path_orig):
-                    print(f"Warning: Video file not found for key '{key}' in task {task_id_s}: {video_path_orig}. Skipping video.")
-                    params_copy.pop(key, None)
-                    continue
-
-                _, extension = os.path.splitext(video_path_orig)
-                vid_filename_in_zip = f"task{task_id_s}_{key}{extension if extension else '.mp4'}"
-                vid_save_path = os.path.join(tmpdir, vid_filename_in_zip)
-
-                try:
-                    shutil.copy2(video_path_orig, vid_save_path)
-                    params_copy[key] = vid_filename_in_zip
-                    file_paths_in_zip[video_path_orig] = vid_filename_in_zip
-                    print(f"Copied video: {video_path_orig} -> {vid_filename_in_zip}")
-                except Exception as e:
-                    print(f"Error copying video {video_path_orig} to {vid_filename_in_zip} for task {task_id_s}: {e}")
-                    params_copy.pop(key, None)
-
-
-            params_copy.pop('state', None)
-            params_copy.pop('start_image_labels', None)
-            params_copy.pop('end_image_labels', None)
-            params_copy.pop('start_image_data_base64', None)
-            params_copy.pop('end_image_data_base64', None)
-            params_copy.pop('start_image_data', None)
-            params_copy.pop('end_image_data', None)
-            task.pop('start_image_data', None)
-            task.pop('end_image_data', None)
-
-            manifest_entry = {
-                "id": task.get('id'),
-                "params": params_copy,
-            }
-            manifest_entry = {k: v for k, v in manifest_entry.items() if v is not None}
-            queue_manifest.append(manifest_entry)
-
-        manifest_path = os.path.join(tmpdir, "queue.json")
-        try:
-            with open(manifest_path, 'w', encoding='utf-8') as f:
-                json.dump(queue_manifest, f, indent=4)
-        except Exception as e:
-            print(f"Error writing queue.json: {e}")
-            gr.Warning("Failed to create queue manifest.")
-            return None
+    store = get_queue_asset_store()
+    try:
+        queue_manifest, assets_names = build_queue_manifest(queue, store)
+    except Exception as e:
+        print(f"Error writing queue manifest: {e}")
+        gr.Warning("Failed to create queue manifest.")
+        return None
 
-        try:
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-                zf.write(manifest_path, arcname="queue.json")
-
-                for file_id, saved_file_rel_path in file_paths_in_zip.items():
-                    saved_file_abs_path = os.path.join(tmpdir, saved_file_rel_path)
-                    if os.path.exists(saved_file_abs_path):
-                        zf.write(saved_file_abs_path, arcname=saved_file_rel_path)
-                        print(f"Adding to zip: {saved_file_rel_path}")
-                    else:
-                        print(f"Warning: File {saved_file_rel_path} (ID: {file_id}) not found during zipping.")
+    zip_buffer = io.BytesIO()
+    try:
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("queue.json", json.dumps(queue_manifest, indent=4))
+            for name in assets_names:
+                # images and videos are already compressed
+                zf.write(store.get_path(name), arcname=name, compress_type=zipfile.ZIP_STORED)
 
-            zip_buffer.seek(0)
-            zip_binary_content = zip_buffer.getvalue()
-            zip_base64 = base64.b64encode(zip_binary_content).decode('utf-8')
-            print(f"Queue successfully prepared as base64 string ({len(zip_base64)} chars).")
-            return zip_base64
+        zip_binary_content = zip_buffer.getvalue()
+        zip_base64 = base64.b64encode(zip_binary_content).decode('utf-8')
+        print(f"Queue successfully prepared as base64 string ({len(zip_base64)} chars).")
+        return zip_base64
 
-        except Exception as e:
-            print(f"Error creating zip file in memory: {e}")
-            gr.Warning("Failed to create zip data for download.")
-            return None
-        finally:
-            zip_buffer.close()
+    except Exception as e:
+        print(f"Error creating zip file in memory: {e}")
+        gr.Warning("Failed to create zip data for download.")
+        return None
+    finally:
+        zip_buffer.close()
 
 def load_queue_action(filepath, state, evt:gr.EventData):
     global task_id
+    from wan.utils.queue_assets import StoredImage
 
     gen = get_gen_info(state)
     original_queue = gen.get("queue", [])
     delete_autoqueue_file  = False 
     if evt.target == None:
-
-        if original_queue or not Path(AUTOSAVE_FILENAME).is_file():
+        if original_queue:
             return
-        print(f"Autoloading queue from {AUTOSAVE_FILENAME}...")
-        filename = AUTOSAVE_FILENAME
+        if Path(AUTOSAVE_MANIFEST_FILENAME).is_file():
+            filename = AUTOSAVE_MANIFEST_FILENAME
+        elif Path(AUTOSAVE_FILENAME).is_file():
+            filename = AUTOSAVE_FILENAME
+        else:
+            return
+        print(f"Autoloading queue from {filename}...")
         delete_autoqueue_file = True
     else:
         if not filepath or not hasattr(filepath, 'name') or not Path(filepath.name).is_file():
@@ -955,129 +861,102 @@ def load_queue_action(filepath, state, evt:gr.EventData):
             return update_queue_data(original_queue)
         filename = filepath.name
 
-
-    save_path_base = server_config.get("save_path", "outputs")
-    loaded_cache_dir = os.path.join(save_path_base, "_loaded_queue_cache")
-
-
     newly_loaded_queue = []
-    max_id_in_file = 0
-    error_message = ""
     local_queue_copy_for_global_ref = None
+    zf = None
 
     try:
         print(f"[load_queue_action] Attempting to load queue from: {filename}")
-        os.makedirs(loaded_cache_dir, exist_ok=True)
-        print(f"[load_queue_action] Using cache directory: {loaded_cache_dir}")
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            with zipfile.ZipFile(filename, 'r') as zf:
-                if "queue.json" not in zf.namelist(): raise ValueError("queue.json not found in zip file")
-                print(f"[load_queue_action] Extracting {filename} to {tmpdir}")
-                zf.extractall(tmpdir)
-                print(f"[load_queue_action] Extraction complete.")
-
-            manifest_path = os.path.join(tmpdir, "queue.json")
-            print(f"[load_queue_action] Reading manifest: {manifest_path}")
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                loaded_manifest = json.load(f)
-            print(f"[load_queue_action] Manifest loaded. Processing {len(loaded_manifest)} tasks.")
-
-            for task_index, task_data in enumerate(loaded_manifest):
-                if task_data is None or not isinstance(task_data, dict):
-                    print(f"[load_queue_action] Skipping invalid task data at index {task_index}")
-                    continue
-
-                params = task_data.get('params', {})
-                task_id_loaded = task_data.get('id', 0)
-                max_id_in_file = max(max_id_in_file, task_id_loaded)
-                params['state'] = state
-
-                image_keys = ["image_start", "image_end", "image_refs", "image_guide", "image_mask"]
-                video_keys = ["video_guide", "video_mask", "video_source", "audio_guide", "audio_guide2"]
-
-                loaded_pil_images = {}
-                loaded_video_paths = {}
-
-                for key in image_keys:
-                    image_filenames = params.get(key)
-                    if image_filenames is None: continue
-
-                    is_list = isinstance(image_filenames, list)
-                    if not is_list: image_filenames = [image_filenames]
-
-                    loaded_pils = []
-                    for img_filename_in_zip in image_filenames:
-                         if not isinstance(img_filename_in_zip, str):
-                             print(f"[load_queue_action] Warning: Non-string filename found for image key '{key}'. Skipping.")
-                             continue
-                         img_load_path = os.path.join(tmpdir, img_filename_in_zip)
-                         if not os.path.exists(img_load_path):
-                             print(f"[load_queue_action] Image file not found in extracted data: {img_load_path}. Skipping.")
-                             continue
-                         try:
-                             pil_image = Image.open(img_load_path)
-                             pil_image.load()
-                             converted_image = convert_image(pil_image)
-                             loaded_pils.append(converted_image)
-                             pil_image.close()
-                             print(f"Loaded image: {img_filename_in_zip} for key {key}")
-                         except Exception as img_e:
-                             print(f"[load_queue_action] Error loading image {img_filename_in_zip}: {img_e}")
-                    if loaded_pils:
-                        params[key] = loaded_pils if is_list else loaded_pils[0]
-                        loaded_pil_images[key] = params[key]
-                    else:
-                        params.pop(key, None)
-
-                for key in video_keys:
-                    video_filename_in_zip = params.get(key)
-                    if video_filename_in_zip is None or not isinstance(video_filename_in_zip, str):
+        if zipfile.is_zipfile(filename):
+            store = get_queue_asset_store()
+            zf = zipfile.ZipFile(filename, 'r')
+            zip_members = set(zf.namelist())
+            if "queue.json" not in zip_members: raise ValueError("queue.json not found in zip file")
+            loaded_manifest = json.loads(zf.read("queue.json").decode('utf-8'))
+            imported_names = {}
+            def get_asset_name(name):
+                # assets are extracted straight into the store, those already there are skipped
+                if name not in zip_members: return None
+                if name not in imported_names:
+                    imported_names[name] = store.import_from_zip(zf, name)
+                return imported_names[name]
+        else:
+            with open(filename, 'r', encoding='utf-8') as f:
+                autosave_data = json.load(f)
+            store = get_queue_asset_store(autosave_data.get("assets_root", None))
+            loaded_manifest = autosave_data.get("tasks", [])
+            get_asset_name = store.check
+        print(f"[load_queue_action] Manifest loaded. Processing {len(loaded_manifest)} tasks.")
+
+        for task_index, task_data in enumerate(loaded_manifest):
+            if task_data is None or not isinstance(task_data, dict):
+                print(f"[load_queue_action] Skipping invalid task data at index {task_index}")
+                continue
+
+            params = task_data.get('params', {})
+            task_id_loaded = task_data.get('id', 0)
+            params['state'] = state
+            any_thumbnails = "start_image_data_base64" in task_data or "end_image_data_base64" in task_data
+
+            for key in QUEUE_IMAGE_KEYS:
+                image_names = params.get(key)
+                if image_names is None: continue
+                is_list = isinstance(image_names, list)
+                if not is_list: image_names = [image_names]
+                images = []
+                for image_name in image_names:
+                    asset_name = get_asset_name(image_name) if isinstance(image_name, str) else None
+                    if asset_name is None:
+                        print(f"[load_queue_action] Image '{image_name}' for key '{key}' not found. Skipping.")
                         continue
+                    images.append(StoredImage(store, asset_name))
+                if images:
+                    params[key] = images if is_list else images[0]
+                else:
+                    params.pop(key, None)
 
-                    video_load_path = os.path.join(tmpdir, video_filename_in_zip)
-                    if not os.path.exists(video_load_path):
-                        print(f"[load_queue_action] Video file not found in extracted data: {video_load_path}. Skipping.")
-                        params.pop(key, None)
-                        continue
+            if not any_thumbnails:
+                # queues saved by older versions don't include thumbnails, the images need to be decoded to build them
+                load_queued_images(params)
 
-                    persistent_video_path = os.path.join(loaded_cache_dir, video_filename_in_zip)
-                    try:
-                        shutil.copy2(video_load_path, persistent_video_path)
-                        params[key] = persistent_video_path
-                        loaded_video_paths[key] = persistent_video_path
-                        print(f"Loaded video: {video_filename_in_zip} -> {persistent_video_path}")
-                    except Exception as vid_e:
-                        print(f"[load_queue_action] Error copying video {video_filename_in_zip} to cache: {vid_e}")
-                        params.pop(key, None)
+            for key in QUEUE_FILE_KEYS:
+                file_name = params.get(key)
+                if file_name is None or not isinstance(file_name, str):
+                    continue
+                asset_name = get_asset_name(file_name)
+                if asset_name is None:
+                    print(f"[load_queue_action] File '{file_name}' for key '{key}' not found. Skipping.")
+                    params.pop(key, None)
+                    continue
+                params[key] = store.get_path(asset_name)
 
+            if any_thumbnails:
+                thumbnails = {key: task_data.get(key, None) for key in QUEUE_THUMBNAIL_KEYS}
+            else:
                 primary_preview_pil_list, secondary_preview_pil_list, primary_preview_pil_labels, secondary_preview_pil_labels  = get_preview_images(params)
-
-                start_b64 = [pil_to_base64_uri(primary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(primary_preview_pil_list, list) and primary_preview_pil_list else None
-                end_b64 = [pil_to_base64_uri(secondary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(secondary_preview_pil_list, list) and secondary_preview_pil_list else None
-
-                top_level_start_image = params.get("image_start") or params.get("image_refs")
-                top_level_end_image = params.get("image_end")
-
-                runtime_task = {
-                    "id": task_id_loaded,
-                    "params": params.copy(),
-                    "repeats": params.get('repeat_generation', 1),
-                    "length": params.get('video_length'),
-                    "steps": params.get('num_inference_steps'),
-                    "prompt": params.get('prompt'),
+                thumbnails = {
                     "start_image_labels": primary_preview_pil_labels,
                     "end_image_labels": secondary_preview_pil_labels,
-                    "start_image_data": top_level_start_image,
-                    "end_image_data": top_level_end_image,
-                    "start_image_data_base64": start_b64,
-                    "end_image_data_base64": end_b64,
+                    "start_image_data_base64": [pil_to_base64_uri(primary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(primary_preview_pil_list, list) and primary_preview_pil_list else None,
+                    "end_image_data_base64": [pil_to_base64_uri(secondary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(secondary_preview_pil_list, list) and secondary_preview_pil_list else None,
                 }
-                newly_loaded_queue.append(runtime_task)
-                print(f"[load_queue_action] Reconstructed task {task_index+1}/{len(loaded_manifest)}, ID: {task_id_loaded}")
+
+            runtime_task = {
+                "id": task_id_loaded,
+                "params": params.copy(),
+                "repeats": params.get('repeat_generation', 1),
+                "length": params.get('video_length'),
+                "steps": params.get('num_inference_steps'),
+                "prompt": params.get('prompt'),
+                "start_image_data": params.get("image_start") or params.get("image_refs"),
+                "end_image_data": params.get("image_end"),
+            }
+            runtime_task.update(thumbnails)
+            newly_loaded_queue.append(runtime_task)
+            print(f"[load_queue_action] Reconstructed task {task_index+1}/{len(loaded_manifest)}, ID: {task_id_loaded}")
+        store.save_index()
 
         with lock:
-            print("[load_queue_action] Acquiring lock to update state...")
             gen["queue"] = newly_loaded_queue[:]
             local_queue_copy_for_global_ref = gen["queue"][:]
 
@@ -1086,17 +965,11 @@ def load_queue_action(filepath, state, evt:gr.EventData):
                  new_task_id = current_max_id_in_new_queue + 1
                  print(f"[load_queue_action] Updating global task_id from {task_id} to {new_task_id}")
                  task_id = new_task_id
-            else:
-                 print(f"[load_queue_action] Global task_id ({task_id}) is > max in file ({current_max_id_in_new_queue}). Not changing task_id.")
 
             gen["prompts_max"] = len(newly_loaded_queue)
-            print("[load_queue_action] State update complete. Releasing lock.")
 
         if local_queue_copy_for_global_ref is not None:
-             print("[load_queue_action] Updating global queue reference...")
              update_global_queue_ref(local_queue_copy_for_global_ref)
-        else:
-             print("[load_queue_action] Warning: Skipping global ref update as local copy is None.")
 
         print(f"[load_queue_action] Queue load successful. Returning DataFrame update for {len(newly_loaded_queue)} tasks.")
         return update_queue_data(newly_loaded_queue)
@@ -1110,6 +983,8 @@ def load_queue_action(filepath, state, evt:gr.EventData):
         print("[load_queue_action] Load failed. Returning DataFrame update for original queue.")
         return update_queue_data(original_queue)
     finally:
+        if zf is not None:
+            zf.close()
         if delete_autoqueue_file:
             if os.path.isfile(filename):
                 os.remove(filename)
@@ -1152,13 +1027,14 @@ def clear_queue_action(state):
             gen["prompts_max"] = 0
 
     if cleared_pending:
-        try:
-            if os.path.isfile(AUTOSAVE_FILENAME):
-                os.remove(AUTOSAVE_FILENAME)
-                print(f"Clear Queue: Deleted autosave file '{AUTOSAVE_FILENAME}'.")
-        except OSError as e:
-            print(f"Clear Queue: Error deleting autosave file '{AUTOSAVE_FILENAME}': {e}")
-            gr.Warning(f"Could not delete the autosave file '{AUTOSAVE_FILENAME}'. You may need to remove it manually.")
+        for autosave_filename in [AUTOSAVE_FILENAME, AUTOSAVE_MANIFEST_FILENAME]:
+            try:
+                if os.path.isfile(autosave_filename):
+                    os.remove(autosave_filename)
+                    print(f"Clear Queue: Deleted autosave file '{autosave_filename}'.")
+            except OSError as e:
+                print(f"Clear Queue: Error deleting autosave file '{autosave_filename}': {e}")
+                gr.Warning(f"Could not delete the autosave file '{autosave_filename}'. You may need to remove it manually.")
 
     if aborted_current and cleared_pending:
         gr.Info("Queue cleared and current generation aborted.")
@@ -1197,109 +1073,19 @@ def autosave_queue():
         print("Autosave: Queue is empty, nothing to save.")
         return
 
-    print(f"Autosaving queue ({len(global_queue_ref)} items) to {AUTOSAVE_FILENAME}...")
-    temp_state_for_save = {"gen": {"queue": global_queue_ref}}
-    zip_file_path = None
+    print(f"Autosaving queue ({len(global_queue_ref)} items) to {AUTOSAVE_MANIFEST_FILENAME}...")
     try:
-
-        def _save_queue_to_file(queue_to_save, output_filename):
-             if not queue_to_save: return None
-
-             with tempfile.TemporaryDirectory() as tmpdir:
-                queue_manifest = []
-                file_paths_in_zip = {}
-
-                for task_index, task in enumerate(queue_to_save):
-                    if task is None or not isinstance(task, dict) or task.get('id') is None: continue
-
-                    params_copy = task.get('params', {}).copy()
-                    task_id_s = task.get('id', f"task_{task_index}")
-
-                    image_keys = ["image_start", "image_end", "image_refs", "image_guide", "image_mask"]
-                    video_keys = ["video_guide", "video_mask", "video_source", "audio_guide", "audio_guide2"]
-
-                    for key in image_keys:
-                        images_pil = params_copy.get(key)
-                        if images_pil is None: continue
-                        is_list = isinstance(images_pil, list)
-                        if not is_list: images_pil = [images_pil]
-                        image_filenames_for_json = []
-                        for img_index, pil_image in enumerate(images_pil):
-                            if not isinstance(pil_image, Image.Image): continue
-                            img_id = id(pil_image)
-                            if img_id in file_paths_in_zip:
-                                image_filenames_for_json.append(file_paths_in_zip[img_id])
-                                continue
-                            img_filename_in_zip = f"task{task_id_s}_{key}_{img_index}.png"
-                            img_save_path = os.path.join(tmpdir, img_filename_in_zip)
-                            try:
-                                pil_image.save(img_save_path, "PNG")
-                                image_filenames_for_json.append(img_filename_in_zip)
-                                file_paths_in_zip[img_id] = img_filename_in_zip
-                            except Exception as e:
-                                print(f"Autosave error saving image {img_filename_in_zip}: {e}")
-                        if image_filenames_for_json:
-                            params_copy[key] = image_filenames_for_json if is_list else image_filenames_for_json[0]
-                        else:
-                            params_copy.pop(key, None)
-
-                    for key in video_keys:
-                        video_path_orig = params_copy.get(key)
-                        if video_path_orig is None or not isinstance(video_path_orig, str):
-                            continue
-
-                        if video_path_orig in file_paths_in_zip:
-                            params_copy[key] = file_paths_in_zip[video_path_orig]
-                            continue
-
-                        if not os.path.isfile(video_path_orig):
-                            print(f"Warning (Autosave): Video file not found for key '{key}' in task {task_id_s}: {video_path_orig}. Skipping.")
-                            params_copy.pop(key, None)
-                            continue
-
-                        _, extension = os.path.splitext(video_path_orig)
-                        vid_filename_in_zip = f"task{task_id_s}_{key}{extension if extension else '.mp4'}"
-                        vid_save_path = os.path.join(tmpdir, vid_filename_in_zip)
-
-                        try:
-                            shutil.copy2(video_path_orig, vid_save_path)
-                            params_copy[key] = vid_filename_in_zip
-                            file_paths_in_zip[video_path_orig] = vid_filename_in_zip
-                        except Exception as e:
-                            print(f"Error (Autosave) copying video {video_path_orig} to {vid_filename_in_zip} for task {task_id_s}: {e}")
-                            params_copy.pop(key, None)
-                    params_copy.pop('state', None)
-                    params_copy.pop('start_image_data_base64', None)
-                    params_copy.pop('end_image_data_base64', None)
-                    params_copy.pop('start_image_data', None)
-                    params_copy.pop('end_image_data', None)
-
-                    manifest_entry = {
-                        "id": task.get('id'),
-                        "params": params_copy,
-                    }
-                    manifest_entry = {k: v for k, v in manifest_entry.items() if v is not None}
-                    queue_manifest.append(manifest_entry)
-
-                manifest_path = os.path.join(tmpdir, "queue.json")
-                with open(manifest_path, 'w', encoding='utf-8') as f: json.dump(queue_manifest, f, indent=4)
-                with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    zf.write(manifest_path, arcname="queue.json")
-                    for saved_file_rel_path in file_paths_in_zip.values():
-                        saved_file_abs_path = os.path.join(tmpdir, saved_file_rel_path)
-                        if os.path.exists(saved_file_abs_path):
-                             zf.write(saved_file_abs_path, arcname=saved_file_rel_path)
-                        else:
-                             print(f"Warning (Autosave): File {saved_file_rel_path} not found during zipping.")
-                return output_filename
-             return None
-
-        saved_path = _save_queue_to_file(global_queue_ref, AUTOSAVE_FILENAME)
-
-        if saved_path:
-            print(f"Queue autosaved successfully to {saved_path}")
-        else:
-            print("Autosave failed.")
+        # the manifest references the assets store: only the new images / videos are written
+        store = get_queue_asset_store()
+        queue_manifest, assets_names = build_queue_manifest(global_queue_ref, store)
+        tmp_filename = AUTOSAVE_MANIFEST_FILENAME + ".tmp"
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            json.dump({"assets_root": store.root, "tasks": queue_manifest}, f, indent=4)
+        os.replace(tmp_filename, AUTOSAVE_MANIFEST_FILENAME)
+        if os.path.isfile(AUTOSAVE_FILENAME):
+            os.remove(AUTOSAVE_FILENAME)
+        store.prune(assets_names)
+        print(f"Queue autosaved successfully to {AUTOSAVE_MANIFEST_FILENAME}")
     except Exception as e:
         print(f"Error during autosave: {e}")
         traceback.print_exc()
@@ -2443,6 +2229,14 @@ default_ui = server_config.get("default_ui", "t2v")
 save_path = server_config.get("save_path", os.path.join(os.getcwd(), "gradio_outputs"))
 preload_model_policy = server_config.get("preload_model_policy", []) 
 
+from wan.modules.t5 import t5_embedding_cache
+t5_embedding_cache.max_entries = server_config.get("text_encoder_cache_max_entries", 256)
+t5_embedding_cache.disk_path = server_config.get("text_encoder_cache_dir", None)
+
+from wan.utils.thread_utils import OutputPipeline
+# number of generated videos that may wait to be encoded / muxed while the next generation starts, 0 to save them synchronously
+output_pipeline = OutputPipeline(server_config.get("output_pipeline_max_pending", 2))
+
 
 if args.t2v_14B or args.t2v: 
     transformer_type = "t2v"
@@ -2761,6 +2555,12 @@ def extract_preset(model_type, lset_name, loras):
     return loras_choices, loras_mult_choices, prompt, full_prompt, error
 
 
+def get_lora_index():
+    from wan.utils.lora_index import lora_index
+    # the verdicts of the compatibility checks are reset when mmgp is upgraded
+    lora_index.configure(server_config.get("loras_index_path", os.path.join("settings", "loras_index.json")), mmgp_version)
+    return lora_index
+
 def setup_loras(model_type, transformer,  lora_dir, lora_preselected_preset, split_linear_modules_map = None):
     loras =[]
     loras_names = []
@@ -2778,9 +2578,9 @@ def setup_loras(model_type, transformer,  lora_dir, lora_preselected_preset, spl
             raise Exception("--lora-dir should be a path to a directory that contains Loras")
 
 
+    lora_index = get_lora_index()
     if lora_dir != None:
-        dir_loras =  glob.glob( os.path.join(lora_dir , "*.sft") ) + glob.glob( os.path.join(lora_dir , "*.safetensors") ) 
-        dir_loras.sort()
+        dir_loras = lora_index.list_loras(lora_dir)
         loras += [element for element in dir_loras if element not in loras ]
 
         dir_presets_settings = glob.glob( os.path.join(lora_dir , "*.json") ) 
@@ -2791,7 +2591,12 @@ def setup_loras(model_type, transformer,  lora_dir, lora_preselected_preset, spl
         loras_presets = [ Path(file_path).parts[-1] for file_path in dir_presets_settings + dir_presets]
 
     if transformer !=None:
-        loras = offload.load_loras_into_model(transformer, loras,  activate_all_loras=False, check_only= True, preprocess_sd=get_loras_preprocessor(transformer, model_type), split_linear_modules_map = split_linear_modules_map) #lora_multiplier,
+        # only the loras never checked against this model type (or modified since) are checked again
+        check = lambda loras_to_check: offload.load_loras_into_model(transformer, loras_to_check,  activate_all_loras=False, check_only= True, preprocess_sd=get_loras_preprocessor(transformer, model_type), split_linear_modules_map = split_linear_modules_map) #lora_multiplier,
+        loras = lora_index.filter_compatible(model_type, loras, check)
+    elif lora_dir != None:
+        # the headers of the new files are indexed in the background, before the loras are checked or loaded
+        lora_index.refresh_async([lora_dir])
 
     if len(loras) > 0:
         loras_names = [ Path(lora).stem for lora in loras  ]
@@ -2901,6 +2706,11 @@ def load_hunyuan_model(model_filename, model_type = None,  base_model_type = Non
     if hunyuan_model.wav2vec != None:
         pipe["wav2vec"] = hunyuan_model.wav2vec
 
+    # tiles of the VAE decode can be spread over several GPUs, for instance ["cuda:0", "cuda:1"]
+    vae_tile_parallel_devices = server_config.get("vae_tile_parallel_devices", [])
+    if len(vae_tile_parallel_devices) > 1:
+        hunyuan_model.vae.enable_tile_parallel("devices", devices = vae_tile_parallel_devices)
+
 
     # if hunyuan_model.align_instance != None:
     #     pipe["align_instance"] = hunyuan_model.align_instance.facedet.model
@@ -2934,8 +2744,8 @@ def get_transformer_model(model, submodel_no = 1):
 def load_models(model_type):
     global transformer_type
     
-    # Start performance tracking
-    global_perf_tracker.start_model_load(model_type)
+    model_load_start = time.time()
+    model_load_span = profiler.begin("model load", model_type = model_type)
     print(f"🔄 Starting model load: {model_type}")
     
     base_model_type = get_base_model_type(model_type)
@@ -3104,10 +2914,8 @@ def load_models(model_type):
         torch.set_default_device(args.gpu)
     transformer_type = model_type
     
-    # End performance tracking and report
-    global_perf_tracker.end_model_load(model_type)
-    print(f"✅ Model load complete: {model_type}")
-    print(f"📊 Performance Summary: {global_perf_tracker.get_performance_summary()}")
+    profiler.end(model_load_span)
+    print(f"✅ Model load complete: {model_type} loaded in {time.time() - model_load_start:.1f}s")
     
     # RTX 5090 Smart Cache Management - Optimize VRAM usage after model loading
     try:
@@ -3731,15 +3539,45 @@ def get_resampled_video(video_in, start_frame, max_frames, target_fps, bridge='t
     # print(f"frame nos: {frame_nos}")
     return frames_list
 
+def get_video_frame_cache():
+    if not server_config.get("video_frame_cache", True):
+        return None
+    from preprocessing.frame_cache import VideoFrameCache
+    frame_cache_dir = server_config.get("video_frame_cache_dir", None)
+    if frame_cache_dir is not None:
+        os.makedirs(frame_cache_dir, exist_ok=True)
+    return VideoFrameCache(frame_cache_dir)
+
+def get_frame_buffer(expected_frames):
+    from wan.utils.utils import VideoFrameBuffer
+    # "bfloat16" halves the RAM used by long videos, "sliding_window_buffer_dir" keeps their frames on disk
+    dtype = torch.bfloat16 if server_config.get("sliding_window_buffer_dtype", "float32") == "bfloat16" else torch.float32
+    return VideoFrameBuffer(expected_frames, dtype = dtype, root = server_config.get("sliding_window_buffer_dir", None))
+
+def get_annotator_pool():
+    from preprocessing.annotator_pool import annotator_pool
+    # with the VerylowRAM profile, annotators are not kept resident unless explicitly requested
+    annotator_pool.set_max_mb(server_config.get("annotator_pool_max_mb", 0 if profile == 5 else 4096))
+    return annotator_pool
+
+def get_audio_encoder_service():
+    from wan.utils.audio_encoder import audio_encoder_service
+    # with the VerylowRAM profile, the wav2vec encoders are not kept resident between generations
+    audio_encoder_service.configure(server_config.get("audio_encoder_resident", 0 if profile == 5 else 1) == 1, server_config.get("audio_embeddings_cache_size", 8))
+    return audio_encoder_service
+
 def get_preprocessor(process_type, inpaint_color):
     if process_type=="pose":
         from preprocessing.dwpose.pose import PoseBodyFaceVideoAnnotator
         cfg_dict = {
             "DETECTION_MODEL": "ckpts/pose/yolox_l.onnx",
             "POSE_MODEL": "ckpts/pose/dw-ll_ucoco_384.onnx",
-            "RESIZE_SIZE": 1024
+            "RESIZE_SIZE": 1024,
+            # frames per detection batch / persons crops per pose batch, threads of the onnx cpu provider (0 = default)
+            "BATCH_SIZE": server_config.get("pose_batch_size", 8),
+            "INTRA_OP_THREADS": server_config.get("pose_intra_op_threads", 0),
         }
-        anno_ins = lambda img: PoseBodyFaceVideoAnnotator(cfg_dict).forward(img)
+        anno_ins = lambda img: get_annotator_pool().get(process_type, cfg_dict, PoseBodyFaceVideoAnnotator).forward(img)
     elif process_type=="depth":
         # from preprocessing.midas.depth import DepthVideoAnnotator
         # cfg_dict = {
@@ -3759,8 +3597,11 @@ def get_preprocessor(process_type, inpaint_color):
                 "PRETRAINED_MODEL": "ckpts/depth/depth_anything_v2_vitb.pth",
                 'MODEL_VARIANT': 'vitb',
             }
+        # frames per batch of the depth model, fp16 inference (cuda only)
+        cfg_dict["BATCH_SIZE"] = server_config.get("depth_batch_size", 8)
+        cfg_dict["HALF_PRECISION"] = server_config.get("depth_half_precision", 0) == 1
 
-        anno_ins = lambda img: DepthV2VideoAnnotator(cfg_dict).forward(img)
+        anno_ins = lambda img: get_annotator_pool().get(process_type, cfg_dict, DepthV2VideoAnnotator).forward(img)
     elif process_type=="gray":
         from preprocessing.gray import GrayVideoAnnotator
         cfg_dict = {}
@@ -3776,13 +3617,15 @@ def get_preprocessor(process_type, inpaint_color):
         cfg_dict = {
                 "PRETRAINED_MODEL": "ckpts/scribble/netG_A_latest.pth"
             }
-        anno_ins = lambda img: ScribbleVideoAnnotator(cfg_dict).forward(img)
+        anno_ins = lambda img: get_annotator_pool().get(process_type, cfg_dict, ScribbleVideoAnnotator).forward(img)
     elif process_type=="flow":
         from preprocessing.flow import FlowVisAnnotator
         cfg_dict = {
-                "PRETRAINED_MODEL": "ckpts/flow/raft-things.pth"
+                "PRETRAINED_MODEL": "ckpts/flow/raft-things.pth",
+                # pairs of frames per batch of the flow model
+                "BATCH_SIZE": server_config.get("flow_batch_size", 4),
             }
-        anno_ins = lambda img: FlowVisAnnotator(cfg_dict).forward(img)
+        anno_ins = lambda img: get_annotator_pool().get(process_type, cfg_dict, FlowVisAnnotator).forward(img)
     elif process_type=="inpaint":
         anno_ins = lambda img :  len(img) * [inpaint_color]
     elif process_type == None or process_type in ["raw", "identity"]:
@@ -3792,10 +3635,14 @@ def get_preprocessor(process_type, inpaint_color):
     return anno_ins
 
 
-def process_images_multithread(image_processor, items, process_type, wrap_in_list = True, max_workers: int = os.cpu_count()/ 2) :
+def get_preprocessing_workers():
+    return max(int(server_config.get("preprocessing_workers", min(11, os.cpu_count() or 1))), 1)
+
+def process_images_multithread(image_processor, items, process_type, wrap_in_list = True, max_workers: int = None) :
     if not items:
        return []    
-    max_workers = 11
+    if max_workers is None:
+        max_workers = get_preprocessing_workers()
     import concurrent.futures
     start_time = time.time()
     # print(f"Preprocessus:{process_type} started")
@@ -3819,23 +3666,10 @@ def process_images_multithread(image_processor, items, process_type, wrap_in_lis
 
     return results  
 
-def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,  max_frames, start_frame=0, fit_canvas = False, target_fps = 16, block_size= 16, expand_scale = 2, process_type = "inpaint", process_type2 = None, to_bbox = False, RGB_Mask = False, negate_mask = False, process_outside_mask = None, inpaint_color = 127, outpainting_dims = None, proc_no = 1):
-    from wan.utils.utils import calculate_new_dimensions, get_outpainting_frame_location, get_outpainting_full_area_dimensions
-
-    def mask_to_xyxy_box(mask):
-        rows, cols = np.where(mask == 255)
-        xmin = min(cols)
-        xmax = max(cols) + 1
-        ymin = min(rows)
-        ymax = max(rows) + 1
-        xmin = max(xmin, 0)
-        ymin = max(ymin, 0)
-        xmax = min(xmax, mask.shape[1])
-        ymax = min(ymax, mask.shape[0])
-        box = [xmin, ymin, xmax, ymax]
-        box = [int(x) for x in box]
-        return box
-    
+@profiler.trace("control video preprocessing")
+def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,  max_frames, start_frame=0, fit_canvas = False, target_fps = 16, block_size= 16, expand_scale = 2, process_type = "inpaint", process_type2 = None, to_bbox = False, RGB_Mask = False, negate_mask = False, process_outside_mask = None, inpaint_color = 127, outpainting_dims = None, proc_no = 1, frame_cache = None):
+    from wan.utils.utils import calculate_new_dimensions, get_outpainting_frame_location, get_outpainting_full_area_dimensions, resize_frames, map_frames, get_masks_boxes
+
     if not input_video_path or max_frames <= 0:
         return None, None
     any_mask = input_mask_path != None
@@ -3855,14 +3689,19 @@ def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,
         preproc_outside = preproc2
     else:
         preproc_outside = get_preprocessor(process_outside_mask, inpaint_color)
-    video = get_resampled_video(input_video_path, start_frame, max_frames, target_fps)
-    if any_mask:
-        mask_video = get_resampled_video(input_mask_path, start_frame, max_frames, target_fps)
+    if frame_cache is not None:
+        video = frame_cache.get_video(input_video_path, start_frame, max_frames, target_fps)
+        if any_mask:
+            mask_video = frame_cache.get_video(input_mask_path, start_frame, max_frames, target_fps)
+    else:
+        video = get_resampled_video(input_video_path, start_frame, max_frames, target_fps)
+        if any_mask:
+            mask_video = get_resampled_video(input_mask_path, start_frame, max_frames, target_fps)
 
     if len(video) == 0 or any_mask and len(mask_video) == 0:
         return None, None
 
-    frame_height, frame_width, _ = video[0].shape
+    frame_height, frame_width, _ = video.get_frame_shape() if frame_cache is not None else video[0].shape
 
     if outpainting_dims != None:
         if fit_canvas != None:
@@ -3885,59 +3724,68 @@ def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,
     if any_identity_mask:
         any_mask = True
 
-    proc_list =[]
-    proc_list_outside =[]
-    proc_mask = []
+    resize_method = server_config.get("preprocessing_resize_method", "torch")
+    resize_device = server_config.get("preprocessing_device", "cpu")
+    max_workers = get_preprocessing_workers()
+    any_mask_video = any_mask and not any_identity_mask
+    cached_video = None
+    if frame_cache is not None:
+        # frames already resized by a previous window or control type are reused
+        cached_video = video
+        frames = cached_video.get_resized_frames(width, height, method = resize_method, device = resize_device, max_workers = max_workers)[:num_frames]
+        masks = mask_video.get_resized_frames(width, height, method = resize_method, device = resize_device, max_workers = max_workers)[:num_frames] if any_mask_video else None
+    else:
+        frames = resize_frames(video[:num_frames], width, height, method = resize_method, device = resize_device, max_workers = max_workers)
+        masks = resize_frames(mask_video[:num_frames], width, height, method = resize_method, device = resize_device, max_workers = max_workers) if any_mask_video else None
+    video = None
+    mask_video = None
 
-    # for frame_idx in range(num_frames):
-    def prep_prephase(frame_idx):
-        frame = Image.fromarray(video[frame_idx].cpu().numpy()) #.asnumpy()
-        frame = frame.resize((width, height), resample=Image.Resampling.LANCZOS) 
-        frame = np.array(frame) 
-        if any_mask:
-            if any_identity_mask:
-                mask = np.full( (height, width, 3), 0, dtype= np.uint8)
-            else:
-                mask = Image.fromarray(mask_video[frame_idx].cpu().numpy()) #.asnumpy()
-                mask = mask.resize((width, height), resample=Image.Resampling.LANCZOS) 
-                mask = np.array(mask)
-
-            if len(mask.shape) == 3 and mask.shape[2] == 3:
-                mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-            original_mask = mask.copy()
-            if expand_scale != 0:
-                kernel_size = abs(expand_scale)
-                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
-                op_expand = cv2.dilate if expand_scale > 0 else cv2.erode
-                mask = op_expand(mask, kernel, iterations=3)
-
-            _, mask = cv2.threshold(mask, 127.5, 255, cv2.THRESH_BINARY)
-            if to_bbox and np.sum(mask == 255) > 0:
-                x0, y0, x1, y1 = mask_to_xyxy_box(mask)
-                mask = mask * 0
+    if any_mask:
+        if any_identity_mask:
+            masks = np.zeros((num_frames, height, width), dtype= np.uint8)
+        elif masks.shape[-1] == 3:
+            masks = np.stack(map_frames(lambda mask: cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY), list(masks), max_workers))
+        else:
+            masks = masks[..., 0]
+        original_masks = masks
+        if expand_scale != 0:
+            kernel_size = abs(expand_scale)
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+            op_expand = cv2.dilate if expand_scale > 0 else cv2.erode
+            masks = np.stack(map_frames(lambda mask: op_expand(mask, kernel, iterations=3), list(masks), max_workers))
+
+        # same as cv2.threshold(mask, 127.5, 255, cv2.THRESH_BINARY) on the whole stack
+        masks = np.where(masks > 127, np.uint8(255), np.uint8(0))
+        if to_bbox:
+            for mask, box in zip(masks, get_masks_boxes(masks)):
+                if box is None: continue
+                x0, y0, x1, y1 = box
+                mask[...] = 0
                 mask[y0:y1, x0:x1] = 255
-            if negate_mask:
-                mask = 255 - mask
-                if pose_special:
-                    original_mask = 255 - original_mask
+        if negate_mask:
+            masks = 255 - masks
+            if pose_special:
+                original_masks = 255 - original_masks
 
-        if pose_special and any_mask:            
-            target_frame = np.where(original_mask[..., None], frame, 0) 
-        else:
-            target_frame = frame 
+    if pose_special and any_mask:            
+        target_frames = np.where(original_masks[..., None] != 0, frames, np.uint8(0))
+    else:
+        target_frames = frames
+    original_masks = None
 
-        if any_mask:
-            return (target_frame, frame, mask) 
-        else:
-            return (target_frame, None, None)
+    proc_list = list(target_frames)
+    if any_mask:
+        proc_list_outside, proc_mask = list(frames), list(masks)
+    else:
+        proc_list_outside = proc_mask = [None] * num_frames
+    frames = target_frames = masks = None
 
-    proc_lists = process_images_multithread(prep_prephase, [frame_idx for frame_idx in range(num_frames)], "prephase", wrap_in_list= False)
-    proc_list, proc_list_outside, proc_mask = [None] * len(proc_lists), [None] * len(proc_lists), [None] * len(proc_lists)
-    for frame_idx, frame_group in enumerate(proc_lists): 
-        proc_list[frame_idx], proc_list_outside[frame_idx], proc_mask[frame_idx] = frame_group
-    prep_prephase = None
-    video = None
-    mask_video = None
+    if cached_video is not None:
+        # annotations of the unmasked frames are shared with the other windows and calls of this task
+        from functools import partial
+        if not (pose_special and any_mask):
+            preproc = partial(cached_video.get_annotations, process_type, width, height, annotator = preproc)
+        preproc_outside = partial(cached_video.get_annotations, process_outside_mask, width, height, annotator = preproc_outside)
 
     if preproc2 != None:
         proc_list2 = process_images_multithread(preproc2, proc_list, process_type2)
@@ -3991,14 +3839,19 @@ def preprocess_video_with_mask(input_video_path, input_mask_path, height, width,
             save_one_video("masks.mp4", saved_masks, fps=target_fps, quality=8, macro_block_size=None)
     preproc = None
     preproc_outside = None
+    get_annotator_pool().offload()
     gc.collect()
     torch.cuda.empty_cache()
 
     return torch.stack(masked_frames), torch.stack(masks) if any_mask else None
 
-def preprocess_video(height, width, video_in, max_frames, start_frame=0, fit_canvas = None, target_fps = 16, block_size = 16):
+@profiler.trace("video preprocessing")
+def preprocess_video(height, width, video_in, max_frames, start_frame=0, fit_canvas = None, target_fps = 16, block_size = 16, frame_cache = None):
 
-    frames_list = get_resampled_video(video_in, start_frame, max_frames, target_fps)
+    if frame_cache is not None:
+        frames_list = frame_cache.get_video(video_in, start_frame, max_frames, target_fps)
+    else:
+        frames_list = get_resampled_video(video_in, start_frame, max_frames, target_fps)
 
     if len(frames_list) == 0:
         return None
@@ -4007,7 +3860,7 @@ def preprocess_video(height, width, video_in, max_frames, start_frame=0, fit_can
         new_height = height
         new_width = width
     else:
-        frame_height, frame_width, _ = frames_list[0].shape
+        frame_height, frame_width, _ = frames_list.get_frame_shape() if frame_cache is not None else frames_list[0].shape
         if fit_canvas :
             scale1  = min(height / frame_height, width /  frame_width)
             scale2  = min(height / frame_width, width /  frame_height)
@@ -4018,23 +3871,18 @@ def preprocess_video(height, width, video_in, max_frames, start_frame=0, fit_can
         new_height = (int(frame_height * scale) // block_size) * block_size
         new_width = (int(frame_width * scale) // block_size) * block_size
 
-    processed_frames_list = []
-    for frame in frames_list:
-        frame = Image.fromarray(np.clip(frame.cpu().numpy(), 0, 255).astype(np.uint8))
-        frame = frame.resize((new_width,new_height), resample=Image.Resampling.LANCZOS) 
-        processed_frames_list.append(frame)
-
-    np_frames = [np.array(frame) for frame in processed_frames_list]
+    resize_method = server_config.get("preprocessing_resize_method", "torch")
+    resize_device = server_config.get("preprocessing_device", "cpu")
+    if frame_cache is not None:
+        np_frames = frames_list.get_resized_frames(new_width, new_height, method = resize_method, device = resize_device, max_workers = get_preprocessing_workers())
+    else:
+        from wan.utils.utils import resize_frames
+        np_frames = resize_frames(frames_list, new_width, new_height, method = resize_method, device = resize_device, max_workers = get_preprocessing_workers())
 
     # from preprocessing.dwpose.pose import save_one_video
     # save_one_video("test.mp4", np_frames, fps=8, quality=8, macro_block_size=None)
 
-    torch_frames = []
-    for np_frame in np_frames:
-        torch_frame = torch.from_numpy(np_frame)
-        torch_frames.append(torch_frame)
-
-    return torch.stack(torch_frames) 
+    return torch.from_numpy(np_frames) 
 
 def update_loras_slists(trans, slists, num_inference_steps ):
     slists = [ expand_slist(slist, num_inference_steps ) if isinstance(slist, list) else slist for slist in slists ]
@@ -4086,6 +3934,7 @@ def parse_keep_frames_video_guide(keep_frames, video_length):
     return  frames, error
 
 
+@profiler.trace("temporal upsampling")
 def perform_temporal_upsampling(sample, previous_last_frame, temporal_upsampling, fps):
     exp = 0
     if temporal_upsampling == "rife2":
@@ -4098,16 +3947,17 @@ def perform_temporal_upsampling(sample, previous_last_frame, temporal_upsampling
         if previous_last_frame != None:
             sample = torch.cat([previous_last_frame, sample], dim=1)
             previous_last_frame = sample[:, -1:].clone()
-            sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device)
+            sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device, batch_size = server_config.get("rife_batch_size", 8))
             sample = sample[:, 1:]
         else:
-            sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device)
+            sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device, batch_size = server_config.get("rife_batch_size", 8))
             previous_last_frame = sample[:, -1:].clone()
 
         output_fps = output_fps * 2**exp
     return sample, previous_last_frame, output_fps 
 
 
+@profiler.trace("spatial upsampling")
 def perform_spatial_upsampling(sample, spatial_upsampling):
     from wan.utils.utils import resize_lanczos 
     if spatial_upsampling == "lanczos1.5":
@@ -4249,6 +4099,9 @@ def edit_video(
         any_change = True
     else:
         video_path = video_source
+    # frames already in memory are given to MMAudio so that the video doesn't need to be decoded again
+    mmaudio_frames = tensor_to_video_frames(sample) if any_mmaudio and sample is not None else None
+    sample = None
 
     repeat_no = 0
     extra_generation = 0
@@ -4268,7 +4121,7 @@ def edit_video(
             send_cmd("progress", [0, get_latest_status(state,"MMAudio Soundtrack Generation")])
             from postprocessing.mmaudio.mmaudio import video_to_audio
             new_video_path = get_available_filename(save_path, video_source, suffix)
-            video_to_audio(video_path, prompt = MMAudio_prompt, negative_prompt = MMAudio_neg_prompt, seed = seed, num_steps = 25, cfg_strength = 4.5, duration= frames_count /output_fps, video_save_path = new_video_path , persistent_models = server_config.get("mmaudio_enabled", 0) == 2, verboseLevel = verbose_level)
+            video_to_audio(video_path, prompt = MMAudio_prompt, negative_prompt = MMAudio_neg_prompt, seed = seed, num_steps = 25, cfg_strength = 4.5, duration= frames_count /output_fps, video_save_path = new_video_path , persistent_models = True, verboseLevel = verbose_level, frames = mmaudio_frames, fps = output_fps)
             configs["MMAudio_setting"] = MMAudio_setting
             configs["MMAudio_prompt"] = MMAudio_prompt
             configs["MMAudio_neg_prompt"] = MMAudio_neg_prompt
@@ -4301,6 +4154,106 @@ def edit_video(
         cleanup_temp_audio_files(audio_tracks)
     clear_status(state)
 
+@profiler.trace("output save")
+def stream_output_video(chunks, file_path, fps):
+    # the decoded chunks are converted and encoded by the writer thread while the next ones are decoded
+    from wan.utils.utils import stream_video
+    frames_count = 0
+    def count_frames(chunks):
+        nonlocal frames_count
+        for chunk in chunks:
+            frames_count += chunk.shape[1]
+            yield chunk
+    stream_video(count_frames(chunks), file_path, fps = fps)
+    return frames_count
+
+def save_generated_output(state, send_cmd, sample, video_path, configs, is_image, extension, output_fps, fps, seed, time_flag, control_audio_tracks, source_audio, merged_audio_data, audio_sampling_rate, any_mmaudio, MMAudio_prompt, MMAudio_neg_prompt, verbose_level, streamed_file = None):
+    gen = get_gen_info(state)
+    file_list = gen["file_list"]
+    file_settings_list = gen["file_settings_list"]
+
+    try:
+        if is_image:
+            sample =  sample.permute(1,2,3,0)  #c f h w -> f h w c
+            new_video_path = []
+            for no, img in enumerate(sample):  
+                img = Image.fromarray((127.5 * (img + 1.0)).cpu().byte().numpy())
+                img_path = os.path.splitext(video_path)[0] + ("" if no==0 else f"_{no}") + ".jpg" 
+                new_video_path.append(img_path)
+                img.save(img_path)
+            video_path= new_video_path
+        elif len(control_audio_tracks) > 0 or source_audio != None or any_mmaudio or merged_audio_data is not None:
+            save_path_tmp = video_path[:-4] + "_tmp.mp4"
+            cache_video( tensor=sample[None], save_file=save_path_tmp, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1))
+            if len(control_audio_tracks) > 0:
+                combine_video_with_audio_tracks(save_path_tmp, control_audio_tracks, video_path )   
+            elif any_mmaudio:
+                from postprocessing.mmaudio.mmaudio import video_to_audio
+                video_to_audio(save_path_tmp, prompt = MMAudio_prompt, negative_prompt = MMAudio_neg_prompt, seed = seed, num_steps = 25, cfg_strength = 4.5, duration= sample.shape[1] /fps, video_save_path = video_path, persistent_models = True, verboseLevel = verbose_level, frames = tensor_to_video_frames(sample), fps = output_fps)
+            else: 
+                if merged_audio_data is not None:
+                    import soundfile as sf
+                    output_audio_path = get_available_filename(save_path, f"tmp{time_flag}.wav" )
+                    sf.write(output_audio_path, merged_audio_data, audio_sampling_rate)                       
+                else:
+                    output_audio_path = None
+                final_command = [ "ffmpeg", "-y", "-i", save_path_tmp, "-i", source_audio if output_audio_path == None else output_audio_path, "-c:v", "libx264", "-c:a", "aac", "-shortest", "-loglevel", "warning", "-nostats", video_path, ]
+                import subprocess
+                subprocess.run(final_command, check=True)
+                if output_audio_path != None: os.remove(output_audio_path) 
+            os.remove(save_path_tmp)
+        elif streamed_file is not None:
+            os.replace(streamed_file, video_path)
+        else:
+            cache_video( tensor=sample[None], save_file=video_path, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1))
+
+        metadata_choice = server_config.get("metadata_type","metadata")
+        video_path = [video_path] if not isinstance(video_path, list) else video_path
+        for no, path in enumerate(video_path): 
+            if metadata_choice == "json":
+                with open(path.replace(f'.{extension}', '.json'), 'w') as f:
+                    json.dump(configs, f, indent=4)
+            elif metadata_choice == "metadata":
+                if is_image:
+                    with Image.open(path) as img:
+                        img.save(path, comment=json.dumps(configs))
+                else:
+                    from mutagen.mp4 import MP4
+                    file = MP4(path)
+                    file.tags['©cmt'] = [json.dumps(configs)]
+                    file.save()
+            if is_image:
+                print(f"New image saved to Path: "+ path)
+            else:
+                print(f"New video saved to Path: "+ path)
+            with lock:
+                file_list.append(path)
+                file_settings_list.append(configs if no > 0 else configs.copy())
+
+        # Play notification sound for single video
+        try:
+            if server_config.get("notification_sound_enabled", 1):
+                volume = server_config.get("notification_sound_volume", 50)
+                notification_sound.notify_video_completion(
+                    video_path=video_path, 
+                    volume=volume
+                )
+        except Exception as e:
+            print(f"Error playing notification sound for individual video: {e}")
+    except Exception as e:
+        gen.get("output_send_cmd", send_cmd)("info", f"Unable to save '{video_path}': {e}")
+        raise
+
+    # the task that produced this output may be over, notify the one currently processed
+    gen.get("output_send_cmd", send_cmd)("output")
+
+def cleanup_generation_files(control_audio_tracks, temp_filenames_list):
+    if len(control_audio_tracks) > 0:
+        cleanup_temp_audio_files(control_audio_tracks)
+    for temp_filename in temp_filenames_list: 
+        if temp_filename!= None and os.path.isfile(temp_filename):
+            os.remove(temp_filename)
+
 def get_transformer_loras(model_type):
     model_def = get_model_def(model_type)
     transformer_loras_filenames = get_model_recursive_prop(model_type, "loras", return_list=True)
@@ -4391,11 +4344,6 @@ def generate_video(
     model_filename,
     mode,
 ):
-    
-    def remove_temp_filenames(temp_filenames_list):
-        for temp_filename in temp_filenames_list: 
-            if temp_filename!= None and os.path.isfile(temp_filename):
-                os.remove(temp_filename)
 
     process_map_outside_mask = { "Y" : "depth", "W": "scribble", "X": "inpaint", "Z": "flow"}
     process_map_video_guide = { "P": "pose", "D" : "depth", "S": "scribble", "E": "canny", "L": "flow", "C": "gray", "M": "inpaint", "U": "identity"}
@@ -4659,6 +4607,9 @@ def generate_video(
     trans.enable_cache = None if len(skip_steps_cache_type) == 0 else skip_steps_cache_type
     if trans2 is not None:
         trans2.enable_cache = None
+    # keeping the text embeddings and cross attention K/V of all the blocks costs a few hundred MB of VRAM, off by default with the low VRAM profiles
+    for model in [trans, trans2]:
+        if model is not None: model.use_cond_cache = server_config.get("conditioning_cache", 1 if profile in (1, 3) else 0) == 1
 
     if trans.enable_cache != None:
         trans.cache_multiplier = skip_steps_multiplier
@@ -4714,6 +4665,7 @@ def generate_video(
     audio_context_lens = None
     if (fantasy or multitalk or hunyuan_avatar or hunyuan_custom_audio) and audio_guide != None:
         from wan.fantasytalking.infer import parse_audio
+        get_audio_encoder_service()
         import librosa
         duration = librosa.get_duration(path=audio_guide)
         combination_type = "add"
@@ -4757,8 +4709,11 @@ def generate_video(
     abort = False
     if gen.get("abort", False):
         return 
+    # decoded / resized frames of the control videos are shared by all the windows and repeats of this task
+    frame_cache = get_video_frame_cache()
     # gen["abort"] = False
     gen["prompt"] = prompt    
+    gen["streaming_output"] = False
     repeat_no = 0
     extra_generation = 0
     initial_total_windows = 0
@@ -4803,6 +4758,7 @@ def generate_video(
         num_frames_generated = 0 # num of new frames created (lower than the number of frames really processed due to overlaps and discards)
         requested_frames_to_generate = default_requested_frames_to_generate # num  of num frames to create (if any source window this num includes also the overlapped source window frames)
         start_time = time.time()
+        profile_start = time.perf_counter()
         if prompt_enhancer_image_caption_model != None and prompt_enhancer !=None and len(prompt_enhancer)>0:
             text_encoder_max_tokens = 256
             send_cmd("progress", [0, get_latest_status(state, "Enhancing Prompt")])
@@ -4887,7 +4843,7 @@ def generate_video(
                     pre_video_guide =  prefix_video
                     image_start = None
                 else:
-                    prefix_video  = preprocess_video(width=width, height=height,video_in=video_source, max_frames= parsed_keep_frames_video_source , start_frame = 0, fit_canvas= sample_fit_canvas, target_fps = fps, block_size = 32 if ltxv else 16)
+                    prefix_video  = preprocess_video(width=width, height=height,video_in=video_source, max_frames= parsed_keep_frames_video_source , start_frame = 0, fit_canvas= sample_fit_canvas, target_fps = fps, block_size = 32 if ltxv else 16, frame_cache = frame_cache)
                     prefix_video  = prefix_video.permute(3, 0, 1, 2)
                     prefix_video  = prefix_video.float().div_(127.5).sub_(1.) # c, f, h, w
                     pre_video_guide =  prefix_video[:, -reuse_frames:]
@@ -4910,7 +4866,7 @@ def generate_video(
                 status_info = "Extracting " + processes_names[preprocess_type]
                 send_cmd("progress", [0, get_latest_status(state, status_info)])
                 # start one frame ealier to faciliate latents merging later
-                src_video, _ = preprocess_video_with_mask(video_guide, video_mask, height=image_size[0], width = image_size[1], max_frames= len(keep_frames_parsed) + (0 if guide_start_frame == 0 else 1), start_frame = guide_start_frame - (0 if guide_start_frame == 0 else 1), fit_canvas = sample_fit_canvas, target_fps = fps,  process_type = preprocess_type, inpaint_color = 0, proc_no =1, negate_mask = "N" in video_prompt_type, process_outside_mask = "inpaint" if "X" in video_prompt_type else "identity", block_size =32 )
+                src_video, _ = preprocess_video_with_mask(video_guide, video_mask, height=image_size[0], width = image_size[1], max_frames= len(keep_frames_parsed) + (0 if guide_start_frame == 0 else 1), start_frame = guide_start_frame - (0 if guide_start_frame == 0 else 1), fit_canvas = sample_fit_canvas, target_fps = fps,  process_type = preprocess_type, inpaint_color = 0, proc_no =1, negate_mask = "N" in video_prompt_type, process_outside_mask = "inpaint" if "X" in video_prompt_type else "identity", block_size =32, frame_cache = frame_cache )
                 if src_video !=  None:
                     src_video = src_video[ :(len(src_video)-1)// latent_size * latent_size +1 ]
                     refresh_preview["video_guide"] = Image.fromarray(src_video[0].cpu().numpy())
@@ -4921,7 +4877,7 @@ def generate_video(
                         sample_fit_canvas = None
 
             if t2v and "G" in video_prompt_type:
-                video_guide_processed = preprocess_video(width = image_size[1], height=image_size[0], video_in=video_guide, max_frames= len(keep_frames_parsed), start_frame = guide_start_frame, fit_canvas= sample_fit_canvas, target_fps = fps)
+                video_guide_processed = preprocess_video(width = image_size[1], height=image_size[0], video_in=video_guide, max_frames= len(keep_frames_parsed), start_frame = guide_start_frame, fit_canvas= sample_fit_canvas, target_fps = fps, frame_cache = frame_cache)
                 if video_guide_processed == None:
                     src_video = pre_video_guide
                 else:
@@ -4953,9 +4909,9 @@ def generate_video(
                     if preprocess_type2 is not None:
                             context_scale = [ control_net_weight /2, control_net_weight2 /2]
                     send_cmd("progress", [0, get_latest_status(state, status_info)])
-                    video_guide_processed, video_mask_processed = preprocess_video_with_mask(video_guide, video_mask, height=image_size[0], width = image_size[1], max_frames= len(keep_frames_parsed) , start_frame = guide_start_frame, fit_canvas = sample_fit_canvas, target_fps = fps,  process_type = preprocess_type, expand_scale = mask_expand, RGB_Mask = True, negate_mask = "N" in video_prompt_type, process_outside_mask = process_outside_mask, outpainting_dims = outpainting_dims, proc_no =1 )
+                    video_guide_processed, video_mask_processed = preprocess_video_with_mask(video_guide, video_mask, height=image_size[0], width = image_size[1], max_frames= len(keep_frames_parsed) , start_frame = guide_start_frame, fit_canvas = sample_fit_canvas, target_fps = fps,  process_type = preprocess_type, expand_scale = mask_expand, RGB_Mask = True, negate_mask = "N" in video_prompt_type, process_outside_mask = process_outside_mask, outpainting_dims = outpainting_dims, proc_no =1, frame_cache = frame_cache )
                     if preprocess_type2 != None:
-                        video_guide_processed2, video_mask_processed2 = preprocess_video_with_mask(video_guide, video_mask, height=image_size[0], width = image_size[1], max_frames= len(keep_frames_parsed), start_frame = guide_start_frame, fit_canvas = sample_fit_canvas, target_fps = fps,  process_type = preprocess_type2, expand_scale = mask_expand, RGB_Mask = True, negate_mask = "N" in video_prompt_type, process_outside_mask = process_outside_mask, outpainting_dims = outpainting_dims, proc_no =2 )
+                        video_guide_processed2, video_mask_processed2 = preprocess_video_with_mask(video_guide, video_mask, height=image_size[0], width = image_size[1], max_frames= len(keep_frames_parsed), start_frame = guide_start_frame, fit_canvas = sample_fit_canvas, target_fps = fps,  process_type = preprocess_type2, expand_scale = mask_expand, RGB_Mask = True, negate_mask = "N" in video_prompt_type, process_outside_mask = process_outside_mask, outpainting_dims = outpainting_dims, proc_no =2, frame_cache = frame_cache )
 
                     if video_guide_processed != None:
                         if sample_fit_canvas != None:
@@ -4999,7 +4955,7 @@ def generate_video(
                     progress_args = [0, get_latest_status(state,"Extracting Video and Mask")]
 
                 send_cmd("progress", progress_args)
-                src_video, src_mask = preprocess_video_with_mask(video_guide,  video_mask, height=height, width = width, max_frames= current_video_length if window_no == 1 else current_video_length - reuse_frames, start_frame = guide_start_frame, fit_canvas = sample_fit_canvas, target_fps = fps, process_type= "pose" if "P" in video_prompt_type else "inpaint", negate_mask = "N" in video_prompt_type, inpaint_color =0)
+                src_video, src_mask = preprocess_video_with_mask(video_guide,  video_mask, height=height, width = width, max_frames= current_video_length if window_no == 1 else current_video_length - reuse_frames, start_frame = guide_start_frame, fit_canvas = sample_fit_canvas, target_fps = fps, process_type= "pose" if "P" in video_prompt_type else "inpaint", negate_mask = "N" in video_prompt_type, inpaint_color =0, frame_cache = frame_cache)
                 refresh_preview["video_guide"] = Image.fromarray(src_video[0].cpu().numpy()) 
                 if src_mask != None:                        
                     refresh_preview["video_mask"] = Image.fromarray(src_mask[0].cpu().numpy())
@@ -5030,7 +4986,15 @@ def generate_video(
             # samples = torch.empty( (1,2)) #for testing
             # if False:
             
+            # when nothing needs the full video afterwards, the decoded frames are encoded into a file as they are produced
+            stream_file = None
+            if server_config.get("stream_vae_decode", 1) == 1 and not (sliding_window or is_image or prefix_video != None or len(temporal_upsampling) > 0 or len(spatial_upsampling) > 0 or film_grain_intensity > 0 \
+                or len(control_audio_tracks) > 0 or source_audio != None or merged_audio_data is not None or MMAudio_setting != 0):
+                stream_file = os.path.join(save_path, f"tmp_stream_{os.getpid()}_{time.time_ns()}.mp4")
+            gen["streaming_output"] = stream_file is not None
+
             try:
+                generation_span = profiler.begin("generation", window_no = window_no)
                 samples = wan_model.generate(
                     input_prompt = prompt,
                     image_start = image_start,  
@@ -5059,6 +5023,7 @@ def generate_video(
                     callback=callback,
                     enable_RIFLEx = enable_RIFLEx,
                     VAE_tile_size = VAE_tile_size,
+                    VAE_tile_batch_size = server_config.get("vae_tile_batch_size", 1),
                     joint_pass = joint_pass,
                     slg_layers = slg_layers,
                     slg_start = slg_start_perc/100,
@@ -5093,11 +5058,11 @@ def generate_video(
                     image_mode =  image_mode,
                     video_prompt_type= video_prompt_type,
                     offloadobj = offloadobj,
+                    output_stream = None if stream_file is None else lambda chunks: stream_output_video(chunks, stream_file, fps),
                 )
             except Exception as e:
-                if len(control_audio_tracks) > 0:
-                    cleanup_temp_audio_files(control_audio_tracks)
-                remove_temp_filenames(temp_filenames_list)
+                if stream_file is not None and os.path.isfile(stream_file): os.remove(stream_file)
+                output_pipeline.submit(cleanup_generation_files, control_audio_tracks, temp_filenames_list)
                 offloadobj.unload_all()
                 offload.unload_loras_from_model(trans)
                 if trans2 is not None: offload.unload_loras_from_model(trans2) 
@@ -5126,19 +5091,28 @@ def generate_video(
                 print('\n'.join(tb))
                 send_cmd("error", new_error)
                 clear_status(state)
+                if frame_cache is not None: frame_cache.release()
+                # the windows of this repeat already submitted may still be saving from the buffer
+                if frames_already_processed is not None: output_pipeline.submit(frames_already_processed.release)
                 return
             finally:
+                profiler.end(generation_span)
                 trans.previous_residual = None
                 trans.previous_modulated_input = None
+                for model in [trans, trans2]:
+                    if hasattr(model, "enable_cond_cache"): model.enable_cond_cache(False)
 
             if trans.enable_cache != None :
                 print(f"Skipped Steps:{trans.cache_skipped_steps}/{trans.num_steps}" )
 
+            streamed_frames_count = None
             if samples != None:
                 if isinstance(samples, dict):
                     overlapped_latents = samples.get("latent_slice", None)
+                    streamed_frames_count = samples.get("streamed_frames_count", None)
                     samples= samples["x"]
-                samples = samples.to("cpu")
+                if samples != None: samples = samples.to("cpu")
+            if streamed_frames_count is None: stream_file = None
             offloadobj.unload_all()
             gc.collect()
             torch.cuda.empty_cache()
@@ -5149,12 +5123,13 @@ def generate_video(
             # sample = samples.cpu()
             # cache_video( tensor=sample[None].clone(), save_file=os.path.join(save_path, file_name), fps=16, nrow=1, normalize=True, value_range=(-1, 1))
 
-            if samples == None:
+            if samples == None and stream_file is None:
                 abort = True
                 state["prompt"] = ""
                 send_cmd("output")  
             else:
-                sample = samples.cpu()
+                # the frames of a streamed output are already in stream_file
+                sample = samples.cpu() if samples != None else None
                 # if True: # for testing
                 #     torch.save(sample, "output.pt")
                 # else:
@@ -5187,6 +5162,7 @@ def generate_video(
                 if len(temporal_upsampling) > 0 or len(spatial_upsampling) > 0:                
                     send_cmd("progress", [0, get_latest_status(state,"Upsampling")])
                 
+                frames_count_before_upsampling = sample.shape[1] if sample != None else streamed_frames_count
                 output_fps  = fps
                 if len(temporal_upsampling) > 0:
                     sample, previous_last_frame, output_fps = perform_temporal_upsampling(sample, previous_last_frame if sliding_window and window_no > 1 else None, temporal_upsampling, fps)
@@ -5198,10 +5174,11 @@ def generate_video(
                     sample = add_film_grain(sample, film_grain_intensity, film_grain_saturation) 
                 if sliding_window :
                     if frames_already_processed == None:
-                        frames_already_processed = sample
-                    else:
-                        sample = torch.cat([frames_already_processed, sample], dim=1)
-                    frames_already_processed = sample
+                        # sized for all the windows to come, so that each window is written in place instead of concatenated
+                        frames_left = max(requested_frames_to_generate - num_frames_generated, 0) * sample.shape[1] / max(frames_count_before_upsampling, 1)
+                        frames_already_processed = get_frame_buffer(sample.shape[1] + math.ceil(frames_left))
+                    frames_already_processed.append(sample)
+                    sample = frames_already_processed.get_frames()
 
                 time_flag = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss")
                 save_prompt = original_prompts[0]
@@ -5216,39 +5193,6 @@ def generate_video(
                 video_path = os.path.join(save_path, file_name)
                 any_mmaudio = MMAudio_setting != 0 and server_config.get("mmaudio_enabled", 0) != 0 and sample.shape[1] >=fps
 
-                if is_image:
-                    sample =  sample.permute(1,2,3,0)  #c f h w -> f h w c
-                    new_video_path = []
-                    for no, img in enumerate(sample):  
-                        img = Image.fromarray((127.5 * (img + 1.0)).cpu().byte().numpy())
-                        img_path = os.path.splitext(video_path)[0] + ("" if no==0 else f"_{no}") + ".jpg" 
-                        new_video_path.append(img_path)
-                        img.save(img_path)
-                    video_path= new_video_path
-                elif len(control_audio_tracks) > 0 or source_audio != None or any_mmaudio or merged_audio_data is not None:
-                    save_path_tmp = video_path[:-4] + "_tmp.mp4"
-                    cache_video( tensor=sample[None], save_file=save_path_tmp, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1))
-                    if len(control_audio_tracks) > 0:
-                        combine_video_with_audio_tracks(save_path_tmp, control_audio_tracks, video_path )   
-                    elif any_mmaudio:
-                        send_cmd("progress", [0, get_latest_status(state,"MMAudio Soundtrack Generation")])
-                        from postprocessing.mmaudio.mmaudio import video_to_audio
-                        video_to_audio(save_path_tmp, prompt = MMAudio_prompt, negative_prompt = MMAudio_neg_prompt, seed = seed, num_steps = 25, cfg_strength = 4.5, duration= sample.shape[1] /fps, video_save_path = video_path, persistent_models = server_config.get("mmaudio_enabled", 0) == 2, verboseLevel = verbose_level)
-                    else: 
-                        if merged_audio_data is not None:
-                            import soundfile as sf
-                            output_audio_path = get_available_filename(save_path, f"tmp{time_flag}.wav" )
-                            sf.write(output_audio_path, merged_audio_data, audio_sampling_rate)                       
-                        else:
-                            output_audio_path = None
-                        final_command = [ "ffmpeg", "-y", "-i", save_path_tmp, "-i", source_audio if output_audio_path == None else output_audio_path, "-c:v", "libx264", "-c:a", "aac", "-shortest", "-loglevel", "warning", "-nostats", video_path, ]
-                        import subprocess
-                        subprocess.run(final_command, check=True)
-                        if output_audio_path != None: os.remove(output_audio_path) 
-                    os.remove(save_path_tmp)
-                else:
-                    cache_video( tensor=sample[None], save_file=video_path, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1))
-
                 end_time = time.time()
 
                 inputs = get_function_arguments(generate_video, locals())
@@ -5270,53 +5214,36 @@ def generate_video(
                 if prompt_enhancer_image_caption_model != None and prompt_enhancer !=None and len(prompt_enhancer)>0:
                     configs["enhanced_prompt"] = "\n".join(prompts)
                 configs["generation_time"] = round(end_time-start_time)
+                # the "output save" / mmaudio spans run after the metadata is built, they are only in the Chrome trace
+                if profiler.enabled: configs["profile"] = profiler.get_summary(since = profile_start)
                 # if is_image: configs["is_image"] = True
-                metadata_choice = server_config.get("metadata_type","metadata")
-                video_path = [video_path] if not isinstance(video_path, list) else video_path
-                for no, path in enumerate(video_path): 
-                    if metadata_choice == "json":
-                        with open(path.replace(f'.{extension}', '.json'), 'w') as f:
-                            json.dump(configs, f, indent=4)
-                    elif metadata_choice == "metadata":
-                        if is_image:
-                            with Image.open(path) as img:
-                                img.save(path, comment=json.dumps(configs))
-                        else:
-                            from mutagen.mp4 import MP4
-                            file = MP4(path)
-                            file.tags['©cmt'] = [json.dumps(configs)]
-                            file.save()
-                    if is_image:
-                        print(f"New image saved to Path: "+ path)
-                    else:
-                        print(f"New video saved to Path: "+ path)
-                    with lock:
-                        file_list.append(path)
-                        file_settings_list.append(configs if no > 0 else configs.copy())
-                    
-                # Play notification sound for single video
-                try:
-                    if server_config.get("notification_sound_enabled", 1):
-                        volume = server_config.get("notification_sound_volume", 50)
-                        notification_sound.notify_video_completion(
-                            video_path=video_path, 
-                            volume=volume
-                        )
-                except Exception as e:
-                    print(f"Error playing notification sound for individual video: {e}")
-
-                send_cmd("output")
 
+                # encoding, muxing and metadata are done by the output pipeline so that the next generation can start
+                if any_mmaudio and output_pipeline.max_pending == 0:
+                    send_cmd("progress", [0, get_latest_status(state,"MMAudio Soundtrack Generation")])
+                output_future = output_pipeline.submit(save_generated_output, state, send_cmd, sample, video_path, configs, is_image = is_image, extension = extension, output_fps = output_fps, fps = fps, seed = seed, time_flag = time_flag,
+                                        control_audio_tracks = control_audio_tracks, source_audio = source_audio, merged_audio_data = merged_audio_data, audio_sampling_rate = audio_sampling_rate,
+                                        any_mmaudio = any_mmaudio, MMAudio_prompt = MMAudio_prompt, MMAudio_neg_prompt = MMAudio_neg_prompt, verbose_level = verbose_level, streamed_file = stream_file)
+                if any_mmaudio and output_future is not None:
+                    # MMAudio needs the GPU, it can't run concurrently with the next generation
+                    send_cmd("progress", [0, get_latest_status(state,"MMAudio Soundtrack Generation")])
+                    output_error = output_future.exception()
+                    if output_error is not None: raise output_error
+                sample = None
+
+        # the pipeline is FIFO: the buffer of this repeat is released once its last window has been saved
+        if frames_already_processed is not None:
+            output_pipeline.submit(frames_already_processed.release)
+            frames_already_processed = None
         seed = set_seed(-1)
     clear_status(state)
+    if frame_cache is not None: frame_cache.release()
     offload.unload_loras_from_model(trans)
     if not trans2 is None:
         offload.unload_loras_from_model(trans2)
 
-    if len(control_audio_tracks) > 0:
-        cleanup_temp_audio_files(control_audio_tracks)
-
-    remove_temp_filenames(temp_filenames_list)
+    # queued after the outputs of this task, as they may still need the audio tracks
+    output_pipeline.submit(cleanup_generation_files, control_audio_tracks, temp_filenames_list)
 
 def prepare_generate_video(state):    
 
@@ -5608,6 +5535,8 @@ def process_tasks(state):
     gen["preview"] = None
     gen["status"] = "Generating Video"
     yield time.time(), time.time() 
+    profiler.enabled = server_config.get("profiler_enabled", 0) == 1
+    profiler.reset()
     prompt_no = 0
     while len(queue) > 0:
         prompt_no += 1
@@ -5618,9 +5547,14 @@ def process_tasks(state):
 
         com_stream = AsyncStream()
         send_cmd = com_stream.output_queue.push
+        gen["output_send_cmd"] = send_cmd
         def generate_video_error_handler():
             try:
-                generate_video(task, send_cmd,  **params)
+                # only the generation thread tracks the VRAM peaks, the output pipeline would reset them under its feet
+                profiler.memory_thread = threading.get_ident()
+                with profiler.span("task", cat = "task", task_id = task_id):
+                    load_queued_images(params)
+                    generate_video(task, send_cmd,  **params)
             except Exception as e:
                 tb = traceback.format_exc().split('\n')[:-1] 
                 print('\n'.join(tb))
@@ -5671,6 +5605,22 @@ def process_tasks(state):
         queue[:] = [item for item in queue if item['id'] != task['id']]
         update_global_queue_ref(queue)
 
+    if not output_pipeline.wait(0):
+        gen["status"] = "Saving Outputs"
+        yield time.time() , gr.Text()
+        output_pipeline.wait()
+    gen.pop("output_send_cmd", None)
+    release_mmaudio_if_needed()
+    if profiler.enabled:
+        trace_dir = server_config.get("profiler_trace_dir", os.path.join(save_path, "traces"))
+        trace_path = os.path.join(trace_dir, datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss") + "_trace.json")
+        try:
+            profiler.export_chrome_trace(trace_path)
+            print(f"Profiler trace saved to {trace_path}")
+        except Exception as e:
+            print(f"Unable to save the profiler trace: {e}")
+    yield time.time() , time.time() 
+
     gen["prompts_max"] = 0
     gen["prompt"] = ""
     end_time = time.time()
@@ -5775,6 +5725,9 @@ def one_more_sample(state):
 
 def one_more_window(state):
     gen = get_gen_info(state)
+    if gen.get("in_progress", False) and gen.get("streaming_output", False):
+        gr.Info("This video is written to its file while it is decoded, so no window can be added to it")
+        return state
     extra_windows = gen.get("extra_windows", 0)
     extra_windows += 1
     gen["extra_windows"]= extra_windows
@@ -6773,6 +6726,13 @@ def preload_model_when_switching(state):
         return   
     return gr.Text()
 
+def release_mmaudio_if_needed(force = False):
+    # MMAudio stays loaded for the whole queue, it is only kept after the queue with the "persistent" option
+    if "postprocessing.mmaudio.mmaudio" not in sys.modules: return
+    if force or server_config.get("mmaudio_enabled", 0) != 2:
+        from postprocessing.mmaudio.mmaudio import release_model
+        release_model()
+
 def unload_model_if_needed(state):
     global reload_needed, wan_model, offloadobj
     if "U" in preload_model_policy:
@@ -6781,6 +6741,11 @@ def unload_model_if_needed(state):
             if offloadobj is not None:
                 offloadobj.release()
                 offloadobj = None
+            get_annotator_pool().release()
+            from postprocessing.rife.inference import rife_engine
+            rife_engine.release()
+            release_mmaudio_if_needed()
+            get_audio_encoder_service().release()
             gc.collect()
             reload_needed=  True
 